@@ -0,0 +1,9 @@
+"""
+Benchmarks for xrdp_local_session, run against local stand-ins for sesman,
+logind and xrdp_local (see tests/stand_ins), so they work on any Linux machine
+with dbus-daemon, dbus-python and PyGObject installed, without xrdp.
+
+Run each benchmark from the repository root, e.g.:
+
+	python -m benchmarks.login
+"""
@@ -0,0 +1,132 @@
+"""
+Helpers shared by the benchmarks: timing, output, and the stand-in
+environment.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import shutil
+import statistics
+import tempfile
+from types import TracebackType
+from typing import Any, Callable, NamedTuple, Optional
+
+from xrdp_local_session.common import xrdp
+
+from tests.stand_ins.fake_login1 import FakeLogin1, PrivateSystemBus
+from tests.stand_ins.fake_sesman import BIN_DIRECTORY, FakeSesman
+
+
+class Stats(NamedTuple):
+	minimum: float
+	median: float
+	maximum: float
+
+	@classmethod
+	def of(cls, samples: list[float]) -> Stats:
+		return cls(min(samples), statistics.median(samples), max(samples))
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Stats:
+	samples = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		samples.append(time.perf_counter() - start)
+	return Stats.of(samples)
+
+
+def format_seconds(seconds: float) -> str:
+	if seconds < 0.001:
+		return f"{seconds * 1_000_000:.0f}us"
+	if seconds < 1:
+		return f"{seconds * 1000:.1f}ms"
+	return f"{seconds:.2f}s"
+
+
+def print_table(title: str, header: list[str], rows: list[list[Any]]) -> None:
+	cells = [header] + [[format_seconds(cell) if isinstance(cell, float) else str(cell) for cell in row] for row in rows]
+	widths = [max(len(row[column]) for row in cells) for column in range(len(header))]
+	print(f"\n{title}")
+	for index, row in enumerate(cells):
+		print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+		if index == 0:
+			print("  ".join("-" * width for width in widths))
+
+
+class StandIns:
+	"""
+	Runs the fake login1 service on a private system bus and a fake sesman,
+	and points xrdp_local_session at them (and at the fake xrdp_local).
+
+	dbus-python keeps its system bus connection for the lifetime of the
+	process, so only one of these can be used per process. Between measurements
+	use reset() to start over with no sessions.
+	"""
+
+	def __init__(self) -> None:
+		self.directory = tempfile.mkdtemp(prefix="xrdp_local_session_benchmark_")
+		self._saved_environment: dict[str, Optional[str]] = {}
+		self._saved_socket_paths = list(xrdp.XRDP_SOCKET_PATHS)
+		self._bus: Optional[PrivateSystemBus] = None
+		self._login1: Optional[FakeLogin1] = None
+		self._sesman: Optional[FakeSesman] = None
+		self._generation = 0
+
+	@property
+	def login1(self) -> FakeLogin1:
+		assert self._login1 is not None
+		return self._login1
+
+	@property
+	def sesman(self) -> FakeSesman:
+		assert self._sesman is not None
+		return self._sesman
+
+	def setenv(self, name: str, value: str) -> None:
+		if name not in self._saved_environment:
+			self._saved_environment[name] = os.environ.get(name)
+		os.environ[name] = value
+
+	def __enter__(self) -> StandIns:
+		try:
+			self._bus = PrivateSystemBus(self.directory)
+			self.setenv("DBUS_SYSTEM_BUS_ADDRESS", self._bus.address)
+			self._login1 = FakeLogin1(self._bus.address)
+			self.setenv("PATH", BIN_DIRECTORY + os.pathsep + os.environ.get("PATH", os.defpath))
+			self.reset()
+		except BaseException:
+			self.__exit__(None, None, None)
+			raise
+		return self
+
+	def __exit__(self, exc_type: Optional[type[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> None:
+		if self._login1 is not None:
+			self._login1.close()
+		if self._bus is not None:
+			self._bus.close()
+		for name, value in self._saved_environment.items():
+			if value is None:
+				os.environ.pop(name, None)
+			else:
+				os.environ[name] = value
+		xrdp.XRDP_SOCKET_PATHS[:] = self._saved_socket_paths
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+	def reset(self, *, list_latency: float=0, launch_latency: float=0, connect_delay: float=0, run_time: float=0) -> None:
+		"""
+		Start over with no logind or sesman sessions, and the given stand-in
+		latencies.
+		"""
+		self.login1.reset()
+		self._generation += 1
+		sesman_directory = os.path.join(self.directory, f"sesman{self._generation}")
+		os.makedirs(sesman_directory)
+		self._sesman = FakeSesman(sesman_directory, list_latency=list_latency, launch_latency=launch_latency)
+		self.setenv("FAKE_SESMAN_STATE", self._sesman.state_path)
+		self.setenv("FAKE_XRDP_LOCAL_CONNECT_DELAY", str(connect_delay))
+		self.setenv("FAKE_XRDP_LOCAL_RUN_TIME", str(run_time))
+		xrdp.XRDP_SOCKET_PATHS[:] = [self._sesman.socket_path_layout]
+		xrdp._known_socket_path_layout = None
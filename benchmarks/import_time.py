@@ -0,0 +1,87 @@
+"""
+Import time of the entry points that run on every login and logout, and a
+guard that they don't import dbus, PyGObject or psutil up front: those are
+only loaded by the features that need them.
+
+Exits with a non-zero status if any of the entry points imports one of them.
+"""
+
+from __future__ import annotations
+
+import sys
+import subprocess
+from typing import NamedTuple
+
+import typer
+
+from .common import Stats, print_table
+
+ENTRY_POINTS = [
+	"xrdp_local_session.session",
+	"xrdp_local_session.session_closer",
+]
+
+# Top-level packages the entry points must not import when loaded
+DEFERRED_PACKAGES = ["dbus", "_dbus_bindings", "gi", "psutil"]
+
+
+class ImportTimes(NamedTuple):
+	total: float
+	# Self time of each module, in seconds
+	modules: dict[str, float]
+
+
+def import_times(module: str) -> ImportTimes:
+	result = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", f"import {module}"],
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.PIPE,
+		encoding="utf-8",
+		check=True,
+	)
+	modules = {}
+	total = 0.0
+	for line in result.stderr.splitlines():
+		# import time: self [us] | cumulative | imported package
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+		self_time, cumulative, name = line[len("import time:"):].split("|")
+		name = name.rstrip()
+		modules[name.strip()] = int(self_time) / 1_000_000
+		if not name.startswith("  "):
+			total += int(cumulative) / 1_000_000
+	return ImportTimes(total, modules)
+
+
+def typer_main(
+	repeat: int = typer.Option(5, "-n", "--repeat", help="Imports per entry point"),
+	top: int = typer.Option(3, "-t", "--top", help="Slowest modules to list per entry point"),
+) -> None:
+	"""
+	Measure the import time of the entry points and check what they import.
+	"""
+	rows = []
+	violations = []
+	for module in ENTRY_POINTS:
+		samples = [import_times(module) for _ in range(repeat)]
+		imported = samples[0].modules
+		for package in DEFERRED_PACKAGES:
+			if package in imported:
+				violations.append(f"{module} imports {package}")
+		slowest = sorted(imported, key=lambda name: Stats.of([sample.modules.get(name, 0) for sample in samples]).median, reverse=True)[:top]
+		rows.append([module, Stats.of([sample.total for sample in samples]).median, ", ".join(slowest)])
+	print_table("Import time (median)", ["module", "total", "slowest modules"], rows)
+
+	if len(violations) > 0:
+		print("\nModules that should only be imported when needed:", file=sys.stderr)
+		for violation in violations:
+			print(f"  {violation}", file=sys.stderr)
+		raise typer.Exit(1)
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,161 @@
+"""
+End-to-end login latency: Main.run against the stand-ins, with the per-stage
+breakdown from the timing spans, and how both scale with the number of sesman
+sessions, of logind sessions of the user, and of processes in a display
+manager session checked by the wrong session workaround.
+
+The xrdp_local stand-in is a Python script, so the xrdp_local.* stages mostly
+measure interpreter startup rather than anything of ours.
+"""
+
+from __future__ import annotations
+
+import os
+import pwd
+import json
+import time
+import logging
+import subprocess
+from typing import Any, Callable, Optional
+
+import typer
+import psutil
+
+from xrdp_local_session import timing
+from xrdp_local_session.config import Settings
+from xrdp_local_session.session import Main
+
+from .common import StandIns, Stats, print_table
+
+USERNAME = pwd.getpwuid(os.getuid()).pw_name
+DISPLAY = 10
+
+
+class LoginResult:
+	def __init__(self) -> None:
+		self.end_to_end: list[float] = []
+		self.stages: dict[str, list[float]] = {}
+
+	def add(self, end_to_end: float, record: dict) -> None:
+		self.end_to_end.append(end_to_end)
+		durations: dict[str, float] = {}
+		for span in record["spans"]:
+			durations[span["name"]] = durations.get(span["name"], 0) + span["duration"]
+		for name, duration in durations.items():
+			self.stages.setdefault(name, []).append(duration)
+
+	def median(self, stage: Optional[str]=None) -> Optional[float]:
+		samples = self.end_to_end if stage is None else self.stages.get(stage)
+		if not samples:
+			return None
+		return Stats.of(samples).median
+
+
+def measure_logins(stand_ins: StandIns, repeat: int, prepare: Callable[[], None], **settings: Any) -> LoginResult:
+	output = os.path.join(stand_ins.directory, "timing.jsonl")
+	measured_settings = Settings(timing_enabled=True, timing_output=output, **settings)
+	result = LoginResult()
+	for _ in range(repeat):
+		prepare()
+		if os.path.exists(output):
+			os.unlink(output)
+		timing.configure(measured_settings)
+		start = time.perf_counter()
+		Main(measured_settings).run()
+		end_to_end = time.perf_counter() - start
+		with open(output, "r") as f:
+			result.add(end_to_end, json.loads(f.readlines()[-1]))
+	return result
+
+
+def print_results(title: str, parameter: str, results: dict[int, LoginResult]) -> None:
+	stages: list[str] = []
+	for result in results.values():
+		stages += [stage for stage in result.stages if stage not in stages]
+	header = [parameter] + [str(value) for value in results]
+	rows = [["end to end"] + [result.median() for result in results.values()]]
+	for stage in stages:
+		medians = [result.median(stage) for result in results.values()]
+		rows.append([stage] + ["-" if median is None else median for median in medians])
+	print_table(title, header, rows)
+
+
+def existing_session(stand_ins: StandIns, sesman_sessions: int, logind_sessions: int) -> None:
+	stand_ins.reset()
+	# Ours is last, so the whole listing is read
+	stand_ins.sesman.add_sessions([(f"user{index}", 100 + index) for index in range(sesman_sessions - 1)])
+	stand_ins.sesman.add_session(USERNAME, DISPLAY)
+	stand_ins.login1.add_session("c1", os.getuid(), display=f":{DISPLAY}")
+	for index in range(logind_sessions - 1):
+		stand_ins.login1.add_session(f"tty{index}", os.getuid(), service="login", type="tty")
+
+
+def benchmark_sesman_sessions(stand_ins: StandIns, counts: list[int], repeat: int) -> None:
+	results = {}
+	for count in counts:
+		existing_session(stand_ins, count, 1)
+		results[count] = measure_logins(stand_ins, repeat, lambda: None)
+	print_results("Existing session, by number of sesman sessions", "sessions", results)
+
+
+def benchmark_new_session(stand_ins: StandIns, counts: list[int], repeat: int) -> None:
+	def prepare(count: int) -> None:
+		stand_ins.reset()
+		stand_ins.sesman.add_sessions([(f"user{index}", 100 + index) for index in range(count)])
+
+	results = {}
+	for count in counts:
+		results[count] = measure_logins(stand_ins, repeat, lambda: prepare(count))
+	print_results("New session, by number of other sesman sessions", "sessions", results)
+
+
+def benchmark_logind_sessions(stand_ins: StandIns, counts: list[int], repeat: int) -> None:
+	results = {}
+	for count in counts:
+		existing_session(stand_ins, 1, count)
+		results[count] = measure_logins(stand_ins, repeat, lambda: None)
+	print_results("Existing session, by number of logind sessions of the user", "sessions", results)
+
+
+def benchmark_processes(stand_ins: StandIns, counts: list[int], repeat: int) -> None:
+	results = {}
+	for count in counts:
+		existing_session(stand_ins, 1, 1)
+		# A display manager session whose leader has `count` descendants
+		leader = subprocess.Popen(["sh", "-c", f"for i in $(seq {count}); do sleep 600 & done; wait"], start_new_session=True)
+		try:
+			while len(psutil.Process(leader.pid).children()) < count:
+				time.sleep(0.01)
+			stand_ins.login1.add_session("c0", os.getuid(), service="sddm", display=":0", leader=leader.pid)
+			results[count] = measure_logins(stand_ins, repeat, lambda: None, xdg_wrong_session_workaround_enabled=True)
+		finally:
+			os.killpg(leader.pid, 15)
+			leader.wait()
+	print_results("Wrong session workaround, by number of processes in the display manager session", "processes", results)
+
+
+def typer_main(
+	repeat: int = typer.Option(10, "-n", "--repeat", help="Logins per measurement"),
+	quick: bool = typer.Option(False, "-q", "--quick", help="Only measure the smallest and largest sizes"),
+) -> None:
+	"""
+	Measure login latency against the stand-ins.
+	"""
+	logging.basicConfig(level=logging.WARNING)
+
+	def sizes(*values: int) -> list[int]:
+		return [values[0], values[-1]] if quick is True else list(values)
+
+	with StandIns() as stand_ins:
+		benchmark_sesman_sessions(stand_ins, sizes(1, 100, 1000, 5000), repeat)
+		benchmark_new_session(stand_ins, sizes(0, 1000), repeat)
+		benchmark_logind_sessions(stand_ins, sizes(1, 10, 50), repeat)
+		benchmark_processes(stand_ins, sizes(0, 100, 500), repeat)
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,133 @@
+"""
+Cost of finding the processes of display manager sessions for the wrong
+session workaround: one ProcessTable snapshot of /proc against the recursive
+psutil children() walk it replaced, on a synthetic /proc of a given size.
+
+psutil reads /proc from psutil.PROCFS_PATH, so the benchmark builds a tree of
+fake processes in a temporary directory and points it there.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+
+import typer
+import psutil
+
+from xrdp_local_session.common.process_table import ProcessTable
+
+from .common import measure, print_table
+
+FANOUT = 4
+FIRST_LEADER_PID = 1000
+
+
+def write_process(procfs: str, pid: int, ppid: int, name: str) -> None:
+	directory = os.path.join(procfs, str(pid))
+	os.mkdir(directory)
+	with open(os.path.join(directory, "stat"), "w") as f:
+		# Enough zero fields for everything psutil reads after the name
+		f.write(f"{pid} ({name}) S {ppid} " + " ".join(["0"] * 48) + "\n")
+	with open(os.path.join(directory, "cmdline"), "w") as f:
+		f.write(name + "\0")
+	with open(os.path.join(directory, "status"), "w") as f:
+		f.write(f"Name:\t{name}\nState:\tS (sleeping)\nPPid:\t{ppid}\nUid:\t0\t0\t0\t0\nGid:\t0\t0\t0\t0\n")
+
+
+def build_procfs(directory: str, processes: int, sessions: int, descendants: int) -> list[int]:
+	"""
+	Write a /proc with `processes` processes, `sessions` of which lead a
+	session with `descendants` descendants each, `FANOUT` children per process.
+	Return the pids of the session leaders.
+	"""
+	with open(os.path.join(directory, "stat"), "w") as f:
+		f.write("cpu  0 0 0 0 0 0 0 0 0 0\nbtime 1700000000\n")
+	write_process(directory, 1, 0, "systemd")
+	leaders = []
+	pid = FIRST_LEADER_PID
+	for _ in range(sessions):
+		leader = pid
+		leaders.append(leader)
+		write_process(directory, leader, 1, "sddm-helper")
+		for index in range(descendants):
+			pid += 1
+			write_process(directory, pid, leader + index // FANOUT, f"process{index % 50}")
+		pid += 1
+	for _ in range(processes - 1 - sessions * (descendants + 1)):
+		write_process(directory, pid, 1, "other")
+		pid += 1
+	return leaders
+
+
+def recursive_subprocess_names(pid: int) -> set[str]:
+	# What the workaround did before ProcessTable
+	try:
+		process = psutil.Process(pid)
+	except psutil.NoSuchProcess:
+		return set()
+	result = set()
+	for child in process.children():
+		result.add(child.name())
+		result |= recursive_subprocess_names(child.pid)
+	return result
+
+
+def clear_process_cache() -> None:
+	# process_iter() keeps Process objects, with their names, across calls.
+	# Each login runs in a new process, so measure without them (and they'd be
+	# stale after switching to another /proc).
+	if hasattr(psutil.process_iter, "cache_clear"):
+		psutil.process_iter.cache_clear()
+
+
+def table_subprocess_names(leaders: list[int]) -> list[set[str]]:
+	clear_process_cache()
+	process_table = ProcessTable.from_proc()
+	return [process_table.descendant_names(leader) for leader in leaders]
+
+
+def typer_main(
+	repeat: int = typer.Option(3, "-n", "--repeat", help="Measurements per size"),
+	quick: bool = typer.Option(False, "-q", "--quick", help="Only measure the smallest and largest sizes"),
+) -> None:
+	"""
+	Compare ProcessTable against the recursive children() walk.
+	"""
+	def sizes(*values: int) -> list[int]:
+		return [values[0], values[-1]] if quick is True else list(values)
+
+	configurations = [(processes, 1, 50) for processes in sizes(200, 1000, 3000)]
+	configurations += [(1000, 1, descendants) for descendants in sizes(10, 100, 300)]
+	configurations += [(1000, sessions, 50) for sessions in sizes(2, 5)]
+
+	saved_procfs_path = psutil.PROCFS_PATH
+	rows = []
+	for processes, sessions, descendants in configurations:
+		directory = tempfile.mkdtemp(prefix="xrdp_local_session_benchmark_procfs_")
+		try:
+			leaders = build_procfs(directory, processes, sessions, descendants)
+			psutil.PROCFS_PATH = directory
+			expected = [recursive_subprocess_names(leader) for leader in leaders]
+			assert table_subprocess_names(leaders) == expected
+			recursive = measure(lambda: [recursive_subprocess_names(leader) for leader in leaders], repeat)
+			table = measure(lambda: table_subprocess_names(leaders), repeat)
+		finally:
+			psutil.PROCFS_PATH = saved_procfs_path
+			clear_process_cache()
+			shutil.rmtree(directory, ignore_errors=True)
+		rows.append([processes, sessions, descendants, recursive.median, table.median, f"{recursive.median / table.median:.1f}x"])
+	print_table(
+		"Descendant names of display manager session leaders (median)",
+		["processes", "sessions", "descendants", "recursive children()", "ProcessTable", "speedup"],
+		rows,
+	)
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+
+if __name__ == "__main__":
+	main()
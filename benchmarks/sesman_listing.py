@@ -0,0 +1,138 @@
+"""
+Cost of reading the sesman session listing with thousands of sessions: the
+streaming SesmanClient.iter_sessions() against the buffered parse with
+uncompiled patterns and pydantic validation it replaced (see session_records
+for how it's validated), for the whole listing and for finding one user's
+session.
+
+The listing comes from the xrdp-sesadmin stand-in, a Python script, so its
+interpreter startup is part of every measurement. The parse columns leave it
+out by parsing a captured listing.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import re
+import pwd
+import shutil
+import tempfile
+import subprocess
+from typing import Iterator, Optional
+
+import typer
+
+from xrdp_local_session.common.xrdp import SesmanClient, XRDPSession, parse_session_listing
+
+from tests.stand_ins.fake_sesman import BIN_DIRECTORY, FakeSesman
+
+from .common import measure, print_table
+from .session_records import ValidatedXRDPSession, validate_session
+
+USERNAME = pwd.getpwuid(os.getuid()).pw_name
+
+
+def buffered_parse(output: str) -> list[ValidatedXRDPSession]:
+	# What get_sessions did before streaming
+	sessions = []
+	session_info: dict[str, str | int] = {}
+	for line in output.splitlines():
+		if r := re.match(r"^Session ID: (\d+)$", line):
+			if len(session_info) > 0:
+				sessions.append(validate_session(session_info))
+			session_info = {"session_id": int(r.group(1))}
+		elif r := re.match(r"^\s*Display: :(\d+)$", line):
+			session_info["display"] = int(r.group(1))
+		elif r := re.match(r"^\s*User: (.+)$", line):
+			session_info["username"] = r.group(1)
+		elif r := re.match(r"^\s*Session type: (.+)$", line):
+			session_info["session_type"] = r.group(1)
+	if len(session_info) > 0:
+		sessions.append(validate_session(session_info))
+	return sessions
+
+
+def buffered_sessions() -> list[ValidatedXRDPSession]:
+	output = subprocess.run(["xrdp-sesadmin", "-c=list"], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, encoding="utf-8").stdout
+	return buffered_parse(output)
+
+
+def buffered_find(username: str) -> Optional[ValidatedXRDPSession]:
+	for session in buffered_sessions():
+		if session.username == username:
+			return session
+	return None
+
+
+def streaming_parse(output: str) -> list[XRDPSession]:
+	return list(parse_session_listing(io.StringIO(output)))
+
+
+def streaming_find(username: str) -> Optional[XRDPSession]:
+	return SesmanClient(USERNAME).find_session_by_username(username)
+
+
+class FakeSesadmin:
+	def __init__(self, sessions: int) -> None:
+		self._directory = tempfile.mkdtemp(prefix="xrdp_local_session_benchmark_sesman_")
+		self._sesman = FakeSesman(self._directory)
+		self._sesman.add_sessions([(f"user{index}", 10 + index) for index in range(sessions)])
+		self._saved_environment: dict[str, Optional[str]] = {}
+
+	def __enter__(self) -> FakeSesadmin:
+		for name, value in {"PATH": BIN_DIRECTORY + os.pathsep + os.environ.get("PATH", os.defpath), "FAKE_SESMAN_STATE": self._sesman.state_path}.items():
+			self._saved_environment[name] = os.environ.get(name)
+			os.environ[name] = value
+		return self
+
+	def __exit__(self, *exc_info: object) -> None:
+		for name, value in self._saved_environment.items():
+			if value is None:
+				os.environ.pop(name, None)
+			else:
+				os.environ[name] = value
+		shutil.rmtree(self._directory, ignore_errors=True)
+
+
+def iter_rows(counts: list[int], repeat: int) -> Iterator[list[object]]:
+	for count in counts:
+		with FakeSesadmin(count):
+			output = subprocess.run(["xrdp-sesadmin", "-c=list"], stdout=subprocess.PIPE, encoding="utf-8").stdout
+			old_sessions = [(session.session_id, session.display, session.username, session.session_type) for session in buffered_parse(output)]
+			assert old_sessions == streaming_parse(output)
+			first, last = "user0", f"user{count - 1}"
+			yield [
+				count,
+				measure(lambda: buffered_parse(output), repeat).median,
+				measure(lambda: streaming_parse(output), repeat).median,
+				measure(buffered_sessions, repeat).median,
+				measure(lambda: list(SesmanClient(USERNAME).iter_sessions()), repeat).median,
+				measure(lambda: buffered_find(first), repeat).median,
+				measure(lambda: streaming_find(first), repeat).median,
+				measure(lambda: buffered_find(last), repeat).median,
+				measure(lambda: streaming_find(last), repeat).median,
+			]
+
+
+def typer_main(
+	repeat: int = typer.Option(10, "-n", "--repeat", help="Measurements per size"),
+	quick: bool = typer.Option(False, "-q", "--quick", help="Only measure the smallest and largest sizes"),
+) -> None:
+	"""
+	Compare the streaming sesman listing against the buffered one.
+	"""
+	counts = [1, 5000] if quick is True else [1, 100, 1000, 5000]
+	print_table(
+		"Sesman session listing (median, old / new)",
+		["sessions", "parse old", "parse new", "list old", "list new", "find first old", "find first new", "find last old", "find last new"],
+		list(iter_rows(counts, repeat)),
+	)
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,92 @@
+"""
+Cost of listing and creating sessions by talking SCP to sesman's socket against
+running xrdp-sesadmin and xrdp-sesrun, by number of sessions of the user.
+
+Both sides are stand-ins written in Python. The xrdp-sesadmin and xrdp-sesrun
+stand-ins pay for an interpreter startup the real programs don't, so this
+overstates the saving per call, but the real programs still cost a process
+spawn (and a sudo, when run for another user) each.
+"""
+
+from __future__ import annotations
+
+import os
+import pwd
+import shutil
+import tempfile
+from typing import Iterator, Optional
+
+import typer
+
+from xrdp_local_session.common import xrdp
+from xrdp_local_session.common.xrdp import SesmanClient
+
+from tests.stand_ins.fake_sesman import FakeScpServer, FakeSesman
+
+from .common import measure, print_table
+
+USERNAME = pwd.getpwuid(os.getuid()).pw_name
+
+
+class FakeSesmanSocket:
+	def __init__(self, sessions: int) -> None:
+		self._directory = tempfile.mkdtemp(prefix="xrdp_local_session_benchmark_scp_")
+		self.sesman = FakeSesman(self._directory)
+		self.sesman.add_sessions([(USERNAME, 10 + index) for index in range(sessions)])
+		self.server = FakeScpServer(self.sesman, os.path.join(self._directory, "sesman.socket"))
+		self._saved_environment: dict[str, Optional[str]] = {}
+		self._saved_socket_paths = list(xrdp.XRDP_SOCKET_PATHS)
+
+	def __enter__(self) -> FakeSesmanSocket:
+		for name, value in self.sesman.environment.items():
+			self._saved_environment[name] = os.environ.get(name)
+			os.environ[name] = value
+		xrdp.XRDP_SOCKET_PATHS[:] = [self.sesman.socket_path_layout]
+		return self
+
+	def __exit__(self, *exc_info: object) -> None:
+		self.server.close()
+		xrdp.XRDP_SOCKET_PATHS[:] = self._saved_socket_paths
+		for name, value in self._saved_environment.items():
+			if value is None:
+				os.environ.pop(name, None)
+			else:
+				os.environ[name] = value
+		shutil.rmtree(self._directory, ignore_errors=True)
+
+
+def iter_rows(counts: list[int], repeat: int) -> Iterator[list[object]]:
+	for count in counts:
+		with FakeSesmanSocket(count) as fake:
+			socket_path = fake.server.socket_path
+			subprocess_sessions = list(SesmanClient(USERNAME).iter_sessions())
+			assert subprocess_sessions == list(SesmanClient(USERNAME, socket_path=socket_path).iter_sessions())
+			yield [
+				count,
+				measure(lambda: list(SesmanClient(USERNAME).iter_sessions()), repeat).median,
+				measure(lambda: list(SesmanClient(USERNAME, socket_path=socket_path).iter_sessions()), repeat).median,
+				measure(lambda: SesmanClient(USERNAME).launch_new_session(), repeat).median,
+				measure(lambda: SesmanClient(USERNAME, socket_path=socket_path).launch_new_session(), repeat).median,
+			]
+
+
+def typer_main(
+	repeat: int = typer.Option(10, "-n", "--repeat", help="Measurements per size"),
+) -> None:
+	"""
+	Compare talking to sesman's socket against running xrdp-sesadmin and
+	xrdp-sesrun.
+	"""
+	print_table(
+		"Sesman sessions of the user (median, subprocess / socket)",
+		["sessions", "list subprocess", "list socket", "launch subprocess", "launch socket"],
+		list(iter_rows([1, 10, 100], repeat)),
+	)
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+
+if __name__ == "__main__":
+	main()
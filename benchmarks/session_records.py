@@ -0,0 +1,105 @@
+"""
+Cost of the session records themselves: building XRDPSession NamedTuples
+against the pydantic models they replaced, and the memory the records of a
+listing keep alive.
+
+The pydantic model is validated with BaseModel.validate(), like the code it
+replaced. That exists in pydantic 1 and 2 (deprecated in 2, where the
+warning it emits is part of what the old code paid for), so the comparison
+runs against whichever version is installed.
+"""
+
+from __future__ import annotations
+
+import warnings
+import tracemalloc
+from typing import Any, Callable
+
+import typer
+import pydantic
+from pydantic import BaseModel
+
+from xrdp_local_session.common.xrdp import XRDPSession
+
+from .common import measure, print_table
+
+
+class ValidatedXRDPSession(BaseModel):
+	session_id: int
+	display: int
+	username: str
+	session_type: str
+
+
+def validate_session(session_info: dict[str, Any]) -> ValidatedXRDPSession:
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", DeprecationWarning)
+		return ValidatedXRDPSession.validate(session_info)
+
+
+def parsed_fields(count: int) -> list[tuple[int, int, str, str]]:
+	return [(index + 1, 10 + index, f"user{index}", "Xorg") for index in range(count)]
+
+
+def build_models(fields: list[tuple[int, int, str, str]]) -> list[ValidatedXRDPSession]:
+	# The old parser collected each block into a dict and validated it
+	return [
+		validate_session({"session_id": session_id, "display": display, "username": username, "session_type": session_type})
+		for session_id, display, username, session_type in fields
+	]
+
+
+def build_tuples(fields: list[tuple[int, int, str, str]]) -> list[XRDPSession]:
+	return [XRDPSession(session_id, display, username, session_type) for session_id, display, username, session_type in fields]
+
+
+def retained_memory(build: Callable[[], list[Any]]) -> int:
+	# Bytes allocated by the build that are still alive while the records are
+	tracemalloc.start()
+	try:
+		records = build()
+		retained, _ = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	del records
+	return retained
+
+
+def format_bytes(size: int) -> str:
+	if size < 1024 * 1024:
+		return f"{size / 1024:.1f}KiB"
+	return f"{size / 1024 / 1024:.1f}MiB"
+
+
+def typer_main(
+	repeat: int = typer.Option(5, "-n", "--repeat", help="Measurements per size"),
+) -> None:
+	"""
+	Compare building NamedTuple session records against pydantic models.
+	"""
+	rows = []
+	for count in [100, 10_000, 100_000]:
+		fields = parsed_fields(count)
+		models = measure(lambda: build_models(fields), repeat)
+		tuples = measure(lambda: build_tuples(fields), repeat)
+		rows.append([
+			count,
+			models.median,
+			tuples.median,
+			f"{models.median / tuples.median:.1f}x",
+			format_bytes(retained_memory(lambda: build_models(fields))),
+			format_bytes(retained_memory(lambda: build_tuples(fields))),
+		])
+	print_table(
+		f"XRDPSession records (median, pydantic {pydantic.VERSION} / NamedTuple)",
+		["sessions", "build pydantic", "build NamedTuple", "speedup", "memory pydantic", "memory NamedTuple"],
+		rows,
+	)
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,77 @@
+"""
+Latency between xrdp_local exiting on a remote takeover and the local session
+being locked and the seat switched to the greeter, with
+lock_on_remote_takeover enabled, by number of logind sessions of the user.
+
+The fake xrdp_local writes the time it exits and the fake login1 records when
+Lock and SwitchToGreeter arrive, both on CLOCK_MONOTONIC, which is shared by
+all processes. The fake xrdp_local still has to shut its interpreter down
+after writing the time, which is part of what's measured.
+"""
+
+from __future__ import annotations
+
+import os
+import logging
+
+import typer
+
+from xrdp_local_session.config import Settings
+from xrdp_local_session.session import Main
+
+from tests.stand_ins.fake_login1 import DISPLAY_MANAGER_SEAT_PATH
+
+from .common import StandIns, Stats, print_table
+from .login import DISPLAY, existing_session
+
+# Seconds after connecting at which the fake xrdp_local exits
+TAKEOVER_AFTER = 0.3
+
+
+def measure_takeovers(stand_ins: StandIns, logind_sessions: int, repeat: int) -> tuple[Stats, Stats]:
+	exit_file = os.path.join(stand_ins.directory, "xrdp_local_exit")
+	settings = Settings(lock_on_remote_takeover=True)
+	locked = []
+	switched = []
+	for _ in range(repeat):
+		existing_session(stand_ins, 1, logind_sessions)
+		stand_ins.setenv("FAKE_XRDP_LOCAL_EXIT_FILE", exit_file)
+		# Long enough for the login to finish before the takeover
+		stand_ins.setenv("FAKE_XRDP_LOCAL_RUN_TIME", str(TAKEOVER_AFTER))
+		stand_ins.login1.add_session("c0", os.getuid(), service="sddm", display=":0")
+		stand_ins.login1.set_current_session("c0")
+		Main(settings).run()
+		with open(exit_file, "r") as f:
+			exited_at = float(f.read())
+		calls = {method: at for _, method, at in stand_ins.login1.get_calls()}
+		locked.append(calls["Lock"] - exited_at)
+		switched.append(calls["SwitchToGreeter"] - exited_at)
+	return Stats.of(locked), Stats.of(switched)
+
+
+def typer_main(
+	repeat: int = typer.Option(20, "-n", "--repeat", help="Takeovers per measurement"),
+) -> None:
+	"""
+	Measure the latency of locking the local session on a remote takeover.
+	"""
+	logging.basicConfig(level=logging.WARNING)
+	rows = []
+	with StandIns() as stand_ins:
+		stand_ins.setenv("XDG_SEAT_PATH", DISPLAY_MANAGER_SEAT_PATH)
+		for count in [1, 10, 50]:
+			locked, switched = measure_takeovers(stand_ins, count, repeat)
+			rows.append([count, locked.minimum, locked.median, locked.maximum, switched.median, switched.maximum])
+	print_table(
+		f"xrdp_local exit to lock and switch to greeter, session on :{DISPLAY}",
+		["logind sessions", "lock min", "lock median", "lock max", "greeter median", "greeter max"],
+		rows,
+	)
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+
+if __name__ == "__main__":
+	main()
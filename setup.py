@@ -3,7 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name="xrdp_local_session",
     version="0.1.0",
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests", "tests.*", "benchmarks", "benchmarks.*"]),
     install_requires=[
         "typer",
         "dbus-python",
@@ -14,6 +14,10 @@ setup(
         "console_scripts": [
             "xrdp_local_session=xrdp_local_session.session:main",
             "xrdp_local_session_session_closer=xrdp_local_session.session_closer:main",
+            "xrdp_local_session_broker=xrdp_local_session.broker:main",
+            "xrdp_local_session_supervisor=xrdp_local_session.supervisor:main",
+            "xrdp_local_session_prewarm=xrdp_local_session.prewarm:main",
+            "xrdp_local_session_active_markers=xrdp_local_session.active_marker:main",
         ],
     },
 )
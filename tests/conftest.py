@@ -0,0 +1,58 @@
+import os
+from typing import Iterator
+
+import pytest
+
+from xrdp_local_session.common import xrdp
+
+from .stand_ins.fake_login1 import FakeLogin1, PrivateSystemBus
+from .stand_ins.fake_sesman import FakeScpServer, FakeSesman
+
+
+@pytest.fixture(scope="session")
+def _login1_service(tmp_path_factory: pytest.TempPathFactory) -> Iterator[FakeLogin1]:
+	# dbus-python keeps one system bus connection per process, so all tests
+	# share one bus and one service, which is reset between tests.
+	pytest.importorskip("dbus")
+	pytest.importorskip("gi")
+	try:
+		bus = PrivateSystemBus(str(tmp_path_factory.mktemp("bus")))
+	except RuntimeError as e:
+		pytest.skip(str(e))
+	previous_address = os.environ.get("DBUS_SYSTEM_BUS_ADDRESS")
+	os.environ["DBUS_SYSTEM_BUS_ADDRESS"] = bus.address
+	try:
+		service = FakeLogin1(bus.address)
+		try:
+			yield service
+		finally:
+			service.close()
+	finally:
+		bus.close()
+		if previous_address is None:
+			os.environ.pop("DBUS_SYSTEM_BUS_ADDRESS", None)
+		else:
+			os.environ["DBUS_SYSTEM_BUS_ADDRESS"] = previous_address
+
+
+@pytest.fixture
+def fake_login1(_login1_service: FakeLogin1) -> FakeLogin1:
+	_login1_service.reset()
+	return _login1_service
+
+
+@pytest.fixture
+def sesman(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> FakeSesman:
+	fake = FakeSesman(str(tmp_path))
+	for name, value in fake.environment.items():
+		monkeypatch.setenv(name, value)
+	monkeypatch.setattr(xrdp, "XRDP_SOCKET_PATHS", [fake.socket_path_layout])
+	monkeypatch.setattr(xrdp, "_known_socket_path_layout", None)
+	return fake
+
+
+@pytest.fixture
+def scp_server(tmp_path: str, sesman: FakeSesman) -> Iterator[FakeScpServer]:
+	server = FakeScpServer(sesman, os.path.join(str(tmp_path), "sesman.socket"))
+	yield server
+	server.close()
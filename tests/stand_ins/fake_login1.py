@@ -0,0 +1,311 @@
+"""
+A fake org.freedesktop.login1 service for tests and benchmarks.
+
+It implements the parts of the logind API xrdp_local_session uses: listing
+sessions and users' sessions, session properties, Lock/Unlock/Kill, and the
+SessionNew, SessionRemoved and PropertiesChanged signals. The same process
+also stands in for the display manager's org.freedesktop.DisplayManager seat,
+recording SwitchToGreeter calls. Tests drive it
+through an extra control interface, and can read back the calls it received
+along with when they arrived (in CLOCK_MONOTONIC, which is shared between
+processes).
+
+The service runs in its own process on a private dbus-daemon, see
+PrivateSystemBus and FakeLogin1 below.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+from typing import Any, Optional
+
+SERVICE_LOGIN = "org.freedesktop.login1"
+LOGIN_MANAGER_PATH = "/org/freedesktop/login1"
+INTERFACE_DBUS_PROPERTIES = "org.freedesktop.DBus.Properties"
+INTERFACE_LOGIN_MANAGER = "org.freedesktop.login1.Manager"
+INTERFACE_LOGIN_SESSION = "org.freedesktop.login1.Session"
+INTERFACE_LOGIN_USER = "org.freedesktop.login1.User"
+INTERFACE_CONTROL = "org.xrdp_local_session.FakeLogin1"
+SERVICE_DISPLAY_MANAGER = "org.freedesktop.DisplayManager"
+INTERFACE_DISPLAY_MANAGER_SEAT = "org.freedesktop.DisplayManager.Seat"
+DISPLAY_MANAGER_SEAT_PATH = "/org/freedesktop/DisplayManager/Seat0"
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:path={socket_path}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+"""
+
+# How long to wait for the bus and the service to come up
+STARTUP_TIMEOUT = 10
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def session_path(session_id: str) -> str:
+	return f"{LOGIN_MANAGER_PATH}/session/{session_id}"
+
+
+def user_path(uid: int) -> str:
+	return f"{LOGIN_MANAGER_PATH}/user/_{uid}"
+
+
+class PrivateSystemBus:
+	"""
+	A dbus-daemon of our own, used as the system bus by pointing
+	DBUS_SYSTEM_BUS_ADDRESS at it.
+	"""
+
+	def __init__(self, directory: str) -> None:
+		dbus_daemon = shutil.which("dbus-daemon")
+		if dbus_daemon is None:
+			raise RuntimeError("dbus-daemon is not installed")
+		config_path = os.path.join(directory, "bus.conf")
+		with open(config_path, "w") as f:
+			f.write(BUS_CONFIG.format(socket_path=os.path.join(directory, "bus.socket")))
+		self._proc = subprocess.Popen(
+			[dbus_daemon, f"--config-file={config_path}", "--nofork", "--print-address"],
+			stdout=subprocess.PIPE,
+			encoding="utf-8",
+		)
+		assert self._proc.stdout is not None
+		self.address = self._proc.stdout.readline().strip()
+		if self.address == "":
+			self.close()
+			raise RuntimeError("dbus-daemon failed to start")
+
+	def close(self) -> None:
+		self._proc.terminate()
+		self._proc.wait()
+
+
+class FakeLogin1:
+	"""
+	Runs the fake service on the bus at the given address, and controls it.
+	"""
+
+	def __init__(self, address: str) -> None:
+		import dbus
+
+		self._proc = subprocess.Popen(
+			[sys.executable, "-m", "tests.stand_ins.fake_login1", address],
+			cwd=REPOSITORY_ROOT,
+			env={**os.environ, "DBUS_SYSTEM_BUS_ADDRESS": address},
+		)
+		self._bus = dbus.bus.BusConnection(address)
+		deadline = time.monotonic() + STARTUP_TIMEOUT
+		while not self._bus.name_has_owner(SERVICE_LOGIN):
+			if time.monotonic() > deadline or self._proc.poll() is not None:
+				self.close()
+				raise RuntimeError("The fake login1 service failed to start")
+			time.sleep(0.01)
+		self._control = self._bus.get_object(SERVICE_LOGIN, LOGIN_MANAGER_PATH)
+
+	def close(self) -> None:
+		self._proc.terminate()
+		self._proc.wait()
+		self._bus.close()
+
+	def _call(self, method: str, *args: Any) -> Any:
+		return getattr(self._control, method)(*args, dbus_interface=INTERFACE_CONTROL)
+
+	def reset(self) -> None:
+		self._call("Reset")
+
+	def add_session(
+		self,
+		session_id: str,
+		uid: int,
+		*,
+		service: str="xrdp-sesman",
+		display: str="",
+		class_: str="user",
+		type: str="x11",
+		leader: int=1,
+		state: str="active",
+		locked_hint: bool=False,
+	) -> str:
+		import dbus
+
+		self._call("AddSession", session_id, dbus.UInt32(uid), dbus.Dictionary({
+			"Service": dbus.String(service),
+			"Display": dbus.String(display),
+			"Class": dbus.String(class_),
+			"Type": dbus.String(type),
+			"Leader": dbus.UInt32(leader),
+			"State": dbus.String(state),
+			"LockedHint": dbus.Boolean(locked_hint),
+		}, signature="sv"))
+		return session_path(session_id)
+
+	def remove_session(self, session_id: str) -> None:
+		self._call("RemoveSession", session_id)
+
+	def set_session_properties(self, session_id: str, **properties: Any) -> None:
+		import dbus
+
+		self._call("SetSessionProperties", session_id, dbus.Dictionary(properties, signature="sv"))
+
+	def set_current_session(self, session_id: str) -> None:
+		self._call("SetCurrentSession", session_id)
+
+	def get_calls(self) -> list[tuple[str, str, float]]:
+		"""
+		The Lock, Unlock and Kill calls received so far, as (session ID, method,
+		CLOCK_MONOTONIC time) tuples. SwitchToGreeter calls are recorded with
+		"seat0" as their session ID.
+		"""
+		return [(str(session_id), str(method), float(at)) for session_id, method, at in self._call("GetCalls")]
+
+
+def _run_service(address: str) -> None:
+	import dbus
+	import dbus.service
+	from dbus.mainloop.glib import DBusGMainLoop
+	from gi.repository import GLib
+
+	DBusGMainLoop(set_as_default=True)
+	bus = dbus.bus.BusConnection(address)
+
+	sessions: dict[str, Session] = {}
+	users: dict[int, User] = {}
+	calls: list[tuple[str, str, float]] = []
+	current: list[Optional[str]] = [None]
+
+	class Session(dbus.service.Object):
+		def __init__(self, session_id: str, uid: int, properties: dict[str, Any]) -> None:
+			super().__init__(bus, session_path(session_id))
+			self.session_id = session_id
+			self.uid = uid
+			self.properties = dict(properties)
+
+		@dbus.service.method(INTERFACE_DBUS_PROPERTIES, in_signature="s", out_signature="a{sv}")
+		def GetAll(self, interface: str) -> dict[str, Any]:
+			return self.properties
+
+		@dbus.service.method(INTERFACE_DBUS_PROPERTIES, in_signature="ss", out_signature="v")
+		def Get(self, interface: str, name: str) -> Any:
+			return self.properties[name]
+
+		@dbus.service.signal(INTERFACE_DBUS_PROPERTIES, signature="sa{sv}as")
+		def PropertiesChanged(self, interface: str, changed: dict[str, Any], invalidated: list[str]) -> None:
+			pass
+
+		def update(self, changed: dict[str, Any]) -> None:
+			self.properties.update(changed)
+			self.PropertiesChanged(INTERFACE_LOGIN_SESSION, dbus.Dictionary(changed, signature="sv"), dbus.Array([], signature="s"))
+
+		# Real logind only asks the session's locker to lock or unlock, which
+		# then sets LockedHint. We set it ourselves, as if a locker did.
+		@dbus.service.method(INTERFACE_LOGIN_SESSION, in_signature="", out_signature="")
+		def Lock(self) -> None:
+			calls.append((self.session_id, "Lock", time.monotonic()))
+			self.update({"LockedHint": dbus.Boolean(True)})
+
+		@dbus.service.method(INTERFACE_LOGIN_SESSION, in_signature="", out_signature="")
+		def Unlock(self) -> None:
+			calls.append((self.session_id, "Unlock", time.monotonic()))
+			self.update({"LockedHint": dbus.Boolean(False)})
+
+		@dbus.service.method(INTERFACE_LOGIN_SESSION, in_signature="si", out_signature="")
+		def Kill(self, who: str, signal_number: int) -> None:
+			calls.append((self.session_id, "Kill", time.monotonic()))
+
+	class User(dbus.service.Object):
+		def __init__(self, uid: int) -> None:
+			super().__init__(bus, user_path(uid))
+			self.uid = uid
+
+		@dbus.service.method(INTERFACE_DBUS_PROPERTIES, in_signature="ss", out_signature="v")
+		def Get(self, interface: str, name: str) -> Any:
+			return dbus.Array([
+				dbus.Struct((session.session_id, dbus.ObjectPath(session_path(session.session_id))))
+				for session in sessions.values()
+				if session.uid == self.uid
+			], signature="(so)")
+
+	class Manager(dbus.service.Object):
+		@dbus.service.method(INTERFACE_LOGIN_MANAGER, in_signature="", out_signature="a(susso)")
+		def ListSessions(self) -> list[Any]:
+			return [
+				(session.session_id, dbus.UInt32(session.uid), "", "", dbus.ObjectPath(session_path(session.session_id)))
+				for session in sessions.values()
+			]
+
+		@dbus.service.method(INTERFACE_LOGIN_MANAGER, in_signature="s", out_signature="o")
+		def GetSession(self, session_id: str) -> str:
+			if session_id == "auto":
+				session_id = current[0] or ""
+			if session_id not in sessions:
+				raise dbus.DBusException(f"No session {session_id}", name="org.freedesktop.login1.NoSuchSession")
+			return dbus.ObjectPath(session_path(session_id))
+
+		@dbus.service.signal(INTERFACE_LOGIN_MANAGER, signature="so")
+		def SessionNew(self, session_id: str, path: str) -> None:
+			pass
+
+		@dbus.service.signal(INTERFACE_LOGIN_MANAGER, signature="so")
+		def SessionRemoved(self, session_id: str, path: str) -> None:
+			pass
+
+		@dbus.service.method(INTERFACE_CONTROL, in_signature="sua{sv}", out_signature="")
+		def AddSession(self, session_id: str, uid: int, properties: dict[str, Any]) -> None:
+			sessions[session_id] = Session(session_id, int(uid), properties)
+			if int(uid) not in users:
+				users[int(uid)] = User(int(uid))
+			self.SessionNew(session_id, dbus.ObjectPath(session_path(session_id)))
+
+		@dbus.service.method(INTERFACE_CONTROL, in_signature="s", out_signature="")
+		def RemoveSession(self, session_id: str) -> None:
+			session = sessions.pop(session_id)
+			session.remove_from_connection()
+			self.SessionRemoved(session_id, dbus.ObjectPath(session_path(session_id)))
+
+		@dbus.service.method(INTERFACE_CONTROL, in_signature="sa{sv}", out_signature="")
+		def SetSessionProperties(self, session_id: str, changed: dict[str, Any]) -> None:
+			sessions[session_id].update(changed)
+
+		@dbus.service.method(INTERFACE_CONTROL, in_signature="s", out_signature="")
+		def SetCurrentSession(self, session_id: str) -> None:
+			current[0] = session_id
+
+		@dbus.service.method(INTERFACE_CONTROL, in_signature="", out_signature="a(ssd)")
+		def GetCalls(self) -> list[Any]:
+			return calls
+
+		@dbus.service.method(INTERFACE_CONTROL, in_signature="", out_signature="")
+		def Reset(self) -> None:
+			for session in sessions.values():
+				session.remove_from_connection()
+			sessions.clear()
+			calls.clear()
+			current[0] = None
+
+	class DisplayManagerSeat(dbus.service.Object):
+		@dbus.service.method(INTERFACE_DISPLAY_MANAGER_SEAT, in_signature="", out_signature="")
+		def SwitchToGreeter(self) -> None:
+			calls.append(("seat0", "SwitchToGreeter", time.monotonic()))
+
+	manager = Manager(bus, LOGIN_MANAGER_PATH)
+	seat = DisplayManagerSeat(bus, DISPLAY_MANAGER_SEAT_PATH)
+	display_manager_name = dbus.service.BusName(SERVICE_DISPLAY_MANAGER, bus)
+	# Requested last, so the service is complete once the name appears
+	name = dbus.service.BusName(SERVICE_LOGIN, bus)
+	GLib.MainLoop().run()
+	del manager, seat, display_manager_name, name
+
+
+if __name__ == "__main__":
+	_run_service(sys.argv[1])
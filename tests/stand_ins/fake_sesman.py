@@ -0,0 +1,195 @@
+"""
+Stand-ins for xrdp's session manager and xrdp_local.
+
+The executables in bin/ replace xrdp-sesadmin, xrdp-sesrun and xrdp_local when
+it's put first in PATH. xrdp-sesadmin and xrdp-sesrun share their state through
+a JSON file managed by FakeSesman, which also sets how long they take. The fake
+xrdp_local is configured through environment variables, see bin/xrdp_local.
+
+FakeScpServer serves the same sessions over sesman's socket, like sesman does
+since xrdp 0.10.
+"""
+
+from __future__ import annotations
+
+import os
+import pwd
+import json
+import time
+import uuid
+import socket
+import struct
+import threading
+import socketserver
+from typing import Any, Optional
+
+BIN_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+
+
+class FakeSesman:
+	def __init__(self, directory: str, *, list_latency: float=0, launch_latency: float=0) -> None:
+		self.state_path = os.path.join(directory, "sesman.json")
+		self.socket_directory = os.path.join(directory, "sockets")
+		os.makedirs(self.socket_directory, exist_ok=True)
+		self._state: dict[str, Any] = {
+			"sessions": [],
+			"list_latency": list_latency,
+			"launch_latency": launch_latency,
+			"socket_directory": self.socket_directory,
+		}
+		self._save()
+
+	def _save(self) -> None:
+		with open(self.state_path, "w") as f:
+			json.dump(self._state, f)
+
+	def _load(self) -> None:
+		with open(self.state_path, "r") as f:
+			self._state = json.load(f)
+
+	@property
+	def socket_path_layout(self) -> str:
+		# Used in place of xrdp_local_session.common.xrdp.XRDP_SOCKET_PATHS
+		return os.path.join(self.socket_directory, "{uid}_xrdp_display_{display}")
+
+	@property
+	def environment(self) -> dict[str, str]:
+		return {
+			"PATH": BIN_DIRECTORY + os.pathsep + os.environ.get("PATH", os.defpath),
+			"FAKE_SESMAN_STATE": self.state_path,
+		}
+
+	@property
+	def sessions(self) -> list[dict[str, Any]]:
+		self._load()
+		return self._state["sessions"]
+
+	def set_launch_latency(self, seconds: float) -> None:
+		self._load()
+		self._state["launch_latency"] = seconds
+		self._save()
+
+	def add_sessions(self, sessions: list[tuple[str, int]], *, session_type: str="Xorg") -> None:
+		# Sessions of other users, in bulk and without sockets
+		self._load()
+		for username, display in sessions:
+			self._state["sessions"].append({
+				"session_id": len(self._state["sessions"]) + 1,
+				"display": display,
+				"username": username,
+				"session_type": session_type,
+			})
+		self._save()
+
+	def add_session(self, username: str, display: int, *, session_type: str="Xorg", create_socket: bool=True) -> None:
+		self._load()
+		session_id = len(self._state["sessions"]) + 1
+		self._state["sessions"].append({
+			"session_id": session_id,
+			"display": display,
+			"username": username,
+			"session_type": session_type,
+		})
+		self._save()
+		if create_socket is True:
+			uid = pwd.getpwnam(username).pw_uid
+			open(self.socket_path_layout.format(uid=uid, display=display), "w").close()
+
+	def launch_session(self, username: str) -> int:
+		# Like bin/xrdp-sesrun, returning the display
+		self._load()
+		time.sleep(self._state["launch_latency"])
+		display = max([session["display"] for session in self._state["sessions"]], default=9) + 1
+		self.add_session(username, display)
+		return display
+
+
+# The libipm header and the SCP messages FakeScpServer understands. These are
+# spelled out here rather than taken from xrdp_local_session.common.scp, so the
+# client is tested against an independent encoding.
+LIBIPM_HEADER = "<HHHHI"
+SCP_UDS_LOGIN_REQUEST = 3
+SCP_LOGIN_RESPONSE = 4
+SCP_CREATE_SESSION_REQUEST = 6
+SCP_CREATE_SESSION_RESPONSE = 7
+SCP_LIST_SESSIONS_REQUEST = 8
+SCP_LIST_SESSIONS_RESPONSE = 9
+SCP_CLOSE_CONNECTION_REQUEST = 12
+SCP_SESSION_TYPES = {"Xvnc": 0, "Xorg": 1}
+
+
+def _field(type_char: str, value: Any) -> bytes:
+	if type_char == "s":
+		return b"s" + value.encode("utf-8") + b"\0"
+	if type_char == "B":
+		return b"B" + struct.pack("<H", len(value)) + value
+	return type_char.encode("ascii") + struct.pack("<" + {"y": "B", "b": "B", "q": "H", "i": "i", "u": "I", "x": "q"}[type_char], value)
+
+
+class _ScpRequestHandler(socketserver.StreamRequestHandler):
+	server: FakeScpServer
+
+	def _reply(self, message_number: int, *fields: tuple[str, Any]) -> None:
+		payload = b"".join(_field(type_char, value) for type_char, value in fields)
+		self.wfile.write(struct.pack(LIBIPM_HEADER, 2, struct.calcsize(LIBIPM_HEADER) + len(payload), 1, message_number, 0) + payload)
+
+	def handle(self) -> None:
+		creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+		_, uid, _ = struct.unpack("3i", creds)
+		username = pwd.getpwuid(uid).pw_name
+		logged_in = False
+		while True:
+			header = self.rfile.read(struct.calcsize(LIBIPM_HEADER))
+			if len(header) < struct.calcsize(LIBIPM_HEADER):
+				return
+			_, size, _, message_number, _ = struct.unpack(LIBIPM_HEADER, header)
+			self.rfile.read(size - len(header))
+			self.server.requests.append(message_number)
+			if message_number == self.server.drop_on:
+				return
+			if message_number == SCP_UDS_LOGIN_REQUEST:
+				logged_in = self.server.login_status == 0
+				self._reply(SCP_LOGIN_RESPONSE, ("i", self.server.login_status), ("b", 0), ("i", uid))
+			elif message_number == SCP_LIST_SESSIONS_REQUEST and logged_in is True:
+				# sesman only lists the sessions of the user logged in
+				for session in self.server.sesman.sessions:
+					if session["username"] != username:
+						continue
+					self._reply(
+						SCP_LIST_SESSIONS_RESPONSE,
+						("i", 0), ("i", session["session_id"]), ("u", session["display"]),
+						("y", SCP_SESSION_TYPES[session["session_type"]]), ("q", 1920), ("q", 1080), ("y", 24),
+						("x", 0), ("i", uid), ("s", "127.0.0.1"),
+					)
+				self._reply(SCP_LIST_SESSIONS_RESPONSE, ("i", 1))
+			elif message_number == SCP_CREATE_SESSION_REQUEST and logged_in is True:
+				display = self.server.sesman.launch_session(username)
+				self._reply(SCP_CREATE_SESSION_RESPONSE, ("i", 0), ("i", display), ("B", uuid.uuid4().bytes))
+			else:
+				# Closing the connection, or a request we don't know
+				return
+
+
+class FakeScpServer(socketserver.ThreadingUnixStreamServer):
+	"""
+	Serves a FakeSesman's sessions over SCP on a Unix socket. It records the
+	number of each message it receives, can refuse logins, and can drop the
+	connection when it receives a given message instead of answering it.
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, sesman: FakeSesman, socket_path: str) -> None:
+		super().__init__(socket_path, _ScpRequestHandler)
+		self.sesman = sesman
+		self.socket_path = socket_path
+		self.requests: list[int] = []
+		self.login_status = 0
+		self.drop_on: Optional[int] = None
+		self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+		self._thread.start()
+
+	def close(self) -> None:
+		self.shutdown()
+		self.server_close()
+		self._thread.join()
@@ -0,0 +1,65 @@
+import os
+import pwd
+import json
+import subprocess
+
+from xrdp_local_session.config import Settings
+from xrdp_local_session.common.xrdp import XRDPSession
+from xrdp_local_session.active_marker import ActiveMarker, _get_process_start_time, list_active_markers, reap_stale_markers
+
+USERNAME = pwd.getpwuid(os.getuid()).pw_name
+
+
+def exited_pid() -> int:
+	proc = subprocess.Popen(["true"])
+	proc.wait()
+	return proc.pid
+
+
+def write_marker(directory: str, name: str, content: object) -> str:
+	path = os.path.join(directory, name)
+	with open(path, "w") as f:
+		json.dump(content, f)
+	return path
+
+
+def test_marker_records_its_owner(tmp_path: str) -> None:
+	settings = Settings(local_active_marker_directory=str(tmp_path))
+	with ActiveMarker(settings, XRDPSession(1, 10, USERNAME, "Xorg")):
+		(marker,) = list_active_markers(str(tmp_path))
+		assert marker.pid == os.getpid()
+		assert marker.start_time == _get_process_start_time(os.getpid())
+		assert (marker.username, marker.x11_display) == (USERNAME, 10)
+	assert os.listdir(str(tmp_path)) == []
+
+
+def test_reaps_markers_of_exited_processes(tmp_path: str) -> None:
+	directory = str(tmp_path)
+	stale = write_marker(directory, "stale", {"pid": exited_pid(), "start_time": 1})
+	live = write_marker(directory, "live", {"pid": os.getpid(), "start_time": _get_process_start_time(os.getpid())})
+	assert [marker.path for marker in reap_stale_markers(directory)] == [stale]
+	assert os.listdir(directory) == ["live"]
+	assert [marker.path for marker in list_active_markers(directory)] == [live]
+
+
+def test_keeps_markers_it_cannot_judge(tmp_path: str) -> None:
+	directory = str(tmp_path)
+	write_marker(directory, "old_format", {})
+	write_marker(directory, "no_start_time", {"pid": exited_pid(), "start_time": None})
+	write_marker(directory, "not_json", "{")
+	assert reap_stale_markers(directory) == []
+	assert sorted(os.listdir(directory)) == ["no_start_time", "not_json", "old_format"]
+
+
+def test_marker_is_readable_by_everyone(tmp_path: str) -> None:
+	settings = Settings(local_active_marker_directory=str(tmp_path))
+	with ActiveMarker(settings, XRDPSession(1, 10, USERNAME, "Xorg")):
+		(path,) = os.listdir(str(tmp_path))
+		assert os.stat(os.path.join(str(tmp_path), path)).st_mode & 0o044 == 0o044
+
+
+def test_reaps_only_markers_of_the_given_user(tmp_path: str) -> None:
+	directory = str(tmp_path)
+	write_marker(directory, "stale", {"pid": exited_pid(), "start_time": 1})
+	assert reap_stale_markers(directory, os.getuid() + 1) == []
+	assert len(reap_stale_markers(directory, os.getuid())) == 1
@@ -0,0 +1,167 @@
+import os
+import pwd
+import json
+import time
+import socket
+import threading
+from typing import Any, Iterator
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from xrdp_local_session import broker
+from xrdp_local_session.config import SettingsLoader
+from xrdp_local_session.broker import Broker, BrokerClient, BrokerError, BrokerServer, BrokerUnavailableError
+
+from .stand_ins.fake_login1 import FakeLogin1
+from .stand_ins.fake_sesman import FakeSesman
+
+USERNAME = pwd.getpwuid(os.getuid()).pw_name
+
+# Signals arrive asynchronously, but on a local bus well within this
+TIMEOUT = 5
+
+
+def make_broker(directory: str, **settings: Any) -> Broker:
+	path = os.path.join(directory, "config.json")
+	with open(path, "w") as f:
+		json.dump({"logind_enabled": False, **settings}, f)
+	return Broker(SettingsLoader(path))
+
+
+@contextmanager
+def serve(server: BrokerServer) -> Iterator[None]:
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		yield
+	finally:
+		server.shutdown()
+		server.server_close()
+		thread.join()
+
+
+@pytest.fixture
+def socket_path(tmp_path: str) -> str:
+	return os.path.join(str(tmp_path), "run", "broker.socket")
+
+
+@pytest.fixture
+def client(tmp_path: str, sesman: FakeSesman, socket_path: str) -> Iterator[BrokerClient]:
+	with serve(BrokerServer(make_broker(str(tmp_path)), socket_path)):
+		yield BrokerClient(socket_path, 1, TIMEOUT)
+
+
+def test_launches_and_then_finds_session(client: BrokerClient, sesman: FakeSesman) -> None:
+	reply = client.lookup(USERNAME)
+	assert reply.is_existing_session is False
+	assert reply.session.username == USERNAME
+	assert os.path.exists(reply.socket_path)
+	reply = client.lookup(USERNAME)
+	assert reply.is_existing_session is True
+	assert reply.unlock_targets == []
+	assert len(sesman.sessions) == 1
+
+
+def test_reports_errors(client: BrokerClient, sesman: FakeSesman) -> None:
+	with pytest.raises(BrokerError, match="No existing session"):
+		client.lookup(USERNAME, create_new_session=False)
+	with pytest.raises(BrokerError, match="Unknown user"):
+		client.lookup("no-such-user-xrdp")
+	assert sesman.sessions == []
+
+
+def test_rejects_malformed_requests(client: BrokerClient, socket_path: str) -> None:
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.connect(socket_path)
+		sock.sendall(b"not json\n")
+		with sock.makefile("rb") as f:
+			assert "error" in json.loads(f.readline())
+
+
+def test_unavailable_broker(socket_path: str) -> None:
+	with pytest.raises(BrokerUnavailableError):
+		BrokerClient(socket_path, 1, TIMEOUT).lookup(USERNAME)
+
+
+def test_passes_peer_credentials(tmp_path: str, socket_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+	instance = make_broker(str(tmp_path))
+	peers = []
+
+	def handle_request(request: dict[str, Any], peer_uid: int) -> dict[str, Any]:
+		peers.append(peer_uid)
+		raise BrokerError("recorded")
+
+	monkeypatch.setattr(instance, "handle_request", handle_request)
+	with serve(BrokerServer(instance, socket_path)):
+		with pytest.raises(BrokerError, match="recorded"):
+			BrokerClient(socket_path, 1, TIMEOUT).lookup(USERNAME)
+	assert peers == [os.getuid()]
+
+
+def test_only_root_looks_up_other_users(tmp_path: str, sesman: FakeSesman) -> None:
+	instance = make_broker(str(tmp_path))
+	other_uid = os.getuid() + 1
+	with pytest.raises(BrokerError, match="Not allowed"):
+		instance.handle_request({"username": USERNAME}, other_uid)
+	assert sesman.sessions == []
+	assert instance.handle_request({"username": USERNAME}, os.getuid())["is_existing_session"] is False
+
+
+def test_concurrent_requests_launch_one_session(client: BrokerClient, sesman: FakeSesman) -> None:
+	# Long enough for all requests to arrive while the first one launches
+	sesman.set_launch_latency(0.2)
+	with ThreadPoolExecutor(max_workers=4) as executor:
+		replies = list(executor.map(lambda _: client.lookup(USERNAME), range(4)))
+	assert len(sesman.sessions) == 1
+	assert len({reply.session for reply in replies}) == 1
+	assert sorted(reply.is_existing_session for reply in replies) == [False, True, True, True]
+
+
+def test_confirms_miss_before_launching(client: BrokerClient, sesman: FakeSesman) -> None:
+	with pytest.raises(BrokerError):
+		client.lookup(USERNAME, create_new_session=False)
+	# Started remotely while the index says there's no session
+	sesman.add_session(USERNAME, 12)
+	reply = client.lookup(USERNAME)
+	assert (reply.is_existing_session, reply.session.display) == (True, 12)
+	assert len(sesman.sessions) == 1
+
+
+def test_socket_activation(tmp_path: str, sesman: FakeSesman, socket_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+	# The socket systemd would pass, standing in for file descriptor 3
+	listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	activated_path = os.path.join(str(tmp_path), "activated.socket")
+	listener.bind(activated_path)
+	listener.listen()
+	monkeypatch.setattr(broker, "SD_LISTEN_FDS_START", listener.detach())
+	monkeypatch.setenv("LISTEN_PID", str(os.getpid()))
+	monkeypatch.setenv("LISTEN_FDS", "1")
+	with serve(BrokerServer(make_broker(str(tmp_path)), socket_path)):
+		assert BrokerClient(activated_path, 1, TIMEOUT).lookup(USERNAME).session.username == USERNAME
+	# The configured path is left alone, systemd owns the socket
+	assert not os.path.exists(socket_path)
+
+
+def test_refreshes_index_on_logind_signals(tmp_path: str, fake_login1: FakeLogin1, sesman: FakeSesman) -> None:
+	instance = make_broker(str(tmp_path), logind_enabled=True)
+	instance.watch()
+	try:
+		with pytest.raises(BrokerError):
+			instance.handle_request({"username": USERNAME, "create_new_session": False}, os.getuid())
+		sesman_client, _ = instance._get_sesman_client(USERNAME)
+		misses = sesman_client.index_misses
+		# A session started remotely, with its logind session
+		sesman.add_session(USERNAME, 11)
+		fake_login1.add_session("c5", os.getuid(), display=":11")
+		# Refreshed in the background, without a request
+		deadline = time.monotonic() + TIMEOUT
+		while sesman_client.index_misses == misses and time.monotonic() < deadline:
+			time.sleep(0.01)
+		assert sesman_client.index_misses == misses + 1
+		reply = instance.handle_request({"username": USERNAME, "create_new_session": False}, os.getuid())
+		assert sesman_client.index_misses == misses + 1
+		assert reply["session"]["display"] == 11
+	finally:
+		instance.close()
@@ -0,0 +1,47 @@
+import os
+import json
+
+import pytest
+
+from xrdp_local_session.config import Settings, SettingsLoader
+
+
+def write_config(path: str, content: object) -> None:
+	with open(path, "w") as f:
+		json.dump(content, f)
+	# Make sure the change is visible even on filesystems with coarse
+	# timestamps
+	stat = os.stat(path)
+	os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_missing_file_gives_defaults(tmp_path: str) -> None:
+	assert Settings.load_from_file(os.path.join(str(tmp_path), "missing.json")).verbose is False
+
+
+def test_rejects_non_object_json(tmp_path: str) -> None:
+	path = os.path.join(str(tmp_path), "config.json")
+	write_config(path, ["verbose"])
+	with pytest.raises(ValueError):
+		Settings.load_from_file(path)
+
+
+def test_loader_reloads_changed_file(tmp_path: str) -> None:
+	path = os.path.join(str(tmp_path), "config.json")
+	write_config(path, {"verbose": False})
+	loader = SettingsLoader(path)
+	first = loader.settings
+	assert loader.settings is first
+	write_config(path, {"verbose": True})
+	assert loader.settings.verbose is True
+
+
+def test_loader_keeps_last_valid_settings(tmp_path: str) -> None:
+	path = os.path.join(str(tmp_path), "config.json")
+	write_config(path, {"verbose": True})
+	loader = SettingsLoader(path)
+	with open(path, "w") as f:
+		f.write("{")
+	assert loader.settings.verbose is True
+	write_config(path, {"verbose": "not a boolean"})
+	assert loader.settings.verbose is True
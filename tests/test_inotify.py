@@ -0,0 +1,56 @@
+import os
+import time
+import threading
+
+import pytest
+
+from xrdp_local_session.common import inotify
+from xrdp_local_session.common.inotify import wait_for_any_path
+
+
+def create_later(path: str, delay: float) -> threading.Thread:
+	def create() -> None:
+		time.sleep(delay)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		open(path, "w").close()
+
+	thread = threading.Thread(target=create)
+	thread.start()
+	return thread
+
+
+def test_returns_existing_path(tmp_path: str) -> None:
+	path = os.path.join(str(tmp_path), "socket")
+	open(path, "w").close()
+	assert wait_for_any_path([os.path.join(str(tmp_path), "missing"), path], 0) == path
+
+
+def test_wakes_up_when_path_and_its_directories_are_created(tmp_path: str) -> None:
+	path = os.path.join(str(tmp_path), "sockdir", "1000", "socket")
+	thread = create_later(path, 0.1)
+	started_at = time.monotonic()
+	assert wait_for_any_path([path], 5) == path
+	assert time.monotonic() - started_at < 2
+	thread.join()
+
+
+def test_times_out(tmp_path: str) -> None:
+	assert wait_for_any_path([os.path.join(str(tmp_path), "socket")], 0.1) is None
+
+
+def test_polls_when_a_directory_cannot_be_watched(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+	class NoWatches:
+		def __init__(self, libc: object) -> None:
+			self._libc = libc
+
+		def inotify_init1(self, flags: int) -> int:
+			return self._libc.inotify_init1(flags)  # type: ignore[attr-defined]
+
+		def inotify_add_watch(self, fd: int, path: bytes, mask: int) -> int:
+			return -1
+
+	monkeypatch.setattr(inotify, "_get_libc", lambda libc=inotify._get_libc(): NoWatches(libc))
+	path = os.path.join(str(tmp_path), "socket")
+	thread = create_later(path, 0.1)
+	assert wait_for_any_path([path], 5) == path
+	thread.join()
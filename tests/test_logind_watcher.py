@@ -0,0 +1,66 @@
+import pytest
+
+pytest.importorskip("dbus")
+pytest.importorskip("gi")
+
+from xrdp_local_session.config import Settings
+from xrdp_local_session.common.logind import LogindClient
+
+from .stand_ins.fake_login1 import FakeLogin1
+
+# Signals arrive asynchronously, but on a local bus well within this
+TIMEOUT = 5
+
+
+@pytest.fixture
+def client(fake_login1: FakeLogin1) -> LogindClient:
+	return LogindClient(Settings())
+
+
+def test_populates_existing_sessions(fake_login1: FakeLogin1, client: LogindClient) -> None:
+	path = fake_login1.add_session("c1", 1000, display=":10", leader=42)
+	with client.subscribe() as watcher:
+		session = watcher.sessions[path]
+	assert session.id == "c1"
+	assert session.display == 10
+	assert session.leader == 42
+	assert session.state == "active"
+
+
+def test_session_new(fake_login1: FakeLogin1, client: LogindClient) -> None:
+	with client.subscribe() as watcher:
+		path = fake_login1.add_session("c2", 1000, service="sddm")
+		assert watcher.wait_for(lambda sessions: path in sessions, TIMEOUT) is True
+		assert watcher.sessions[path].service_name == "sddm"
+
+
+def test_session_removed(fake_login1: FakeLogin1, client: LogindClient) -> None:
+	path = fake_login1.add_session("c3", 1000)
+	removed = []
+	with client.subscribe() as watcher:
+		watcher.add_removed_listener(removed.append)
+		# Populates the client's proxy cache
+		client.get_session(path)
+		assert path in client._proxies
+		fake_login1.remove_session("c3")
+		assert watcher.wait_session_removed(path, TIMEOUT) is True
+	assert removed == [path]
+	assert path not in client._proxies
+
+
+def test_incremental_properties(fake_login1: FakeLogin1, client: LogindClient) -> None:
+	path = fake_login1.add_session("c4", 1000, locked_hint=True)
+	with client.subscribe() as watcher:
+		assert watcher.wait_session_unlocked(path, 0.1) is False
+		calls = client.bus_calls
+		client.unlock_session(client.get_session(path))
+		assert watcher.wait_session_unlocked(path, TIMEOUT) is True
+		fake_login1.set_session_properties("c4", State="closing")
+		assert watcher.wait_for(lambda sessions: sessions[path].state == "closing", TIMEOUT) is True
+		# Applied from the signals, without fetching the session again
+		assert client.bus_calls == calls + 2
+
+
+def test_wait_for_timeout(fake_login1: FakeLogin1, client: LogindClient) -> None:
+	with client.subscribe() as watcher:
+		assert watcher.wait_for(lambda sessions: len(sessions) > 0, 0.1) is False
@@ -0,0 +1,32 @@
+import pytest
+
+from xrdp_local_session.name_matcher import NameMatcher
+
+
+def test_matches_exact_names() -> None:
+	matcher = NameMatcher(["sddm", "gdm-x-session"])
+	assert matcher.match("sddm") == "sddm"
+	assert matcher.match("sddm-helper") is None
+
+
+def test_matches_truncated_process_names() -> None:
+	matcher = NameMatcher(["xrdp_local_session"])
+	assert matcher.match("xrdp_local_sess") == "xrdp_local_session"
+
+
+def test_matches_globs_and_regular_expressions() -> None:
+	matcher = NameMatcher(["kde*", "re:^gvfsd(-.*)?$"])
+	assert matcher.match("kded5") == "kde*"
+	assert matcher.match("gvfsd-fuse") == "re:^gvfsd(-.*)?$"
+	assert matcher.match("xgvfsd") is None
+
+
+def test_rejects_invalid_regular_expressions() -> None:
+	with pytest.raises(ValueError):
+		NameMatcher(["re:("])
+
+
+def test_splits_matched_and_unmatched_names() -> None:
+	matched, unmatched = NameMatcher(["sddm", "kde*"]).match_all({"sddm", "kded5", "firefox"})
+	assert matched == {"sddm": "sddm", "kded5": "kde*"}
+	assert unmatched == {"firefox"}
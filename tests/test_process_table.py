@@ -0,0 +1,35 @@
+import os
+import time
+import subprocess
+from typing import Iterator
+
+import pytest
+
+from xrdp_local_session.common.process_table import ProcessTable
+
+
+@pytest.fixture
+def child() -> Iterator[int]:
+	proc = subprocess.Popen(["sh", "-c", "sleep 60 & wait"])
+	yield proc.pid
+	proc.kill()
+	proc.wait()
+
+
+def test_descendants() -> None:
+	table = ProcessTable([(10, 1, "sddm-helper"), (11, 10, "startplasma"), (12, 11, "kwin"), (13, 1, "other")])
+	assert sorted(table.descendants(10)) == [11, 12]
+	assert table.descendant_names(10) == {"startplasma", "kwin"}
+	assert table.descendant_names(12) == set()
+	assert table.descendant_names(99) == set()
+
+
+def test_from_proc_sees_descendants(child: int) -> None:
+	# The shell may not have started sleep yet
+	for _ in range(100):
+		table = ProcessTable.from_proc()
+		if "sleep" in table.descendant_names(os.getpid()):
+			break
+		time.sleep(0.01)
+	assert child in table.descendants(os.getpid())
+	assert "sleep" in table.descendant_names(child)
@@ -0,0 +1,31 @@
+import pytest
+
+from xrdp_local_session.common.scp import ScpError, decode_fields, encode_fields, encode_message
+
+
+def test_encodes_header() -> None:
+	# Version 2, 12 bytes in all, SCP facility, message 3, reserved
+	assert encode_message(3) == b"\x02\x00\x0c\x00\x01\x00\x03\x00\x00\x00\x00\x00"
+
+
+def test_round_trips_fields() -> None:
+	values = (1, True, -2, 1080, -3, 4, -5, 6, "shell", b"\x01\x02")
+	payload = encode_fields("ybnqiuxtsB", values)
+	assert payload[:2] == b"y\x01"
+	assert tuple(decode_fields("ybnqiuxtsB", payload)) == values
+
+
+def test_ignores_trailing_fields() -> None:
+	assert decode_fields("i", encode_fields("iu", (1, 2))) == [1]
+
+
+@pytest.mark.parametrize("signature, payload", [
+	("i", encode_fields("u", (1,))),
+	("i", b"i\x01\x00"),
+	("s", b"sno terminator"),
+	("B", b"B\x10\x00short"),
+	("ii", encode_fields("i", (1,))),
+])
+def test_rejects_malformed_fields(signature: str, payload: bytes) -> None:
+	with pytest.raises(ScpError):
+		decode_fields(signature, payload)
@@ -0,0 +1,96 @@
+import os
+import pwd
+import subprocess
+from typing import Iterator
+
+import pytest
+
+pytest.importorskip("dbus")
+pytest.importorskip("gi")
+
+from xrdp_local_session.config import Settings
+from xrdp_local_session.session import Main
+
+from .stand_ins.fake_login1 import DISPLAY_MANAGER_SEAT_PATH, FakeLogin1
+from .stand_ins.fake_sesman import FakeSesman
+
+# Generous, so loaded CI machines don't fail. On an idle machine this takes a
+# few milliseconds.
+TAKEOVER_LOCK_LATENCY_LIMIT = 0.5
+
+USERNAME = pwd.getpwuid(os.getuid()).pw_name
+
+
+@pytest.fixture
+def exit_file(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> str:
+	path = os.path.join(str(tmp_path), "xrdp_local_exit")
+	monkeypatch.setenv("FAKE_XRDP_LOCAL_RUN_TIME", "0.2")
+	monkeypatch.setenv("FAKE_XRDP_LOCAL_EXIT_FILE", path)
+	monkeypatch.setenv("XDG_SEAT_PATH", DISPLAY_MANAGER_SEAT_PATH)
+	return path
+
+
+@pytest.fixture
+def leader() -> Iterator[int]:
+	# A session leader without descendants, so the wrong session workaround
+	# considers its session part of the xrdp session
+	proc = subprocess.Popen(["sleep", "60"])
+	yield proc.pid
+	proc.kill()
+	proc.wait()
+
+
+def get_calls(fake_login1: FakeLogin1) -> list[tuple[str, str]]:
+	return [(session_id, method) for session_id, method, _ in fake_login1.get_calls()]
+
+
+def test_locks_and_switches_to_greeter_on_takeover(fake_login1: FakeLogin1, sesman: FakeSesman, exit_file: str) -> None:
+	sesman.add_session(USERNAME, 10)
+	fake_login1.add_session("c2", os.getuid(), display=":10")
+	fake_login1.add_session("c1", os.getuid(), service="sddm", display=":0")
+	fake_login1.set_current_session("c1")
+
+	settings = Settings(lock_on_remote_takeover=True, xdg_wrong_session_workaround_enabled=False)
+	assert Main(settings).run() == (0, True)
+
+	assert get_calls(fake_login1) == [("c2", "Unlock"), ("c1", "Lock"), ("seat0", "SwitchToGreeter")]
+	with open(exit_file, "r") as f:
+		exited_at = float(f.read())
+	locked_at = next(at for _, method, at in fake_login1.get_calls() if method == "Lock")
+	assert locked_at - exited_at < TAKEOVER_LOCK_LATENCY_LIMIT
+
+
+def test_does_not_lock_session_the_xrdp_session_was_launched_from(fake_login1: FakeLogin1, sesman: FakeSesman, exit_file: str) -> None:
+	fake_login1.add_session("c1", os.getuid(), service="sddm", display=":0")
+	fake_login1.set_current_session("c1")
+
+	settings = Settings(lock_on_remote_takeover=True)
+	assert Main(settings).run() == (0, False)
+
+	assert len(sesman.sessions) == 1
+	assert get_calls(fake_login1) == [("seat0", "SwitchToGreeter")]
+
+
+def test_does_not_lock_session_belonging_to_xrdp_session(fake_login1: FakeLogin1, sesman: FakeSesman, exit_file: str, leader: int) -> None:
+	sesman.add_session(USERNAME, 10)
+	fake_login1.add_session("c2", os.getuid(), display=":10")
+	fake_login1.add_session("c1", os.getuid(), service="sddm", display=":0", leader=leader)
+	fake_login1.set_current_session("c1")
+
+	settings = Settings(lock_on_remote_takeover=True)
+	assert Main(settings).run() == (0, True)
+
+	calls = get_calls(fake_login1)
+	assert ("c1", "Lock") not in calls
+	assert ("seat0", "SwitchToGreeter") in calls
+
+
+def test_takeover_handling_is_disabled_by_default(fake_login1: FakeLogin1, sesman: FakeSesman, exit_file: str) -> None:
+	sesman.add_session(USERNAME, 10)
+	fake_login1.add_session("c2", os.getuid(), display=":10")
+	fake_login1.add_session("c1", os.getuid(), service="sddm", display=":0")
+	fake_login1.set_current_session("c1")
+
+	assert Main(Settings(xdg_wrong_session_workaround_enabled=False)).run() == (0, True)
+
+	assert get_calls(fake_login1) == [("c2", "Unlock")]
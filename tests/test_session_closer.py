@@ -0,0 +1,72 @@
+import os
+import time
+import subprocess
+import threading
+
+import pytest
+
+pytest.importorskip("dbus")
+pytest.importorskip("gi")
+
+from xrdp_local_session.config import Settings
+from xrdp_local_session.common import process_table
+from xrdp_local_session.common.logind import LogindClient
+from xrdp_local_session.session_closer import SessionCloser
+
+from .stand_ins.fake_login1 import FakeLogin1
+
+TIMEOUT = 5
+
+
+def close_when_drained(timeout: float) -> float:
+	# The closer blocks termination signals in the calling thread, so it must
+	# not run in pytest's.
+	closer = SessionCloser(LogindClient(Settings()))
+	started_at = time.monotonic()
+	thread = threading.Thread(target=closer.close_when_drained, args=(timeout,))
+	thread.start()
+	thread.join()
+	return time.monotonic() - started_at
+
+
+@pytest.fixture
+def session(fake_login1: FakeLogin1) -> str:
+	fake_login1.add_session("c1", os.getuid(), service="sddm")
+	fake_login1.set_current_session("c1")
+	return "c1"
+
+
+def test_closes_when_processes_exit(fake_login1: FakeLogin1, session: str, monkeypatch: pytest.MonkeyPatch) -> None:
+	child = subprocess.Popen(["sleep", "0.2"])
+	monkeypatch.setattr(process_table, "get_cgroup_pids", lambda pid: [os.getpid(), child.pid])
+	elapsed = close_when_drained(TIMEOUT)
+	child.wait()
+	assert 0.2 <= elapsed < TIMEOUT
+	assert [(session_id, method) for session_id, method, _ in fake_login1.get_calls()] == [(session, "Kill")]
+
+
+def test_closes_when_session_is_closing(fake_login1: FakeLogin1, session: str, monkeypatch: pytest.MonkeyPatch) -> None:
+	child = subprocess.Popen(["sleep", str(TIMEOUT * 2)])
+	monkeypatch.setattr(process_table, "get_cgroup_pids", lambda pid: [os.getpid(), child.pid])
+	timer = threading.Timer(0.2, fake_login1.set_session_properties, args=(session,), kwargs={"State": "closing"})
+	timer.start()
+	try:
+		elapsed = close_when_drained(TIMEOUT)
+	finally:
+		timer.join()
+		child.kill()
+		child.wait()
+	assert 0.2 <= elapsed < TIMEOUT
+	assert [method for _, method, _ in fake_login1.get_calls()] == ["Kill"]
+
+
+def test_closes_after_timeout(fake_login1: FakeLogin1, session: str, monkeypatch: pytest.MonkeyPatch) -> None:
+	child = subprocess.Popen(["sleep", str(TIMEOUT * 2)])
+	monkeypatch.setattr(process_table, "get_cgroup_pids", lambda pid: [os.getpid(), child.pid])
+	try:
+		elapsed = close_when_drained(0.3)
+	finally:
+		child.kill()
+		child.wait()
+	assert 0.3 <= elapsed < TIMEOUT
+	assert [method for _, method, _ in fake_login1.get_calls()] == ["Kill"]
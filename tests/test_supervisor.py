@@ -0,0 +1,79 @@
+import os
+import pwd
+import json
+import asyncio
+
+import pytest
+
+from xrdp_local_session import supervisor
+from xrdp_local_session.config import SettingsLoader
+from xrdp_local_session.supervisor import Seat, Supervisor
+
+from .stand_ins.fake_sesman import FakeSesman
+
+USERNAME = pwd.getpwuid(os.getuid()).pw_name
+
+
+@pytest.fixture
+def seat_supervisor(tmp_path: str, sesman: FakeSesman, monkeypatch: pytest.MonkeyPatch) -> Supervisor:
+	# Seats don't inherit our PATH, so they have to find the fake xrdp_local
+	# in theirs
+	monkeypatch.setattr(supervisor, "SEAT_PATH", os.environ["PATH"])
+	path = os.path.join(str(tmp_path), "config.json")
+	with open(path, "w") as f:
+		json.dump({"logind_enabled": False, "local_active_marker_directory": os.path.join(str(tmp_path), "markers")}, f)
+	return Supervisor(SettingsLoader(path))
+
+
+def test_parses_seats() -> None:
+	assert Seat.parse("alice=:0") == Seat("alice", ":0", None)
+	assert Seat.parse("alice=:1,/run/lightdm/root/:1") == Seat("alice", ":1", "/run/lightdm/root/:1")
+	assert Seat.parse("alice=:1,/tmp/a,b") == Seat("alice", ":1", "/tmp/a,b")
+
+
+@pytest.mark.parametrize("value", ["alice", "=:0", "alice=", "alice=,/tmp/auth", "alice=:0,"])
+def test_rejects_invalid_seats(value: str) -> None:
+	with pytest.raises(ValueError):
+		Seat.parse(value)
+
+
+def test_environment_is_clean(seat_supervisor: Supervisor, monkeypatch: pytest.MonkeyPatch) -> None:
+	monkeypatch.setenv("XAUTHORITY", "/root/.Xauthority")
+	user = pwd.getpwnam(USERNAME)
+	environment = seat_supervisor._get_environment(user, Seat(USERNAME, ":3"), None)
+	assert environment["DISPLAY"] == ":3"
+	assert environment["HOME"] == user.pw_dir
+	assert "XAUTHORITY" not in environment
+	assert seat_supervisor._get_environment(user, Seat(USERNAME, ":3", "/a"), "/b")["XAUTHORITY"] == "/b"
+
+
+def test_copies_xauthority_privately(seat_supervisor: Supervisor, tmp_path: str) -> None:
+	path = os.path.join(str(tmp_path), "xauth")
+	with open(path, "wb") as f:
+		f.write(b"cookie")
+	copy_path = seat_supervisor._copy_xauthority(pwd.getpwnam(USERNAME), path)
+	try:
+		with open(copy_path, "rb") as f:
+			assert f.read() == b"cookie"
+		stat = os.stat(copy_path)
+		assert stat.st_uid == os.getuid()
+		assert stat.st_mode & 0o777 == 0o600
+	finally:
+		os.unlink(copy_path)
+
+
+def test_serves_seats_of_the_same_user_from_one_session(seat_supervisor: Supervisor, sesman: FakeSesman) -> None:
+	seats = [Seat(USERNAME, ":0"), Seat(USERNAME, ":1")]
+	assert asyncio.run(seat_supervisor.run(seats)) == 0
+	# The second seat waited for the first to launch the session, and found it
+	assert len(sesman.sessions) == 1
+
+
+def test_reuses_existing_session(seat_supervisor: Supervisor, sesman: FakeSesman) -> None:
+	sesman.add_session(USERNAME, 10)
+	assert asyncio.run(seat_supervisor.run_seat(Seat(USERNAME, ":0"))) == 0
+	assert len(sesman.sessions) == 1
+
+
+def test_reports_seat_failures(seat_supervisor: Supervisor) -> None:
+	assert asyncio.run(seat_supervisor.run([Seat(USERNAME, ":0"), Seat("no-such-user-xrdp", ":1")])) == 1
@@ -0,0 +1,127 @@
+import io
+import os
+import pwd
+
+import pytest
+
+from xrdp_local_session.common.xrdp import SesmanClient, SessionIndex, XRDPSession, parse_session_listing
+
+from .stand_ins.fake_sesman import (
+	SCP_CLOSE_CONNECTION_REQUEST,
+	SCP_CREATE_SESSION_REQUEST,
+	SCP_LIST_SESSIONS_REQUEST,
+	SCP_UDS_LOGIN_REQUEST,
+	FakeScpServer,
+	FakeSesman,
+)
+
+USERNAME = pwd.getpwuid(os.getuid()).pw_name
+
+LISTING = """\
+Session ID: 1
+	Display: :10
+	User: alice
+	Session type: Xorg
+	Screen size: 1920x1080, color depth 24
+Session ID: 2
+	Display: :11
+	User: bob
+	Session type: Xorg
+"""
+
+
+def test_parses_listing() -> None:
+	assert list(parse_session_listing(io.StringIO(LISTING))) == [
+		XRDPSession(1, 10, "alice", "Xorg"),
+		XRDPSession(2, 11, "bob", "Xorg"),
+	]
+
+
+def test_parses_empty_listing() -> None:
+	assert list(parse_session_listing(io.StringIO("No sessions.\n"))) == []
+
+
+def test_rejects_incomplete_session() -> None:
+	sessions = parse_session_listing(io.StringIO("Session ID: 1\n\tDisplay: :10\nSession ID: 2\n"))
+	with pytest.raises(ValueError, match="session 1"):
+		next(sessions)
+
+
+def test_lookup_of_missing_user_fills_index(sesman: FakeSesman) -> None:
+	sesman.add_sessions([("alice", 10), ("bob", 11)])
+	client = SesmanClient(USERNAME)
+	assert client.find_session_by_username("carol") is None
+	# Read to the end, so answered from the index from now on
+	assert client.find_session_by_username("bob") == XRDPSession(2, 11, "bob", "Xorg")
+	assert (client.index_hits, client.index_misses) == (1, 1)
+
+
+def test_lookup_stopping_early_does_not_fill_index(sesman: FakeSesman) -> None:
+	sesman.add_sessions([("alice", 10), ("bob", 11)])
+	client = SesmanClient(USERNAME)
+	assert client.find_session_by_username("alice") == XRDPSession(1, 10, "alice", "Xorg")
+	assert client.find_session_by_username("bob") == XRDPSession(2, 11, "bob", "Xorg")
+	assert (client.index_hits, client.index_misses) == (0, 2)
+
+
+def test_index_serves_repeated_lookups(sesman: FakeSesman) -> None:
+	sesman.add_sessions([("alice", 10)])
+	client = SesmanClient(USERNAME)
+	for _ in range(3):
+		assert client.get_index().by_username.get("alice") == XRDPSession(1, 10, "alice", "Xorg")
+	assert (client.index_hits, client.index_misses) == (2, 1)
+
+
+def test_index_keeps_first_match() -> None:
+	first = XRDPSession(1, 10, "alice", "Xorg")
+	second = XRDPSession(2, 11, "alice", "Xorg")
+	index = SessionIndex([first, second])
+	assert index.by_username["alice"] == first
+	assert index.by_display[11] == second
+	assert index.by_session_id[2] == second
+	assert index.is_fresh(60) is True
+	assert index.is_fresh(0) is False
+
+
+def requests(server: FakeScpServer) -> list[int]:
+	# Connections are closed without waiting for sesman, so it may not have
+	# seen the last close request yet
+	return [request for request in server.requests if request != SCP_CLOSE_CONNECTION_REQUEST]
+
+
+def test_lists_own_sessions_through_socket(sesman: FakeSesman, scp_server: FakeScpServer) -> None:
+	sesman.add_sessions([("alice", 10)])
+	sesman.add_session(USERNAME, 11)
+	client = SesmanClient(USERNAME, socket_path=scp_server.socket_path)
+	# Only our own session, unlike xrdp-sesadmin would list
+	assert client.get_sessions() == [XRDPSession(2, 11, USERNAME, "Xorg")]
+	assert requests(scp_server) == [SCP_UDS_LOGIN_REQUEST, SCP_LIST_SESSIONS_REQUEST]
+
+
+def test_launches_session_through_socket(sesman: FakeSesman, scp_server: FakeScpServer) -> None:
+	client = SesmanClient(USERNAME, socket_path=scp_server.socket_path)
+	assert client.launch_new_session() == XRDPSession(1, 10, USERNAME, "Xorg")
+	assert requests(scp_server) == [SCP_UDS_LOGIN_REQUEST, SCP_CREATE_SESSION_REQUEST, SCP_UDS_LOGIN_REQUEST, SCP_LIST_SESSIONS_REQUEST]
+
+
+def test_falls_back_without_socket(sesman: FakeSesman, tmp_path: str) -> None:
+	sesman.add_sessions([("alice", 10)])
+	client = SesmanClient(USERNAME, socket_path=os.path.join(str(tmp_path), "missing.socket"))
+	assert client.get_sessions() == [XRDPSession(1, 10, "alice", "Xorg")]
+	assert client.launch_new_session() == XRDPSession(2, 11, USERNAME, "Xorg")
+
+
+def test_falls_back_when_login_is_refused(sesman: FakeSesman, scp_server: FakeScpServer) -> None:
+	scp_server.login_status = 1
+	client = SesmanClient(USERNAME, socket_path=scp_server.socket_path)
+	assert client.launch_new_session() == XRDPSession(1, 10, USERNAME, "Xorg")
+	assert SCP_CREATE_SESSION_REQUEST not in scp_server.requests
+
+
+def test_does_not_fall_back_once_asked_to_create(sesman: FakeSesman, scp_server: FakeScpServer) -> None:
+	# xrdp-sesrun could launch a second session
+	scp_server.drop_on = SCP_CREATE_SESSION_REQUEST
+	client = SesmanClient(USERNAME, socket_path=scp_server.socket_path)
+	with pytest.raises(RuntimeError, match="Failed to launch"):
+		client.launch_new_session()
+	assert sesman.sessions == []
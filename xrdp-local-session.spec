@@ -9,6 +9,7 @@ Source0:        %{name}-%{version}.tar.gz
 
 BuildRequires:  python3-setuptools
 BuildRequires:  pyproject-rpm-macros
+BuildRequires:  systemd-rpm-macros
 
 Requires:       python3
 Requires:       python3-psutil
@@ -45,14 +46,28 @@ cp xrdp-local-session.desktop %{buildroot}/%{_datadir}/xsessions/
 mkdir -p %{buildroot}/usr/share/doc/%{name}
 cp README.md %{buildroot}/usr/share/doc/%{name}/
 cp COPYING %{buildroot}/usr/share/doc/%{name}/
+mkdir -p %{buildroot}/%{_unitdir}
+cp systemd/xrdp-local-session-broker.socket systemd/xrdp-local-session-broker.service %{buildroot}/%{_unitdir}/
+cp systemd/xrdp-local-session-prewarm.service systemd/xrdp-local-session-prewarm.timer %{buildroot}/%{_unitdir}/
+mkdir -p %{buildroot}/usr/share/doc/%{name}/examples
+cp examples/xrdp-local-session-prewarm-hook %{buildroot}/usr/share/doc/%{name}/examples/
 
 cat %{pyproject_files}
 %files -f "%{pyproject_files}"
 %{_bindir}/xrdp_local_session
 %{_bindir}/xrdp_local_session_session_closer
+%{_bindir}/xrdp_local_session_broker
+%{_bindir}/xrdp_local_session_supervisor
+%{_bindir}/xrdp_local_session_prewarm
+%{_bindir}/xrdp_local_session_active_markers
 %{_datadir}/xsessions/xrdp-local-session.desktop
+%{_unitdir}/xrdp-local-session-broker.socket
+%{_unitdir}/xrdp-local-session-broker.service
+%{_unitdir}/xrdp-local-session-prewarm.service
+%{_unitdir}/xrdp-local-session-prewarm.timer
 %{_datadir}/doc/%{name}/README.md
 %{_datadir}/doc/%{name}/COPYING
+%{_datadir}/doc/%{name}/examples/xrdp-local-session-prewarm-hook
 
 %changelog
 * Fri Aug 15 2025 Shaul Kremer <shaulk@users.noreply.github.com> - 0.10.4-1
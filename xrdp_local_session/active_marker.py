@@ -1,23 +1,127 @@
 import os
+import pwd
+import json
 import logging
-from typing import Optional, Type
+from typing import NamedTuple, Optional, Type
 from types import TracebackType
+
+import typer
+
+from . import timing
 from .config import Settings
+from .consts import SYSTEM_CONFIG_FILE
 from .common.xrdp import XRDPSession
 
+# Markers are written to a hidden temporary file first and renamed into place,
+# so anyone watching the directory sees them appear complete.
+TEMPORARY_MARKER_PREFIX = "."
+
+
+def _get_process_start_time(pid: int) -> Optional[int]:
+	# Field 22 of /proc/<pid>/stat, in clock ticks since boot. Together with the
+	# pid it identifies a process even if the pid is reused.
+	try:
+		with open(f"/proc/{pid}/stat", "r") as f:
+			stat = f.read()
+	except OSError:
+		return None
+	# The command name may contain spaces, so we split after its closing paren
+	return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+class MarkerInfo(NamedTuple):
+	path: str
+	pid: Optional[int]
+	start_time: Optional[int]
+	username: Optional[str]
+	uid: Optional[int]
+	x11_display: Optional[int]
+	session_id: Optional[int]
+
+	@property
+	def is_stale(self) -> bool:
+		# Markers we can't read (e.g. created by older versions), or whose
+		# owner couldn't determine its own start time, are assumed to be
+		# active.
+		if self.pid is None or self.start_time is None:
+			return False
+		return _get_process_start_time(self.pid) != self.start_time
+
+
+def read_marker(path: str) -> MarkerInfo:
+	try:
+		with open(path, "r") as f:
+			content = json.load(f)
+	except (OSError, ValueError):
+		content = {}
+	if not isinstance(content, dict):
+		content = {}
+	return MarkerInfo(
+		path=path,
+		pid=content.get("pid"),
+		start_time=content.get("start_time"),
+		username=content.get("username"),
+		uid=content.get("uid"),
+		x11_display=content.get("x11_display"),
+		session_id=content.get("session_id"),
+	)
+
+
+def list_markers(directory: str, uid: Optional[int]=None) -> list[MarkerInfo]:
+	"""
+	List the markers in the directory, or only those whose file is owned by the
+	given user.
+	"""
+	result = []
+	with os.scandir(directory) as entries:
+		for entry in entries:
+			if entry.name.startswith(TEMPORARY_MARKER_PREFIX) or not entry.is_file(follow_symlinks=False):
+				continue
+			if uid is not None and entry.stat(follow_symlinks=False).st_uid != uid:
+				continue
+			result.append(read_marker(entry.path))
+	return result
+
+
+def reap_stale_markers(directory: str, uid: Optional[int]=None) -> list[MarkerInfo]:
+	"""
+	Remove markers left behind by processes that no longer exist (only those
+	owned by the given user, if any), returning the markers that were removed.
+	Markers we're not allowed to remove are skipped.
+	"""
+	reaped = []
+	for marker in list_markers(directory, uid):
+		if marker.is_stale is False:
+			continue
+		try:
+			os.unlink(marker.path)
+		except (FileNotFoundError, PermissionError):
+			continue
+		reaped.append(marker)
+	return reaped
+
+
+def list_active_markers(directory: str) -> list[MarkerInfo]:
+	return [marker for marker in list_markers(directory) if marker.is_stale is False]
+
+
 class ActiveMarker:
 	def __init__(self, settings: Settings, session: XRDPSession) -> None:
 		self._settings = settings
 		self._session = session
 		self._logger = logging.getLogger("xrdp_local_session.active_marker")
 
+	@property
+	def _uid(self) -> int:
+		return pwd.getpwnam(self._session.username).pw_uid
+
 	@property
 	def _filename(self) -> str:
 		return self._settings.local_active_marker_filename_format.format(
 			username=self._session.username,
 			x11_display=self._session.display,
 			logind_session_id=self._session.session_id,
-			uid=os.getuid(),
+			uid=self._uid,
 		)
 
 	def _set(self) -> None:
@@ -25,14 +129,43 @@ class ActiveMarker:
 			return
 
 		full_path = os.path.join(self._settings.local_active_marker_directory, self._filename)
+		temporary_path = os.path.join(self._settings.local_active_marker_directory, f"{TEMPORARY_MARKER_PREFIX}{self._filename}.{os.getpid()}")
 		try:
-			fd = os.open(full_path, os.O_CREAT | os.O_WRONLY, 0o600)
-			os.close(fd)
+			with timing.span("active_marker.set"):
+				# We record who owns the marker, so it can be reaped if we die
+				# without removing it.
+				content = {
+					"pid": os.getpid(),
+					"start_time": _get_process_start_time(os.getpid()),
+					"username": self._session.username,
+					"uid": self._uid,
+					"x11_display": self._session.display,
+					"session_id": self._session.session_id,
+				}
+				# Readable by everyone, so any login or the CLI can tell whether
+				# it's stale. The directory's sticky bit keeps others from
+				# removing it while it isn't.
+				fd = os.open(temporary_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644)
+				with os.fdopen(fd, "w") as f:
+					json.dump(content, f)
+				os.rename(temporary_path, full_path)
 		except Exception as e:
 			self._logger.warning("Failed to create active marker file %s: %s", full_path, e)
+			if os.path.exists(temporary_path):
+				os.unlink(temporary_path)
 			if self._settings.local_active_marker_mandatory is True:
 				raise
 
+		# Once our own marker is in place, so it doesn't delay it. We can only
+		# remove our own markers from a sticky directory, so we don't bother
+		# reading anyone else's (root can remove them all).
+		uid = os.getuid()
+		try:
+			for marker in reap_stale_markers(self._settings.local_active_marker_directory, None if uid == 0 else uid):
+				self._logger.info("Removed stale active marker %s of process %s", marker.path, marker.pid)
+		except OSError as e:
+			self._logger.warning("Failed to remove stale active markers: %s", e)
+
 	def _unset(self) -> None:
 		if self._settings.local_active_marker_directory is None:
 			return
@@ -46,3 +179,31 @@ class ActiveMarker:
 
 	def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> None:
 		self._unset()
+
+
+def typer_main(
+	settings_file: str = typer.Option(SYSTEM_CONFIG_FILE, "-c", "--config-file", help="Path to the global configuration file"),
+	reap: bool = typer.Option(False, "-r", "--reap", help="Remove stale markers before listing"),
+	as_json: bool = typer.Option(False, "-j", "--json", help="Print one JSON object per marker"),
+) -> None:
+	"""
+	List the local connections currently marked as active.
+	"""
+	settings = Settings.load_from_file(settings_file)
+	if settings.local_active_marker_directory is None:
+		raise typer.BadParameter("local_active_marker_directory is not configured")
+
+	if reap is True:
+		reap_stale_markers(settings.local_active_marker_directory)
+	for marker in list_active_markers(settings.local_active_marker_directory):
+		if as_json is True:
+			print(json.dumps(marker._asdict()))
+		else:
+			print(marker.path, marker.username or "-", marker.x11_display if marker.x11_display is not None else "-", marker.pid or "-")
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+if __name__ == "__main__":
+	main()
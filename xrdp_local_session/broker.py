@@ -0,0 +1,289 @@
+"""
+An optional long-running broker that answers session lookups for
+xrdp_local_session over a Unix socket.
+
+Without the broker, every local login loads the configuration, connects to the
+system bus, enumerates sesman sessions and probes for the xorgxrdp socket from
+scratch. The broker keeps all of that warm, so xrdp_local_session only has to
+send a single request and gets back the xrdp session, its socket path and the
+logind sessions to unlock once xrdp_local connects.
+
+The broker runs as root, either standalone or socket-activated by systemd, and
+answers requests only for the user connecting to it (or any user for root).
+With logind support enabled, it watches logind and refreshes each user's
+session index in the background whenever a session starts or ends, so lookups
+don't have to wait for sesman.
+
+The protocol is a single JSON object per line in each direction. Requests look
+like {"username": "alice", "create_new_session": true}, and responses contain
+either "error" or "session", "is_existing_session", "socket_path" and
+"unlock_targets".
+"""
+
+from __future__ import annotations
+
+import os
+import pwd
+import json
+import socket
+import struct
+import logging
+import threading
+import socketserver
+from typing import TYPE_CHECKING, Any, Optional
+
+import typer
+
+from .consts import SYSTEM_CONFIG_FILE, BROKER_SOCKET_PATH
+from .config import SettingsLoader
+from .common.xrdp import SESSION_INDEX_TTL, SesmanClient, XRDPSession
+from .session_lookup import SessionService, get_session
+
+if TYPE_CHECKING:
+	from .common.logind_watcher import LogindWatcher
+
+# The first file descriptor passed by systemd socket activation
+SD_LISTEN_FDS_START = 3
+
+# Requests are tiny, anything larger is a misbehaving client
+MAX_REQUEST_SIZE = 4096
+
+# While logind is watched, indexes are refreshed as sessions start and end, so
+# they're trusted for longer. The TTL still bounds how stale an index can get
+# if a signal is missed.
+WATCHED_INDEX_TTL = 60.0
+
+
+class BrokerError(Exception):
+	pass
+
+
+class BrokerUnavailableError(BrokerError):
+	"""
+	The broker couldn't be reached, so the request was never sent and it's safe
+	to look the session up without it.
+	"""
+	pass
+
+
+class BrokerReply:
+	def __init__(self, session: XRDPSession, is_existing_session: bool, socket_path: str, unlock_targets: list[dict[str, Any]]) -> None:
+		self.session = session
+		self.is_existing_session = is_existing_session
+		self.socket_path = socket_path
+		self.unlock_targets = unlock_targets
+
+
+class Broker(SessionService):
+	def __init__(self, settings_loader: SettingsLoader) -> None:
+		# Enabling logind requires a restart, everything else is picked up
+		# from the configuration file on the next request.
+		super().__init__(settings_loader)
+		self._logger = logging.getLogger("xrdp_local_session.broker")
+		self._sesman_clients: dict[str, SesmanClient] = {}
+		self._user_locks: dict[str, threading.Lock] = {}
+		self._lock = threading.Lock()
+		self._index_ttl = SESSION_INDEX_TTL
+		self._watcher: Optional[LogindWatcher] = None
+		self._refresh_needed = threading.Event()
+		self._closed = False
+
+	def watch(self) -> None:
+		"""
+		Refresh the session indexes in the background whenever logind reports a
+		session starting or ending, which xrdp sessions do along with theirs.
+		Called before serving, as it only applies to users looked up later.
+		"""
+		if self.logind_client is None:
+			return
+		try:
+			self._watcher = self.logind_client.subscribe()
+		except RuntimeError as e:
+			self._logger.warning("Not watching logind, session indexes will be refreshed on lookups: %s", e)
+			return
+		self._watcher.add_new_listener(self._on_session_changed)
+		self._watcher.add_removed_listener(self._on_session_changed)
+		self._index_ttl = WATCHED_INDEX_TTL
+		threading.Thread(target=self._refresh_indexes, name="index-refresh", daemon=True).start()
+
+	def close(self) -> None:
+		self._closed = True
+		self._refresh_needed.set()
+		if self._watcher is not None:
+			self._watcher.close()
+			self._watcher = None
+
+	def _on_session_changed(self, session_path: str) -> None:
+		# Called from the watcher's thread. Dropping an index is a single
+		# assignment, so it doesn't wait for requests holding the user's lock.
+		with self._lock:
+			clients = list(self._sesman_clients.values())
+		for sesman_client in clients:
+			sesman_client.invalidate()
+		self._refresh_needed.set()
+
+	def _refresh_indexes(self) -> None:
+		while True:
+			self._refresh_needed.wait()
+			if self._closed is True:
+				return
+			self._refresh_needed.clear()
+			with self._lock:
+				users = [(username, self._sesman_clients[username], self._user_locks[username]) for username in self._sesman_clients]
+			for username, sesman_client, user_lock in users:
+				with user_lock:
+					try:
+						sesman_client.get_index()
+					except Exception as e:
+						self._logger.warning("Failed to refresh the sessions of %s: %s", username, e)
+
+	def _get_sesman_client(self, username: str) -> tuple[SesmanClient, threading.Lock]:
+		# One client per user, so each user's session index survives between
+		# logins. SesmanClient isn't thread-safe, and two concurrent requests
+		# could both find no session and launch one each, so each user's
+		# requests are serialized by the returned lock.
+		with self._lock:
+			if username not in self._sesman_clients:
+				self._sesman_clients[username] = SesmanClient(username, self._index_ttl, self._settings.sesman_socket_path)
+				self._user_locks[username] = threading.Lock()
+			return self._sesman_clients[username], self._user_locks[username]
+
+	def handle_request(self, request: dict[str, Any], peer_uid: int) -> dict[str, Any]:
+		username = request.get("username")
+		if not isinstance(username, str):
+			raise BrokerError("Missing username")
+		try:
+			user = pwd.getpwnam(username)
+		except KeyError:
+			raise BrokerError(f"Unknown user {username}")
+		if peer_uid != 0 and peer_uid != user.pw_uid:
+			raise BrokerError(f"Not allowed to look up sessions for {username}")
+
+		settings = self._settings
+		sesman_client, user_lock = self._get_sesman_client(username)
+		with user_lock:
+			try:
+				session, is_existing_session = get_session(sesman_client, username, self._logger, create_new_session=request.get("create_new_session", True) is True, indexed=True)
+			except KeyError as e:
+				raise BrokerError(e.args[0])
+			socket_path = sesman_client.get_socket_path_for_session(session, settings.xrdp_socket_wait_timeout)
+
+		unlock_targets = []
+		if self.logind_client is not None and is_existing_session is True and settings.unlock_on_local_connection is True:
+			unlock_targets = [
+				logind_session._asdict()
+				for logind_session in self.logind_client.find_xrdp_sessions(user.pw_uid, session.display)
+			]
+
+		return {
+			"session": session._asdict(),
+			"is_existing_session": is_existing_session,
+			"socket_path": socket_path,
+			"unlock_targets": unlock_targets,
+		}
+
+
+class _BrokerRequestHandler(socketserver.StreamRequestHandler):
+	server: "BrokerServer"
+
+	def handle(self) -> None:
+		creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+		_, peer_uid, _ = struct.unpack("3i", creds)
+		line = self.rfile.readline(MAX_REQUEST_SIZE)
+		try:
+			response = self.server.broker.handle_request(json.loads(line), peer_uid)
+		except Exception as e:
+			self.server.broker._logger.warning("Request from uid %d failed: %s", peer_uid, e)
+			response = {"error": str(e)}
+		self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class BrokerServer(socketserver.ThreadingUnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, broker: Broker, socket_path: str) -> None:
+		self.broker = broker
+		listen_fds = _get_systemd_listen_fds()
+		if listen_fds > 0:
+			super().__init__(socket_path, _BrokerRequestHandler, bind_and_activate=False)
+			self.socket.close()
+			self.socket = socket.socket(fileno=SD_LISTEN_FDS_START)
+			return
+		os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+		if os.path.exists(socket_path):
+			os.unlink(socket_path)
+		super().__init__(socket_path, _BrokerRequestHandler)
+		# Peers are authenticated by their credentials, not by file permissions
+		os.chmod(socket_path, 0o666)
+
+
+def _get_systemd_listen_fds() -> int:
+	if os.environ.get("LISTEN_PID") != str(os.getpid()):
+		return 0
+	return int(os.environ.get("LISTEN_FDS", "0"))
+
+
+class BrokerClient:
+	def __init__(self, socket_path: str, connect_timeout: float, reply_timeout: Optional[float]) -> None:
+		self._socket_path = socket_path
+		self._connect_timeout = connect_timeout
+		self._reply_timeout = reply_timeout
+
+	def lookup(self, username: str, *, create_new_session: bool=True) -> BrokerReply:
+		request = {"username": username, "create_new_session": create_new_session}
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			sock.settimeout(self._connect_timeout)
+			try:
+				sock.connect(self._socket_path)
+			except OSError as e:
+				raise BrokerUnavailableError(f"Failed to connect to the broker at {self._socket_path}: {e}")
+			# Once sent, the broker may be launching a session for us, which
+			# can take much longer than connecting.
+			sock.settimeout(self._reply_timeout)
+			sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+			with sock.makefile("rb") as f:
+				line = f.readline()
+		if len(line) == 0:
+			raise BrokerError("Broker closed the connection without replying")
+		response = json.loads(line)
+		if "error" in response:
+			raise BrokerError(response["error"])
+		return BrokerReply(
+			session=XRDPSession(**response["session"]),
+			is_existing_session=response["is_existing_session"],
+			socket_path=response["socket_path"],
+			unlock_targets=response["unlock_targets"],
+		)
+
+
+def typer_main(
+	settings_file: str = typer.Option(SYSTEM_CONFIG_FILE, "-c", "--config-file", help="Path to the global configuration file"),
+	verbose: bool = typer.Option(False, "-v", "--verbose", help="Verbose logging to stderr"),
+	socket_path: Optional[str] = typer.Option(None, "-s", "--socket", help="Path of the socket to listen on, overriding the configuration file"),
+) -> None:
+	"""
+	Run the xrdp_local_session broker, answering session lookups for
+	xrdp_local_session over a Unix socket.
+	"""
+	settings_loader = SettingsLoader(settings_file)
+	settings = settings_loader.settings
+	level = logging.INFO
+	if verbose is True or settings.verbose is True:
+		level = logging.DEBUG
+	logging.basicConfig(level=level)
+
+	broker = Broker(settings_loader)
+	broker.watch()
+	try:
+		with BrokerServer(broker, socket_path or settings.broker_socket_path or BROKER_SOCKET_PATH) as server:
+			logging.info("Broker listening")
+			server.serve_forever()
+	finally:
+		broker.close()
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,21 @@
+import os
+import dbus
+
+SERVICE_DISPLAY_MANAGER = 'org.freedesktop.DisplayManager'
+INTERFACE_DISPLAY_MANAGER_SEAT = 'org.freedesktop.DisplayManager.Seat'
+
+
+def switch_to_greeter(bus: dbus.Bus) -> bool:
+	"""
+	Ask the display manager to show its greeter on our seat, returning False if
+	the display manager doesn't support it.
+
+	This uses the org.freedesktop.DisplayManager API, which LightDM and SDDM
+	implement, and which they point sessions to through XDG_SEAT_PATH.
+	"""
+	seat_path = os.environ.get("XDG_SEAT_PATH")
+	if seat_path is None:
+		return False
+	seat = bus.get_object(SERVICE_DISPLAY_MANAGER, seat_path)
+	seat.SwitchToGreeter(dbus_interface=INTERFACE_DISPLAY_MANAGER_SEAT)
+	return True
@@ -0,0 +1,104 @@
+import os
+import time
+import ctypes
+import select
+import logging
+from typing import Optional
+
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Used when inotify isn't available
+FALLBACK_POLL_INTERVAL = 0.05
+
+_logger = logging.getLogger("xrdp_local_session.common.inotify")
+_libc: Optional[ctypes.CDLL] = None
+
+
+def _get_libc() -> ctypes.CDLL:
+	global _libc
+	if _libc is None:
+		_libc = ctypes.CDLL(None, use_errno=True)
+	return _libc
+
+
+def _existing_ancestor(path: str) -> str:
+	directory = os.path.dirname(path)
+	while not os.path.isdir(directory):
+		directory = os.path.dirname(directory)
+	return directory
+
+
+def _first_existing(paths: list[str]) -> Optional[str]:
+	for path in paths:
+		if os.path.exists(path):
+			return path
+	return None
+
+
+def _poll_for_any_path(paths: list[str], deadline: float) -> Optional[str]:
+	while time.monotonic() < deadline:
+		time.sleep(FALLBACK_POLL_INTERVAL)
+		if (found := _first_existing(paths)) is not None:
+			return found
+	return None
+
+
+def wait_for_any_path(paths: list[str], timeout: float) -> Optional[str]:
+	"""
+	Wait until one of the paths exists, returning it, or None if none appeared
+	within the timeout.
+
+	The deepest existing ancestor directory of each path is watched with
+	inotify, so this wakes up as soon as the path, or any directory leading to
+	it, is created.
+	"""
+	if (found := _first_existing(paths)) is not None:
+		return found
+	deadline = time.monotonic() + timeout
+
+	try:
+		fd = _get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+	except (OSError, AttributeError) as e:
+		_logger.debug("inotify is not available, polling instead: %s", e)
+		fd = -1
+	if fd < 0:
+		return _poll_for_any_path(paths, deadline)
+
+	try:
+		watched: set[str] = set()
+		while True:
+			# Directories may have been created since the last round, so we
+			# move our watches down the tree as far as it exists.
+			for path in paths:
+				directory = _existing_ancestor(path)
+				if directory in watched:
+					continue
+				if _get_libc().inotify_add_watch(fd, directory.encode(), IN_CREATE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF) < 0:
+					# e.g. EACCES on a restricted directory, or ENOSPC when
+					# we're out of watches
+					error = ctypes.get_errno()
+					_logger.debug("Failed to watch %s, polling instead: %s", directory, os.strerror(error))
+					return _poll_for_any_path(paths, deadline)
+				watched.add(directory)
+			# Checked after adding the watches so we can't miss a creation in
+			# between
+			if (found := _first_existing(paths)) is not None:
+				return found
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				return None
+			readable, _, _ = select.select([fd], [], [], remaining)
+			if len(readable) > 0:
+				try:
+					# We only care that something happened, not what
+					while len(os.read(fd, 4096)) > 0:
+						pass
+				except BlockingIOError:
+					pass
+	finally:
+		os.close(fd)
@@ -1,29 +1,44 @@
+from __future__ import annotations
+
 import re
 import time
 import dbus
 import signal
 import logging
-import psutil
-from typing import Optional
-from pydantic import BaseModel
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, NamedTuple, Optional
 
+from .. import timing
 from ..config import Settings
 from ..consts import SYSTEM_CONFIG_FILE
 
+if TYPE_CHECKING:
+	from .process_table import ProcessTable
+	from .logind_watcher import LogindWatcher
+
 SERVICE_LOGIN = 'org.freedesktop.login1'
 INTERFACE_DBUS_PROPERTIES = 'org.freedesktop.DBus.Properties'
 INTERFACE_LOGIN_USER = 'org.freedesktop.login1.User'
 INTERFACE_LOGIN_SESSION = 'org.freedesktop.login1.Session'
 INTERFACE_LOGIN_MANAGER = 'org.freedesktop.login1.Manager'
 
+# Upper bound on concurrent property fetches when taking a snapshot of a user's
+# sessions. Users rarely have more than a handful of sessions.
+MAX_SESSION_FETCH_WORKERS = 8
+
+LOGIN_MANAGER_PATH = '/org/freedesktop/login1'
 
-class LogindSession(BaseModel):
+
+class LogindSession(NamedTuple):
 	dbus_path: str
 	service_name: str
 	class_: str
 	display: Optional[int]
 	type: str
 	leader: int
+	state: str = ""
+	locked_hint: bool = False
 
 	@property
 	def id(self) -> str:
@@ -35,87 +50,151 @@ class LogindSession(BaseModel):
 		raise ValueError(f"Invalid session basename: {basename}")
 
 
+class UnlockResult(NamedTuple):
+	unlocked: list[str]
+	failed: dict[str, str]
+
+	@property
+	def success(self) -> bool:
+		return len(self.failed) == 0
+
+
 class LogindClient:
 	def __init__(self, settings: Settings):
 		self.bus = dbus.SystemBus()
 		self.settings = settings
 		self._logger = logging.getLogger("xrdp_local_session.common.logind")
+		# Proxies are cached by object path, and dropped once logind reports
+		# the object gone. Sessions are fetched and unlocked from thread
+		# pools, so the cache and counters are guarded by a lock.
+		self._proxies: dict[str, dbus.proxies.ProxyObject] = {}
+		self._lock = threading.Lock()
+		# Every proxy lookup precedes exactly one method call, so this also
+		# counts our calls to logind. A cache miss costs an extra round trip
+		# to introspect the object.
+		self.bus_calls = 0
+		self.proxy_cache_hits = 0
+		self.proxy_cache_misses = 0
+
+	def _get_proxy(self, dbus_path: str) -> dbus.proxies.ProxyObject:
+		with self._lock:
+			self.bus_calls += 1
+			proxy = self._proxies.get(dbus_path)
+			if proxy is not None:
+				self.proxy_cache_hits += 1
+				return proxy
+			self.proxy_cache_misses += 1
+		# Created outside the lock, a concurrent miss for the same path merely
+		# creates an equivalent proxy.
+		proxy = self.bus.get_object(SERVICE_LOGIN, dbus_path)
+		with self._lock:
+			return self._proxies.setdefault(dbus_path, proxy)
+
+	def invalidate(self, dbus_path: str) -> None:
+		with self._lock:
+			self._proxies.pop(dbus_path, None)
 
 	def get_sessions_for_user(self, uid: int) -> list[str]:
-		proxy = self.bus.get_object(SERVICE_LOGIN, f'/org/freedesktop/login1/user/_{uid}')
+		user_path = f'{LOGIN_MANAGER_PATH}/user/_{uid}'
+		proxy = self._get_proxy(user_path)
 		try:
 			sessions = proxy.Get(INTERFACE_LOGIN_USER, "Sessions", dbus_interface=INTERFACE_DBUS_PROPERTIES)
 			return [session[1] for session in sessions]
 		except dbus.DBusException as e:
 			if e.get_dbus_name() == 'org.freedesktop.DBus.Error.UnknownObject':
+				self.invalidate(user_path)
 				return []
 			raise
 
 	def get_session(self, dbus_path: str) -> LogindSession:
-		proxy = self.bus.get_object(SERVICE_LOGIN, dbus_path)
+		proxy = self._get_proxy(dbus_path)
 		try:
-			display_str = proxy.Get(INTERFACE_LOGIN_SESSION, "Display", dbus_interface=INTERFACE_DBUS_PROPERTIES)
-			display = None
-			if r := re.match(r"^:(\d+)$", display_str):
-				display = int(r.group(1))
-			return LogindSession(
-				dbus_path=dbus_path,
-				service_name=proxy.Get(INTERFACE_LOGIN_SESSION, "Service", dbus_interface=INTERFACE_DBUS_PROPERTIES),
-				class_=proxy.Get(INTERFACE_LOGIN_SESSION, "Class", dbus_interface=INTERFACE_DBUS_PROPERTIES),
-				display=display,
-				type=proxy.Get(INTERFACE_LOGIN_SESSION, "Type", dbus_interface=INTERFACE_DBUS_PROPERTIES),
-				leader=proxy.Get(INTERFACE_LOGIN_SESSION, "Leader", dbus_interface=INTERFACE_DBUS_PROPERTIES),
-			)
+			# A single GetAll is one round trip instead of one per property
+			properties = proxy.GetAll(INTERFACE_LOGIN_SESSION, dbus_interface=INTERFACE_DBUS_PROPERTIES)
 		except dbus.DBusException as e:
 			if e.get_dbus_name() == 'org.freedesktop.DBus.Error.UnknownObject':
+				self.invalidate(dbus_path)
 				raise KeyError(f"Session {dbus_path} not found")
 			raise
+		display = None
+		if r := re.match(r"^:(\d+)$", str(properties["Display"])):
+			display = int(r.group(1))
+		return LogindSession(
+			dbus_path=dbus_path,
+			service_name=str(properties["Service"]),
+			class_=str(properties["Class"]),
+			display=display,
+			type=str(properties["Type"]),
+			leader=int(properties["Leader"]),
+			state=str(properties.get("State", "")),
+			locked_hint=bool(properties.get("LockedHint", False)),
+		)
+
+	def get_session_snapshot(self, uid: int) -> list[LogindSession]:
+		# Sessions are queried concurrently, and ones that disappear while we
+		# take the snapshot are skipped.
+		with timing.span("logind.session_snapshot"):
+			session_paths = self.get_sessions_for_user(uid)
+			if len(session_paths) == 0:
+				return []
+
+			def fetch(session_path: str) -> Optional[LogindSession]:
+				try:
+					return self.get_session(session_path)
+				except KeyError:
+					return None
+
+			with ThreadPoolExecutor(max_workers=min(len(session_paths), MAX_SESSION_FETCH_WORKERS)) as executor:
+				sessions = executor.map(fetch, session_paths)
+				return [session for session in sessions if session is not None]
+
+	def subscribe(self) -> LogindWatcher:
+		# Imported here since watching requires PyGObject, which is optional
+		from .logind_watcher import LogindWatcher
+		watcher = LogindWatcher(self)
+		watcher.add_removed_listener(self.invalidate)
+		return watcher
 
 	def get_current_session(self) -> LogindSession:
-		proxy = self.bus.get_object(SERVICE_LOGIN, "/org/freedesktop/login1")
+		proxy = self._get_proxy(LOGIN_MANAGER_PATH)
 		session_path = str(proxy.GetSession("auto", dbus_interface=INTERFACE_LOGIN_MANAGER))
 		return self.get_session(session_path)
 
 	def close_session(self, session: LogindSession) -> None:
-		proxy = self.bus.get_object(SERVICE_LOGIN, session.dbus_path)
-		interface = dbus.Interface(proxy, INTERFACE_LOGIN_SESSION)
-		interface.Kill("all", signal.SIGTERM)
+		self._get_session_interface(session).Kill("all", signal.SIGTERM)
 		self._logger.info("Session %s closed", session.dbus_path)
 
-	def _get_subprocess_names(self, pid: int) -> set[str]:
-		try:
-			process = psutil.Process(pid)
-		except psutil.NoSuchProcess:
-			return set()
-		result = set()
-		for child in process.children():
-			result.add(child.name())
-			result |= self._get_subprocess_names(child.pid)
-		return result
-
-	def _wrong_session_workaround_process_allowlist(self) -> set[str]:
-		result = set(self.settings.xdg_wrong_session_workaround_process_allowlist)
-		for item in list(result):
-			if len(item) > 15:
-				result.add(item[:15])
-		return result
+	def _get_subprocess_names(self, pid: int, process_table: Optional[ProcessTable]) -> tuple[set[str], Optional[ProcessTable]]:
+		# Imported here so psutil is only loaded when the workaround needs it
+		from .process_table import ProcessTable, get_cgroup_process_names
+		if self.settings.xdg_wrong_session_workaround_use_cgroup is True:
+			names = get_cgroup_process_names(pid)
+			if names is not None:
+				return names, process_table
+			self._logger.debug("Could not read the cgroup of process %d, falling back to the process tree", pid)
+		# One snapshot of /proc serves all candidate sessions
+		if process_table is None:
+			with timing.span("logind.process_table"):
+				process_table = ProcessTable.from_proc()
+		return process_table.descendant_names(pid), process_table
 
 	def find_xrdp_sessions(self, uid: int, display: int) -> list[LogindSession]:
 		native_sessions = []
 		main_sessions = []
-		for session_path in self.get_sessions_for_user(uid):
-			try:
-				session = self.get_session(session_path)
-			except KeyError:
-				continue
+		process_table: Optional[ProcessTable] = None
+		for session in self.get_session_snapshot(uid):
+			session_path = session.dbus_path
 			self._logger.debug("Checking session %s", session)
 			if session.class_ == 'user' and session.type == 'x11':
 				if session.service_name == 'xrdp-sesman' and session.display == display:
 					self._logger.info("Found xrdp session for display %d at %s", display, session_path)
 					native_sessions.append(session)
-				elif self.settings.xdg_wrong_session_workaround_enabled is True and session.service_name in self.settings.xdg_wrong_session_workaround_dm_allowlist:
-					subprocess_names = self._get_subprocess_names(session.leader)
-					not_allowed_processes = subprocess_names - self._wrong_session_workaround_process_allowlist()
+				elif self.settings.xdg_wrong_session_workaround_enabled is True and (dm_rule := self.settings.dm_allowlist_matcher.match(session.service_name)) is not None:
+					self._logger.debug("Session %s service %s matched display manager rule %r", session_path, session.service_name, dm_rule)
+					subprocess_names, process_table = self._get_subprocess_names(session.leader, process_table)
+					allowed_processes, not_allowed_processes = self.settings.process_allowlist_matcher.match_all(subprocess_names)
+					for name, rule in allowed_processes.items():
+						self._logger.debug("Session %s process %s matched allowlist rule %r", session_path, name, rule)
 					if len(not_allowed_processes) > 0:
 						self._logger.info("Found a main session at %s but it has processes not in the allowlist, so not using it: %s", session_path, not_allowed_processes)
 						continue
@@ -124,15 +203,45 @@ class LogindClient:
 		return native_sessions + main_sessions
 
 	def _get_session_interface(self, session: LogindSession) -> dbus.proxies.Interface:
-		proxy = self.bus.get_object(SERVICE_LOGIN, session.dbus_path)
-		return dbus.Interface(proxy, INTERFACE_LOGIN_SESSION)
+		return dbus.Interface(self._get_proxy(session.dbus_path), INTERFACE_LOGIN_SESSION)
 
 	def lock_session(self, session: LogindSession) -> None:
 		self._get_session_interface(session).Lock()
 
-	def unlock_session(self, session: LogindSession) -> None:
+	def unlock_session(self, session: LogindSession, timeout: Optional[float]=None) -> None:
 		self._logger.info("Unlocking logind session for %s", session.dbus_path)
-		self._get_session_interface(session).Unlock()
+		if timeout is None:
+			self._get_session_interface(session).Unlock()
+		else:
+			self._get_session_interface(session).Unlock(timeout=timeout)
+
+	def unlock_sessions(self, sessions: list[LogindSession], timeout: float) -> UnlockResult:
+		# All unlocks are sent at once and share one deadline, and a failure of
+		# one session does not prevent unlocking the others.
+		result = UnlockResult(unlocked=[], failed={})
+		if len(sessions) == 0:
+			return result
+		with timing.span("logind.unlock_sessions", sessions=len(sessions)):
+			self._unlock_sessions(sessions, timeout, result)
+		return result
+
+	def _unlock_sessions(self, sessions: list[LogindSession], timeout: float, result: UnlockResult) -> None:
+		executor = ThreadPoolExecutor(max_workers=min(len(sessions), MAX_SESSION_FETCH_WORKERS))
+		try:
+			futures = {
+				executor.submit(self.unlock_session, session, timeout): session
+				for session in sessions
+			}
+			done, _ = wait(futures, timeout=timeout)
+			for future, session in futures.items():
+				if future not in done:
+					result.failed[session.id] = f"Timed out after {timeout} seconds"
+				elif (e := future.exception()) is not None:
+					result.failed[session.id] = str(e)
+				else:
+					result.unlocked.append(session.id)
+		finally:
+			executor.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == "__main__":
 	import os
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import dbus
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Optional
+from types import TracebackType
+
+from .logind import (
+	SERVICE_LOGIN,
+	INTERFACE_DBUS_PROPERTIES,
+	INTERFACE_LOGIN_MANAGER,
+	INTERFACE_LOGIN_SESSION,
+	LOGIN_MANAGER_PATH,
+	LogindSession,
+)
+
+if TYPE_CHECKING:
+	from .logind import LogindClient
+
+# Session properties we can apply straight from PropertiesChanged without
+# fetching the session again
+INCREMENTAL_PROPERTIES = {
+	"State": ("state", str),
+	"LockedHint": ("locked_hint", bool),
+}
+
+
+class LogindWatcher:
+	"""
+	An incrementally updated table of logind sessions, kept current by the
+	SessionNew, SessionRemoved and PropertiesChanged signals.
+
+	Signals are received on a private bus connection dispatched by a GLib main
+	loop in a background thread, so this requires PyGObject. Session properties
+	are fetched through the owning LogindClient.
+	"""
+
+	def __init__(self, client: LogindClient) -> None:
+		try:
+			from gi.repository import GLib
+			from dbus.mainloop.glib import DBusGMainLoop
+		except ImportError as e:
+			raise RuntimeError(f"Watching logind requires PyGObject: {e}")
+
+		self._client = client
+		self._logger = logging.getLogger("xrdp_local_session.common.logind_watcher")
+		self._condition = threading.Condition()
+		self._sessions: dict[str, LogindSession] = {}
+		self._new_listeners: list[Callable[[str], None]] = []
+		self._removed_listeners: list[Callable[[str], None]] = []
+
+		# dbus-python dispatches through the default GLib main context, which
+		# nothing else in this process runs, so we run it in our own thread.
+		self._loop = GLib.MainLoop()
+		self._bus = dbus.SystemBus(mainloop=DBusGMainLoop(), private=True)
+		# libdbus exits the process when a bus connection is closed, unless
+		# told otherwise
+		self._bus.set_exit_on_disconnect(False)
+		self._receivers = [
+			self._bus.add_signal_receiver(
+				self._on_session_new,
+				signal_name="SessionNew",
+				dbus_interface=INTERFACE_LOGIN_MANAGER,
+				bus_name=SERVICE_LOGIN,
+				path=LOGIN_MANAGER_PATH,
+			),
+			self._bus.add_signal_receiver(
+				self._on_session_removed,
+				signal_name="SessionRemoved",
+				dbus_interface=INTERFACE_LOGIN_MANAGER,
+				bus_name=SERVICE_LOGIN,
+				path=LOGIN_MANAGER_PATH,
+			),
+			self._bus.add_signal_receiver(
+				self._on_properties_changed,
+				signal_name="PropertiesChanged",
+				dbus_interface=INTERFACE_DBUS_PROPERTIES,
+				bus_name=SERVICE_LOGIN,
+				arg0=INTERFACE_LOGIN_SESSION,
+				path_keyword="path",
+			),
+		]
+		self._thread = threading.Thread(target=self._loop.run, name="logind-watcher", daemon=True)
+		self._thread.start()
+
+		# We populate the table only after subscribing, so nothing that happens
+		# in between is missed.
+		manager = self._client.bus.get_object(SERVICE_LOGIN, LOGIN_MANAGER_PATH)
+		for _, _, _, _, session_path in manager.ListSessions(dbus_interface=INTERFACE_LOGIN_MANAGER):
+			self._refresh(str(session_path))
+
+	def close(self) -> None:
+		for receiver in self._receivers:
+			receiver.remove()
+		self._loop.quit()
+		self._thread.join()
+		self._bus.close()
+
+	def __enter__(self) -> LogindWatcher:
+		return self
+
+	def __exit__(self, exc_type: Optional[type[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> None:
+		self.close()
+
+	def _refresh(self, session_path: str) -> None:
+		try:
+			session = self._client.get_session(session_path)
+		except KeyError:
+			self._remove(session_path)
+			return
+		with self._condition:
+			self._sessions[session_path] = session
+			self._condition.notify_all()
+
+	def _remove(self, session_path: str) -> None:
+		with self._condition:
+			self._sessions.pop(session_path, None)
+			self._condition.notify_all()
+		for listener in self._removed_listeners:
+			listener(session_path)
+
+	def _on_session_new(self, session_id: str, session_path: str) -> None:
+		self._logger.debug("Session %s added at %s", session_id, session_path)
+		self._refresh(str(session_path))
+		for listener in self._new_listeners:
+			listener(str(session_path))
+
+	def _on_session_removed(self, session_id: str, session_path: str) -> None:
+		self._logger.debug("Session %s removed from %s", session_id, session_path)
+		self._remove(str(session_path))
+
+	def _on_properties_changed(self, interface: str, changed: dict[str, Any], invalidated: list[str], path: str) -> None:
+		path = str(path)
+		with self._condition:
+			session = self._sessions.get(path)
+			incremental = session is not None and len(invalidated) == 0 and all(name in INCREMENTAL_PROPERTIES for name in changed)
+			if session is not None and incremental is True:
+				update = {
+					INCREMENTAL_PROPERTIES[name][0]: INCREMENTAL_PROPERTIES[name][1](value)
+					for name, value in changed.items()
+				}
+				self._sessions[path] = session._replace(**update)
+				self._condition.notify_all()
+				return
+		self._refresh(path)
+
+	def add_new_listener(self, listener: Callable[[str], None]) -> None:
+		self._new_listeners.append(listener)
+
+	def add_removed_listener(self, listener: Callable[[str], None]) -> None:
+		self._removed_listeners.append(listener)
+
+	@property
+	def sessions(self) -> dict[str, LogindSession]:
+		with self._condition:
+			return dict(self._sessions)
+
+	def wait_for(self, predicate: Callable[[dict[str, LogindSession]], bool], timeout: Optional[float]) -> bool:
+		"""
+		Block until the predicate holds for the session table, returning False if
+		the timeout passes first.
+		"""
+		with self._condition:
+			return self._condition.wait_for(lambda: predicate(self._sessions), timeout)
+
+	def wait_session_removed(self, session_path: str, timeout: Optional[float]) -> bool:
+		return self.wait_for(lambda sessions: session_path not in sessions, timeout)
+
+	def wait_session_unlocked(self, session_path: str, timeout: Optional[float]) -> bool:
+		return self.wait_for(
+			lambda sessions: session_path in sessions and sessions[session_path].locked_hint is False,
+			timeout,
+		)
@@ -0,0 +1,97 @@
+import os
+import logging
+import psutil
+from typing import Iterable, Optional
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+_logger = logging.getLogger("xrdp_local_session.common.process_table")
+
+
+class ProcessTable:
+	"""
+	A point-in-time view of the process tree.
+
+	Building it reads /proc once, after which descendant lookups for any number
+	of processes are plain dictionary walks, and processes exiting mid-lookup
+	can't make the result inconsistent.
+	"""
+
+	def __init__(self, processes: Iterable[tuple[int, int, str]]) -> None:
+		self.names: dict[int, str] = {}
+		self.children: dict[int, list[int]] = {}
+		for pid, ppid, name in processes:
+			self.names[pid] = name
+			self.children.setdefault(ppid, []).append(pid)
+
+	@classmethod
+	def from_proc(cls) -> "ProcessTable":
+		processes = []
+		for process in psutil.process_iter(["pid", "ppid", "name"]):
+			info = process.info
+			if info["ppid"] is None or info["name"] is None:
+				continue
+			processes.append((info["pid"], info["ppid"], info["name"]))
+		return cls(processes)
+
+	def descendants(self, pid: int) -> list[int]:
+		result = []
+		pending = list(self.children.get(pid, []))
+		while len(pending) > 0:
+			child = pending.pop()
+			result.append(child)
+			pending.extend(self.children.get(child, []))
+		return result
+
+	def descendant_names(self, pid: int) -> set[str]:
+		return {self.names[child] for child in self.descendants(pid)}
+
+
+def _read_cgroup_path(pid: int) -> Optional[str]:
+	# Only the unified (v2) hierarchy is supported, which is what logind uses on
+	# every distro we package for.
+	try:
+		with open(f"/proc/{pid}/cgroup", "r") as f:
+			for line in f:
+				if line.startswith("0::"):
+					return line[3:].strip()
+	except OSError:
+		pass
+	return None
+
+
+def get_cgroup_pids(pid: int) -> Optional[list[int]]:
+	"""
+	Return the processes in the cgroup of the given process (including itself),
+	or None if they can't be determined from the cgroup hierarchy.
+	"""
+	cgroup_path = _read_cgroup_path(pid)
+	if cgroup_path is None:
+		return None
+	try:
+		with open(os.path.join(CGROUP_ROOT, cgroup_path.lstrip("/"), "cgroup.procs"), "r") as f:
+			return [int(line) for line in f if line.strip() != ""]
+	except (OSError, ValueError) as e:
+		_logger.debug("Failed to read cgroup %s of process %d: %s", cgroup_path, pid, e)
+		return None
+
+
+def get_cgroup_process_names(pid: int) -> Optional[set[str]]:
+	"""
+	Return the names of all other processes in the cgroup of the given process,
+	or None if they can't be determined from the cgroup hierarchy.
+	"""
+	pids = get_cgroup_pids(pid)
+	if pids is None:
+		return None
+	result = set()
+	for member in pids:
+		if member == pid:
+			continue
+		try:
+			with open(f"/proc/{member}/comm", "r") as f:
+				result.add(f.read().rstrip("\n"))
+		except OSError:
+			# Exited since we read the cgroup
+			continue
+	return result
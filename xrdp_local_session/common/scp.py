@@ -0,0 +1,231 @@
+"""
+A client for SCP, the protocol xrdp-sesadmin and xrdp-sesrun speak to sesman
+over its Unix socket since xrdp 0.10, so sessions can be listed and created
+without running either of them.
+
+SCP messages are carried by libipm: a 12 byte header (the libipm version, the
+size of the whole message, the facility and the message number, as
+little-endian 16-bit integers, followed by 32 reserved bits), then the fields
+of the message, each preceded by the character giving its type. sesman
+identifies us by our credentials on the socket, so it only lets us manage our
+own sessions.
+"""
+
+from __future__ import annotations
+
+import socket
+import struct
+from types import TracebackType
+from typing import Any, NamedTuple, Optional
+
+LIBIPM_VERSION = 2
+LIBIPM_HEADER = struct.Struct("<HHHHI")
+LIBIPM_MAX_MESSAGE_SIZE = 8192
+LIBIPM_FACILITY_SCP = 1
+
+# Field types with a fixed size, by their type character
+LIBIPM_FIXED_FIELDS = {
+	"y": struct.Struct("<B"),
+	"b": struct.Struct("<B"),
+	"n": struct.Struct("<h"),
+	"q": struct.Struct("<H"),
+	"i": struct.Struct("<i"),
+	"u": struct.Struct("<I"),
+	"x": struct.Struct("<q"),
+	"t": struct.Struct("<Q"),
+}
+# Buffers ("B") are preceded by their length
+LIBIPM_BUFFER_LENGTH = struct.Struct("<H")
+
+# SCP message numbers
+SCP_UDS_LOGIN_REQUEST = 3
+SCP_LOGIN_RESPONSE = 4
+SCP_CREATE_SESSION_REQUEST = 6
+SCP_CREATE_SESSION_RESPONSE = 7
+SCP_LIST_SESSIONS_REQUEST = 8
+SCP_LIST_SESSIONS_RESPONSE = 9
+SCP_CLOSE_CONNECTION_REQUEST = 12
+
+SCP_LOGIN_OK = 0
+SCP_CREATE_SESSION_OK = 0
+SCP_LIST_SESSIONS_INFO = 0
+SCP_LIST_SESSIONS_END = 1
+
+SCP_SESSION_TYPE_XVNC = 0
+SCP_SESSION_TYPE_XORG = 1
+# As xrdp-sesadmin names them
+SCP_SESSION_TYPE_NAMES = {
+	SCP_SESSION_TYPE_XVNC: "Xvnc",
+	SCP_SESSION_TYPE_XORG: "Xorg",
+}
+
+# Fields of a SCP_LIST_SESSIONS_RESPONSE describing a session, after its status
+SCP_SESSION_INFO_FIELDS = "iuyqqyxis"
+
+# What xrdp-sesrun asks for by default. The session is resized to the local
+# display once xrdp_local connects.
+SCP_DEFAULT_WIDTH = 1280
+SCP_DEFAULT_HEIGHT = 1024
+SCP_DEFAULT_BPP = 24
+
+SCP_CONNECT_TIMEOUT = 1
+# sesman only answers a create request once the session started
+SCP_REPLY_TIMEOUT = 60
+
+
+class ScpError(Exception):
+	pass
+
+
+class ScpSessionInfo(NamedTuple):
+	session_id: int
+	display: int
+	session_type: int
+	width: int
+	height: int
+	bpp: int
+	start_time: int
+	uid: int
+	start_ip: str
+
+
+def encode_fields(signature: str, values: tuple[Any, ...]) -> bytes:
+	if len(signature) != len(values):
+		raise ValueError(f"Signature {signature!r} doesn't match {len(values)} values")
+	parts = []
+	for type_char, value in zip(signature, values):
+		parts.append(type_char.encode("ascii"))
+		if type_char in LIBIPM_FIXED_FIELDS:
+			parts.append(LIBIPM_FIXED_FIELDS[type_char].pack(int(value)))
+		elif type_char == "s":
+			parts.append(value.encode("utf-8") + b"\0")
+		elif type_char == "B":
+			parts.append(LIBIPM_BUFFER_LENGTH.pack(len(value)) + value)
+		else:
+			raise ValueError(f"Unsupported field type {type_char!r}")
+	return b"".join(parts)
+
+
+def decode_fields(signature: str, payload: bytes) -> list[Any]:
+	"""
+	Decode the fields of a message payload given by the signature. Anything
+	after them is ignored.
+	"""
+	values: list[Any] = []
+	offset = 0
+	try:
+		for type_char in signature:
+			if payload[offset:offset + 1] != type_char.encode("ascii"):
+				raise ScpError(f"Expected a field of type {type_char!r} at offset {offset}")
+			offset += 1
+			if type_char in LIBIPM_FIXED_FIELDS:
+				field = LIBIPM_FIXED_FIELDS[type_char]
+				(value,) = field.unpack_from(payload, offset)
+				offset += field.size
+				values.append(value != 0 if type_char == "b" else value)
+			elif type_char == "s":
+				end = payload.index(b"\0", offset)
+				values.append(payload[offset:end].decode("utf-8", errors="replace"))
+				offset = end + 1
+			elif type_char == "B":
+				(length,) = LIBIPM_BUFFER_LENGTH.unpack_from(payload, offset)
+				offset += LIBIPM_BUFFER_LENGTH.size
+				if offset + length > len(payload):
+					raise ScpError(f"Truncated buffer at offset {offset}")
+				values.append(payload[offset:offset + length])
+				offset += length
+			else:
+				raise ValueError(f"Unsupported field type {type_char!r}")
+	except (struct.error, ValueError) as e:
+		raise ScpError(f"Malformed message: {e}")
+	return values
+
+
+def encode_message(message_number: int, signature: str="", *values: Any) -> bytes:
+	payload = encode_fields(signature, values)
+	size = LIBIPM_HEADER.size + len(payload)
+	if size > LIBIPM_MAX_MESSAGE_SIZE:
+		raise ValueError(f"Message of {size} bytes exceeds the libipm limit")
+	return LIBIPM_HEADER.pack(LIBIPM_VERSION, size, LIBIPM_FACILITY_SCP, message_number, 0) + payload
+
+
+class ScpClient:
+	def __init__(self, socket_path: str, reply_timeout: Optional[float]=SCP_REPLY_TIMEOUT) -> None:
+		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			self._socket.settimeout(SCP_CONNECT_TIMEOUT)
+			self._socket.connect(socket_path)
+			self._socket.settimeout(reply_timeout)
+		except BaseException:
+			self._socket.close()
+			raise
+
+	def close(self) -> None:
+		try:
+			self._send(SCP_CLOSE_CONNECTION_REQUEST)
+		except OSError:
+			pass
+		finally:
+			self._socket.close()
+
+	def __enter__(self) -> ScpClient:
+		return self
+
+	def __exit__(self, exc_type: Optional[type[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> None:
+		self.close()
+
+	def _send(self, message_number: int, signature: str="", *values: Any) -> None:
+		self._socket.sendall(encode_message(message_number, signature, *values))
+
+	def _receive_exactly(self, size: int) -> bytes:
+		data = bytearray()
+		while len(data) < size:
+			chunk = self._socket.recv(size - len(data))
+			if len(chunk) == 0:
+				raise ScpError("sesman closed the connection")
+			data += chunk
+		return bytes(data)
+
+	def _receive(self, message_number: int) -> bytes:
+		version, size, facility, received_number, _ = LIBIPM_HEADER.unpack(self._receive_exactly(LIBIPM_HEADER.size))
+		if version != LIBIPM_VERSION:
+			raise ScpError(f"Unsupported libipm version {version}")
+		if size < LIBIPM_HEADER.size or size > LIBIPM_MAX_MESSAGE_SIZE:
+			raise ScpError(f"Invalid message size {size}")
+		payload = self._receive_exactly(size - LIBIPM_HEADER.size)
+		if facility != LIBIPM_FACILITY_SCP or received_number != message_number:
+			raise ScpError(f"Expected SCP message {message_number}, got message {received_number} of facility {facility}")
+		return payload
+
+	def login(self) -> int:
+		"""
+		Log in as the user we're connected as, returning its UID.
+		"""
+		self._send(SCP_UDS_LOGIN_REQUEST)
+		status, _, uid = decode_fields("ibi", self._receive(SCP_LOGIN_RESPONSE))
+		if status != SCP_LOGIN_OK:
+			raise ScpError(f"Login failed with status {status}")
+		return uid
+
+	def list_sessions(self) -> list[ScpSessionInfo]:
+		self._send(SCP_LIST_SESSIONS_REQUEST)
+		sessions: list[ScpSessionInfo] = []
+		# One message per session, then one marking the end of the list
+		while True:
+			payload = self._receive(SCP_LIST_SESSIONS_RESPONSE)
+			(status,) = decode_fields("i", payload)
+			if status == SCP_LIST_SESSIONS_END:
+				return sessions
+			if status != SCP_LIST_SESSIONS_INFO:
+				raise ScpError(f"Listing sessions failed with status {status}")
+			sessions.append(ScpSessionInfo(*decode_fields("i" + SCP_SESSION_INFO_FIELDS, payload)[1:]))
+
+	def create_session(self, session_type: int=SCP_SESSION_TYPE_XORG, width: int=SCP_DEFAULT_WIDTH, height: int=SCP_DEFAULT_HEIGHT, bpp: int=SCP_DEFAULT_BPP, shell: str="", directory: str="") -> int:
+		"""
+		Create a session, returning its display.
+		"""
+		self._send(SCP_CREATE_SESSION_REQUEST, "yqqyss", session_type, width, height, bpp, shell, directory)
+		status, display, _ = decode_fields("iiB", self._receive(SCP_CREATE_SESSION_RESPONSE))
+		if status != SCP_CREATE_SESSION_OK:
+			raise ScpError(f"Creating a session failed with status {status}")
+		return display
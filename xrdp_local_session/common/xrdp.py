@@ -1,9 +1,14 @@
 import re
 import os
 import pwd
+import time
 import logging
 import subprocess
-from pydantic import BaseModel
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from .. import timing
+from .inotify import wait_for_any_path
+from .scp import SCP_SESSION_TYPE_NAMES, ScpClient, ScpError, ScpSessionInfo
 
 
 XRDP_SOCKET_PATHS = [
@@ -11,78 +16,255 @@ XRDP_SOCKET_PATHS = [
 	"/run/xrdp/{uid}/xrdp_display_{display}",
 ]
 
-class XRDPSession(BaseModel):
+# Which of XRDP_SOCKET_PATHS this host uses, once we've found a socket
+_known_socket_path_layout: Optional[str] = None
+
+# How long a session listing is trusted before sesman is asked again. A single
+# login only needs the listing to live for a few seconds.
+SESSION_INDEX_TTL = 5.0
+
+# xrdp-sesadmin -c=list output, one block per session starting with its ID
+SESSION_ID_PATTERN = re.compile(r"^Session ID: (\d+)$")
+SESSION_DISPLAY_PATTERN = re.compile(r"^\s*Display: :(\d+)$")
+SESSION_USER_PATTERN = re.compile(r"^\s*User: (.+)$")
+SESSION_TYPE_PATTERN = re.compile(r"^\s*Session type: (.+)$")
+
+# Session records are plain tuples rather than pydantic models, since they're
+# built on hot paths from data we parse ourselves and don't need validation.
+class XRDPSession(NamedTuple):
 	session_id: int
 	display: int
 	username: str
 	session_type: str
 
 
+def _make_session(session_id: int, display: Optional[int], username: Optional[str], session_type: Optional[str]) -> XRDPSession:
+	if display is None or username is None or session_type is None:
+		raise ValueError(f"Incomplete entry for session {session_id} in the session listing")
+	return XRDPSession(session_id, display, username, session_type)
+
+
+def parse_session_listing(lines: Iterable[str]) -> Iterator[XRDPSession]:
+	session_id: Optional[int] = None
+	display: Optional[int] = None
+	username: Optional[str] = None
+	session_type: Optional[str] = None
+	for line in lines:
+		line = line.rstrip("\n")
+		if r := SESSION_ID_PATTERN.match(line):
+			if session_id is not None:
+				yield _make_session(session_id, display, username, session_type)
+			session_id = int(r.group(1))
+			display = username = session_type = None
+		elif r := SESSION_DISPLAY_PATTERN.match(line):
+			display = int(r.group(1))
+		elif r := SESSION_USER_PATTERN.match(line):
+			username = r.group(1)
+		elif r := SESSION_TYPE_PATTERN.match(line):
+			session_type = r.group(1)
+	if session_id is not None:
+		yield _make_session(session_id, display, username, session_type)
+
+
+class SessionIndex:
+	def __init__(self, sessions: list[XRDPSession]) -> None:
+		self.sessions = sessions
+		self.created_at = time.monotonic()
+		self.by_username: dict[str, XRDPSession] = {}
+		self.by_display: dict[int, XRDPSession] = {}
+		self.by_session_id: dict[int, XRDPSession] = {}
+		# Keep the first match for each key, like a linear scan would
+		for session in sessions:
+			self.by_username.setdefault(session.username, session)
+			self.by_display.setdefault(session.display, session)
+			self.by_session_id.setdefault(session.session_id, session)
+
+	def is_fresh(self, ttl: float) -> bool:
+		return time.monotonic() - self.created_at < ttl
+
+
+# With a socket path, sessions are listed and created by talking SCP to sesman
+# directly, saving a process (and possibly sudo) per call. xrdp-sesadmin and
+# xrdp-sesrun are still used for other users' sessions, which sesman won't
+# show us, and whenever sesman can't be reached.
 class SesmanClient:
-	def __init__(self, username: str) -> None:
+	def __init__(self, username: str, index_ttl: float=SESSION_INDEX_TTL, socket_path: Optional[str]=None) -> None:
 		self._logger = logging.getLogger("xrdp_local.sesman_client")
 		self._username = username
+		self._socket_path = socket_path
+		self._command_prefix: Optional[list[str]] = None
+		self._index_ttl = index_ttl
+		self._index: Optional[SessionIndex] = None
+		self.index_hits = 0
+		self.index_misses = 0
 
-	def get_sessions(self) -> list[XRDPSession]:
-		command = ["xrdp-sesadmin", "-c=list"]
-		uid = os.getuid()
-		if uid != pwd.getpwnam(self._username).pw_uid:
-			if uid != 0:
-				raise RuntimeError("Cannot list sessions for other users unless running as root")
-			command = ["sudo", "-u", self._username] + command
-		result = subprocess.run(
-			command,
+	def _sesman_command(self, command: list[str]) -> list[str]:
+		# The sudo decision only depends on the user, so we resolve it once
+		# instead of looking up the password database on every call.
+		if self._command_prefix is None:
+			uid = os.getuid()
+			if uid == pwd.getpwnam(self._username).pw_uid:
+				self._command_prefix = []
+			elif uid == 0:
+				self._command_prefix = ["sudo", "-u", self._username]
+			else:
+				raise RuntimeError("Cannot manage sessions for other users unless running as root")
+		return self._command_prefix + command
+
+	def _uses_socket(self) -> bool:
+		return self._socket_path is not None and self._sesman_command([]) == []
+
+	def _make_session(self, info: ScpSessionInfo) -> XRDPSession:
+		# sesman only shows us our own sessions
+		username = self._username
+		if info.uid != os.getuid():
+			try:
+				username = pwd.getpwuid(info.uid).pw_name
+			except KeyError:
+				username = str(info.uid)
+		return XRDPSession(info.session_id, info.display, username, SCP_SESSION_TYPE_NAMES.get(info.session_type, str(info.session_type)))
+
+	def _list_sessions_from_socket(self) -> Optional[list[XRDPSession]]:
+		assert self._socket_path is not None
+		try:
+			with ScpClient(self._socket_path) as client:
+				client.login()
+				infos = client.list_sessions()
+		except (OSError, ScpError) as e:
+			self._logger.warning("Failed to list sessions through %s, falling back to xrdp-sesadmin: %s", self._socket_path, e)
+			return None
+		return [self._make_session(info) for info in infos]
+
+	def iter_sessions(self) -> Iterator[XRDPSession]:
+		if self._uses_socket() is True:
+			sessions = self._list_sessions_from_socket()
+			if sessions is not None:
+				yield from sessions
+				return
+		# Sessions are yielded as soon as their block of the listing is complete.
+		# If the caller stops iterating early, xrdp-sesadmin is terminated instead
+		# of being read to the end.
+		proc = subprocess.Popen(
+			self._sesman_command(["xrdp-sesadmin", "-c=list"]),
+			stdin=subprocess.DEVNULL,
 			stdout=subprocess.PIPE,
+			encoding="utf-8",
 		)
-		# xrdp-sesadmin return codes are not reliable, so we parse the output anyway
-		sessions = []
-		session_info: dict[str, str | int] = {}
-		for line_bytes in result.stdout.splitlines():
-			line = line_bytes.decode("utf-8")
-			if r := re.match(r"^Session ID: (\d+)$", line):
-				if len(session_info) > 0:
-					sessions.append(XRDPSession.validate(session_info))
-				session_info = {"session_id": int(r.group(1))}
-			elif r := re.match(r"^\s*Display: :(\d+)$", line):
-				session_info["display"] = int(r.group(1))
-			elif r := re.match(r"^\s*User: (.+)$", line):
-				session_info["username"] = r.group(1)
-			elif r := re.match(r"^\s*Session type: (.+)$", line):
-				session_info["session_type"] = r.group(1)
-		if len(session_info) > 0:
-			sessions.append(XRDPSession.validate(session_info))
+		assert proc.stdout is not None
+		try:
+			# xrdp-sesadmin return codes are not reliable, so we parse the output anyway
+			yield from parse_session_listing(proc.stdout)
+		finally:
+			if proc.poll() is None:
+				proc.terminate()
+			proc.stdout.close()
+			proc.wait()
+
+	def _list_sessions(self) -> list[XRDPSession]:
+		with timing.span("sesman.list_sessions"):
+			sessions = list(self.iter_sessions())
 		self._logger.debug("Found %d sessions: %s", len(sessions), sessions)
 		return sessions
 
+	def invalidate(self) -> None:
+		self._index = None
+
+	def get_index(self) -> SessionIndex:
+		if self._index is not None and self._index.is_fresh(self._index_ttl):
+			self.index_hits += 1
+			return self._index
+		self.index_misses += 1
+		self._index = SessionIndex(self._list_sessions())
+		return self._index
+
+	def get_sessions(self) -> list[XRDPSession]:
+		return self.get_index().sessions
+
 	def find_session_by_username(self, username: str) -> XRDPSession | None:
-		for session in self.get_sessions():
-			if session.username == username:
-				return session
+		if self._index is not None and self._index.is_fresh(self._index_ttl):
+			self.index_hits += 1
+			return self._index.by_username.get(username)
+		# Without a fresh index, we stop reading the listing at the first match.
+		# If there's none, we've read all of it, so we index it for the next
+		# lookups.
+		self.index_misses += 1
+		sessions = []
+		with timing.span("sesman.find_session_by_username"):
+			for session in self.iter_sessions():
+				if session.username == username:
+					return session
+				sessions.append(session)
+		self._index = SessionIndex(sessions)
 		return None
 
 	def find_session_by_display(self, display: int) -> XRDPSession | None:
-		for session in self.get_sessions():
-			if session.display == display:
-				return session
-		return None
+		return self.get_index().by_display.get(display)
 
-	def get_socket_path_for_session(self, session: XRDPSession) -> str:
+	def find_session_by_id(self, session_id: int) -> XRDPSession | None:
+		return self.get_index().by_session_id.get(session_id)
+
+	def get_socket_path_for_session(self, session: XRDPSession, timeout: float=0) -> str:
+		# A freshly launched session may not have created its socket yet, so we
+		# wait up to the timeout for it to appear.
+		global _known_socket_path_layout
 		uid = pwd.getpwnam(session.username).pw_uid
-		for path in XRDP_SOCKET_PATHS:
-			path = path.format(uid=uid, display=session.display)
-			if os.path.exists(path):
-				return path
+		layouts = list(XRDP_SOCKET_PATHS)
+		if _known_socket_path_layout in layouts:
+			layouts.remove(_known_socket_path_layout)
+			layouts.insert(0, _known_socket_path_layout)
+		candidates = {layout.format(uid=uid, display=session.display): layout for layout in layouts}
+		with timing.span("sesman.socket_path"):
+			for path, layout in candidates.items():
+				if os.path.exists(path):
+					_known_socket_path_layout = layout
+					return path
+			if timeout > 0:
+				self._logger.debug("Waiting up to %s seconds for the socket of session %d", timeout, session.session_id)
+				if (appeared := wait_for_any_path(list(candidates), timeout)) is not None:
+					_known_socket_path_layout = candidates[appeared]
+					return appeared
 		raise RuntimeError(f"No socket path found for session {session.session_id}")
 
-	def launch_new_session(self) -> XRDPSession:
-		self._logger.debug("Launching new session...")
-		result = subprocess.run(["xrdp-sesrun"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	def _launch_through_socket(self) -> Optional[int]:
+		# We only fall back to xrdp-sesrun while sesman can't have created a
+		# session for us yet, so we never end up with two.
+		assert self._socket_path is not None
+		try:
+			client = ScpClient(self._socket_path)
+		except OSError as e:
+			self._logger.warning("Failed to connect to sesman at %s, falling back to xrdp-sesrun: %s", self._socket_path, e)
+			return None
+		with client:
+			try:
+				client.login()
+			except (OSError, ScpError) as e:
+				self._logger.warning("Failed to log in to sesman at %s, falling back to xrdp-sesrun: %s", self._socket_path, e)
+				return None
+			try:
+				return client.create_session()
+			except (OSError, ScpError) as e:
+				raise RuntimeError(f"Failed to launch new session: {e}")
+
+	def _launch_with_sesrun(self) -> int:
+		result = subprocess.run(self._sesman_command(["xrdp-sesrun"]), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 		if result.returncode != 0:
 			raise RuntimeError(f"Failed to launch new session: {result.stderr.decode('utf-8')}")
 		if r := re.match(r"ok display=:(\d+) guid=([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})", result.stdout.decode("utf-8").strip().lower()):
-			session = self.find_session_by_display(int(r.group(1)))
-			if session is None:
-				raise RuntimeError(f"Failed to find session by display: {r.group(1)}")
-			self._logger.info("Launched new session with display: %d", session.display)
-			return session
+			return int(r.group(1))
 		raise RuntimeError(f"Failed to launch new session: {result.stdout.decode('utf-8')}")
+
+	def launch_new_session(self) -> XRDPSession:
+		self._logger.debug("Launching new session...")
+		with timing.span("sesman.launch_new_session"):
+			display = None
+			if self._uses_socket() is True:
+				display = self._launch_through_socket()
+			if display is None:
+				display = self._launch_with_sesrun()
+		# The listing we have predates the new session
+		self.invalidate()
+		session = self.find_session_by_display(display)
+		if session is None:
+			raise RuntimeError(f"Failed to find session by display: {display}")
+		self._logger.info("Launched new session with display: %d", session.display)
+		return session
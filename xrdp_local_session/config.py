@@ -2,8 +2,11 @@ from __future__ import annotations
 
 import os
 import json
+import logging
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+from .name_matcher import NameMatcher
 
 # We don't use pydantic-settings or native Pydantic 2.0 configuration because
 # some distros we support have Pydantic 1.x packaged (specifically Debian
@@ -15,7 +18,15 @@ class Settings(BaseModel):
 
 	verbose: bool = Field(default=False, description="Verbose logging to stderr")
 
+	xrdp_socket_wait_timeout: float = Field(default=10, description="Seconds to wait for the socket of a newly launched xrdp session to appear")
+	xrdp_local_connect_timeout: Optional[float] = Field(default=30, description="Seconds to wait for xrdp_local to connect to Xorg before giving up, or null to wait forever")
+	sesman_socket_path: Optional[str] = Field(default=None, description="Socket of sesman to list and create our own sessions through instead of running xrdp-sesadmin and xrdp-sesrun, if any")
+
 	logind_enabled: bool = Field(default=True, description="Enable logind support")
+	logind_unlock_timeout: float = Field(default=5, description="Seconds to wait for logind to unlock the session on local connection")
+	session_closer_in_process: bool = Field(default=True, description="Close the logind session from within xrdp_local_session instead of spawning the session closer")
+	session_closer_drain_timeout: float = Field(default=1, description="Maximum number of seconds to wait for child processes to exit before closing the session in-process")
+	lock_on_remote_takeover: bool = Field(default=False, description="Lock the local logind session and switch to the greeter as soon as xrdp_local disconnects, e.g. because an RDP client took over the session")
 
 	# See the README for details on this workaround
 	xdg_wrong_session_workaround_enabled: bool = Field(default=True, description="Enable the wrong logind session workaround")
@@ -35,15 +46,97 @@ class Settings(BaseModel):
 		"sddm-helper",
 		"gdm-session-worker",
 	], description="List of processes to allow when the desktop environment is connected to the wrong logind session")
+	xdg_wrong_session_workaround_use_cgroup: bool = Field(default=False, description="Check the processes in the session's cgroup instead of the session leader's process tree")
+
+	broker_socket_path: Optional[str] = Field(default=None, description="Socket of the xrdp_local_session broker to look up sessions through, if any")
+	broker_timeout: float = Field(default=5, description="Seconds to wait for the broker to accept a request, and to answer it on top of xrdp_socket_wait_timeout")
+
+	prewarm_users: list[str] = Field(default=[], description="Users to launch xrdp sessions for ahead of time with xrdp_local_session_prewarm")
+	prewarm_max_sessions: int = Field(default=1, description="Maximum number of sessions of pre-warmed users to keep at once")
+
+	timing_enabled: bool = Field(default=False, description="Record a timing breakdown of each login")
+	timing_output: Optional[str] = Field(default=None, description="File to append login timing JSON lines to, or null to log them")
 
 	local_active_marker_directory: Optional[str] = Field(default=None, description="Directory in which to keep a file marking a connection as active locally")
 	local_active_marker_filename_format: str = Field(default="{username}_{x11_display}", description="Format of the active marker file name")
 	local_active_marker_mandatory: bool = Field(default=False, description="Whether to require no error in creating the active marker")
 
+	_dm_allowlist_matcher: NameMatcher = PrivateAttr()
+	_process_allowlist_matcher: NameMatcher = PrivateAttr()
+
+	def __init__(self, **kwargs) -> None:
+		super().__init__(**kwargs)
+		# Compiled once here instead of on every session check
+		self._dm_allowlist_matcher = NameMatcher(self.xdg_wrong_session_workaround_dm_allowlist)
+		self._process_allowlist_matcher = NameMatcher(self.xdg_wrong_session_workaround_process_allowlist)
+
+	@property
+	def dm_allowlist_matcher(self) -> NameMatcher:
+		return self._dm_allowlist_matcher
+
+	@property
+	def process_allowlist_matcher(self) -> NameMatcher:
+		return self._process_allowlist_matcher
+
 	@classmethod
 	def load_from_file(cls, path: str) -> Settings:
+		# Loading is cached on the file's identity and modification time, so
+		# processes that load the same file repeatedly only parse and validate
+		# it (and compile the derived matchers) when it actually changes.
+		key = _get_file_key(path)
+		cached = _cache.get(path)
+		if cached is not None and cached[0] == key:
+			return cached[1]
 		kwargs = {}
-		if os.path.exists(path):
+		if key is not None:
 			with open(path, "r") as f:
 				kwargs = json.load(f)
-		return cls(**kwargs)
+			if not isinstance(kwargs, dict):
+				raise ValueError(f"Expected a JSON object in {path}, got {type(kwargs).__name__}")
+		settings = cls(**kwargs)
+		_cache[path] = (key, settings)
+		return settings
+
+
+FileKey = tuple[int, int, int, int]
+
+_cache: dict[str, tuple[Optional[FileKey], Settings]] = {}
+
+
+def _get_file_key(path: str) -> Optional[FileKey]:
+	try:
+		stat = os.stat(path)
+	except FileNotFoundError:
+		return None
+	return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class SettingsLoader:
+	"""
+	Keeps the settings of a long-running process current with the configuration
+	file. Each access to `settings` checks whether the file changed and reloads
+	it if so. A reload that fails (e.g. invalid JSON or values) is logged and
+	the last valid settings stay in use.
+	"""
+
+	def __init__(self, path: str) -> None:
+		self._path = path
+		self._logger = logging.getLogger("xrdp_local_session.config")
+		self._settings = Settings.load_from_file(path)
+		self._key = _get_file_key(path)
+
+	@property
+	def settings(self) -> Settings:
+		key = _get_file_key(self._path)
+		if key == self._key:
+			return self._settings
+		try:
+			settings = Settings.load_from_file(self._path)
+		except (OSError, ValueError) as e:
+			self._logger.warning("Ignoring invalid configuration in %s, keeping the previous one: %s", self._path, e)
+		else:
+			self._logger.info("Reloaded configuration from %s", self._path)
+			self._settings = settings
+		# Also remembered on failure, so we only warn once per change
+		self._key = key
+		return self._settings
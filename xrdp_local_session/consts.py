@@ -1 +1,2 @@
 SYSTEM_CONFIG_FILE = "/etc/xrdp_local_session.json"
+BROKER_SOCKET_PATH = "/run/xrdp_local_session/broker.socket"
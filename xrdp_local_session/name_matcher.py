@@ -0,0 +1,55 @@
+import re
+import fnmatch
+from typing import Optional
+
+# The kernel truncates process names (comm) to 15 characters
+COMM_MAX_LENGTH = 15
+
+REGEX_PREFIX = "re:"
+GLOB_CHARACTERS = "*?["
+
+
+class NameMatcher:
+	"""
+	Matches process or service names against a list of rules.
+
+	A rule is either an exact name, a glob pattern (any rule containing one of
+	`*?[`), or a regular expression prefixed with `re:`. Exact names longer than
+	the kernel's comm limit also match their truncated form.
+	"""
+
+	def __init__(self, rules: list[str]) -> None:
+		self._exact: dict[str, str] = {}
+		self._patterns: list[tuple[re.Pattern[str], str]] = []
+		for rule in rules:
+			if rule.startswith(REGEX_PREFIX):
+				try:
+					self._patterns.append((re.compile(rule[len(REGEX_PREFIX):]), rule))
+				except re.error as e:
+					raise ValueError(f"Invalid regular expression in rule {rule!r}: {e}")
+			elif any(c in rule for c in GLOB_CHARACTERS):
+				self._patterns.append((re.compile(fnmatch.translate(rule)), rule))
+			else:
+				self._exact.setdefault(rule, rule)
+				if len(rule) > COMM_MAX_LENGTH:
+					self._exact.setdefault(rule[:COMM_MAX_LENGTH], rule)
+
+	def match(self, name: str) -> Optional[str]:
+		"""Return the rule matching the name, or None if there isn't one."""
+		if (rule := self._exact.get(name)) is not None:
+			return rule
+		for pattern, rule in self._patterns:
+			if pattern.fullmatch(name):
+				return rule
+		return None
+
+	def match_all(self, names: set[str]) -> tuple[dict[str, str], set[str]]:
+		"""Split names into a mapping of matched names to rules, and unmatched names."""
+		matched = {}
+		unmatched = set()
+		for name in names:
+			if (rule := self.match(name)) is not None:
+				matched[name] = rule
+			else:
+				unmatched.add(name)
+		return matched, unmatched
@@ -0,0 +1,103 @@
+"""
+Pre-warm xrdp sessions for configured users.
+
+Launching a new xrdp session starts an entire Xorg and desktop session, which
+the user otherwise waits for on their first local login. This program starts
+those sessions ahead of time, so xrdp_local_session always finds an existing
+session to connect to.
+
+It's meant to run as root, either on a schedule (e.g. a systemd timer) or from
+a display manager hook that runs when the greeter is shown (e.g. LightDM's
+greeter-setup-script or SDDM's Xsetup script). Only users listed in
+`prewarm_users` are pre-warmed, and no more than `prewarm_max_sessions` of
+their sessions are kept at once.
+"""
+
+import logging
+from typing import Optional
+
+import typer
+
+from .config import Settings
+from .consts import SYSTEM_CONFIG_FILE
+from .common.xrdp import SesmanClient
+
+
+class Prewarmer:
+	def __init__(self, settings: Settings) -> None:
+		self._settings = settings
+		self._logger = logging.getLogger("xrdp_local_session.prewarm")
+
+	def _has_session(self, client: SesmanClient, username: str) -> bool:
+		try:
+			return client.get_index().by_username.get(username) is not None
+		except Exception as e:
+			# Assume the worst, so we neither launch a duplicate session nor
+			# exceed the limit
+			self._logger.warning("Failed to list sessions for %s, assuming it has one: %s", username, e)
+			return True
+
+	def run(self, usernames: Optional[list[str]]=None) -> list[str]:
+		"""
+		Launch sessions for the given users (or all configured users) that don't
+		have one yet, returning the users a session was launched for.
+		"""
+		configured = self._settings.prewarm_users
+		if usernames is None:
+			usernames = configured
+		else:
+			for username in usernames:
+				if username not in configured:
+					self._logger.warning("Not pre-warming a session for %s, who isn't in prewarm_users", username)
+			usernames = [username for username in usernames if username in configured]
+
+		# Sessions of all configured users count towards the limit, whether we
+		# launched them or the user did.
+		clients = {username: SesmanClient(username, socket_path=self._settings.sesman_socket_path) for username in configured}
+		with_session = {username for username, client in clients.items() if self._has_session(client, username)}
+		available = self._settings.prewarm_max_sessions - len(with_session)
+
+		launched = []
+		for username in usernames:
+			if username in with_session:
+				self._logger.debug("%s already has a session", username)
+				continue
+			if available <= 0:
+				self._logger.info("Not pre-warming a session for %s, already at the limit of %d sessions", username, self._settings.prewarm_max_sessions)
+				continue
+			self._logger.info("Pre-warming a session for %s", username)
+			try:
+				session = clients[username].launch_new_session()
+			except Exception as e:
+				self._logger.warning("Failed to pre-warm a session for %s: %s", username, e)
+				continue
+			self._logger.info("Pre-warmed session for %s at :%d", username, session.display)
+			with_session.add(username)
+			available -= 1
+			launched.append(username)
+		return launched
+
+
+def typer_main(
+	users: Optional[list[str]] = typer.Option(None, "-u", "--user", help="Only pre-warm sessions for these users (must also be in prewarm_users)"),
+	settings_file: str = typer.Option(SYSTEM_CONFIG_FILE, "-c", "--config-file", help="Path to the global configuration file"),
+	verbose: bool = typer.Option(False, "-v", "--verbose", help="Verbose logging to stderr"),
+) -> None:
+	"""
+	Launch xrdp sessions ahead of time for the users configured in
+	prewarm_users, so their local login connects to an existing session.
+	"""
+	settings = Settings.load_from_file(settings_file)
+	level = logging.INFO
+	if verbose is True or settings.verbose is True:
+		level = logging.DEBUG
+	logging.basicConfig(level=level)
+
+	Prewarmer(settings).run(users or None)
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+if __name__ == "__main__":
+	main()
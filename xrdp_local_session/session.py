@@ -1,83 +1,221 @@
 import os
 import sys
 import pwd
+import time
+import selectors
 import subprocess
 import logging
 import typer
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 
-from .common.logind import LogindClient
+from . import timing
 from .common.xrdp import SesmanClient, XRDPSession
 from .config import Settings
 from .consts import SYSTEM_CONFIG_FILE
 from .active_marker import ActiveMarker
+from .session_lookup import get_session, unlock_sessions
 
+if TYPE_CHECKING:
+	from .common.logind import LogindSession
+
+# How often to check whether xrdp_local exited while waiting for it to connect
+XRDP_LOCAL_EXIT_POLL_INTERVAL = 0.1
 
 class Main:
 	def __init__(self, settings: Settings, username: Optional[str]=None) -> None:
 		self._settings = settings
 		if settings.logind_enabled is True:
-			self.logind_client = LogindClient(settings)
+			# Imported here so dbus is only loaded when logind support is enabled
+			from .common.logind import LogindClient
+			self.logind_client: LogindClient = LogindClient(settings)
 		self.logger = logging.getLogger("xrdp_local_session.core")
 		self._proc: Optional[subprocess.Popen] = None
+		# The logind sessions of the xrdp session, once we've looked them up
+		self._xrdp_logind_sessions: Optional[list[LogindSession]] = None
 		self._username = username or self._get_current_username()
-		self.sesman_client = SesmanClient(self._username)
+		self.sesman_client = SesmanClient(self._username, socket_path=settings.sesman_socket_path)
 
 	def _get_current_username(self) -> str:
 		return pwd.getpwuid(os.getuid()).pw_name
 
-	def _launch_xrdp_local(self, socket_path: str, xrdp_session: XRDPSession, is_existing_session: bool) -> None:
+	def _wait_for_xrdp_local(self, pipe_read: int, pidfd: Optional[int]) -> None:
+		# We wait for an acknowledgement so we unlock only after a successful
+		# connection to Xorg, but never longer than the configured deadline and
+		# never past the exit of xrdp_local itself.
+		assert self._proc is not None
+		timeout = self._settings.xrdp_local_connect_timeout
+		deadline = None if timeout is None else time.monotonic() + timeout
+		buffer = b""
+		with selectors.DefaultSelector() as selector:
+			selector.register(pipe_read, selectors.EVENT_READ)
+			# The pipe may be held open by descendants of xrdp_local, so EOF
+			# alone does not tell us it exited. With a pidfd we're woken up by
+			# its exit, otherwise we poll for it.
+			wait: Optional[float] = XRDP_LOCAL_EXIT_POLL_INTERVAL
+			if pidfd is not None:
+				selector.register(pidfd, selectors.EVENT_READ)
+				wait = None
+			while True:
+				select_timeout = wait
+				if deadline is not None:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						raise TimeoutError(f"xrdp_local did not connect to Xorg within {timeout} seconds.")
+					select_timeout = remaining if wait is None else min(wait, remaining)
+				events = selector.select(select_timeout)
+				if not any(key.fd == pipe_read for key, _ in events):
+					if self._proc.poll() is not None:
+						raise RuntimeError(f"xrdp_local exited with status {self._proc.returncode} before successfully connecting to Xorg.")
+					continue
+				data = os.read(pipe_read, 4096)
+				if len(data) == 0:
+					raise RuntimeError("xrdp_local disconnected before successfully connecting to Xorg.")
+				buffer += data
+				while b"\n" in buffer:
+					line_bytes, buffer = buffer.split(b"\n", 1)
+					line = line_bytes.decode("utf-8", errors="replace").strip()
+					match line:
+						case "connected":
+							return
+						case _:
+							self.logger.warning(f"Unknown xrdp_local output: {line}")
+
+	def _launch_xrdp_local(self, socket_path: str, xrdp_session: XRDPSession, is_existing_session: bool, unlock_targets: Optional[list[dict[str, Any]]]=None) -> None:
 		pipe_read, pipe_write = os.pipe()
+		pidfd = None
 		try:
 			try:
 				os.set_inheritable(pipe_write, True)
 				os.set_inheritable(pipe_read, False)
-				self._proc = subprocess.Popen(
-					["xrdp_local", socket_path, str(pipe_write)],
-					close_fds=False,
-				)
+				spawned_at = time.monotonic()
+				with timing.span("xrdp_local.spawn"):
+					self._proc = subprocess.Popen(
+						["xrdp_local", socket_path, str(pipe_write)],
+						close_fds=False,
+					)
+				pidfd = self._open_pidfd(self._proc.pid)
 			finally:
 				os.close(pipe_write)
-			# We wait for an acknowledgement so we unlock only after a successful connection to Xorg
-			for line in os.fdopen(pipe_read, closefd=False):
-				match line.strip():
-					case "connected":
-						self.logger.info("xrdp_local connected")
-						if self._settings.logind_enabled is True:
-							if self._settings.unlock_on_local_connection is True and is_existing_session is True:
-								logind_sessions = self.logind_client.find_xrdp_sessions(os.getuid(), xrdp_session.display)
-								if len(logind_sessions) == 0:
-									self.logger.warning("No logind session found for existing session, will be unable to unlock it automatically.")
-								for session in logind_sessions:
-									self.logger.info("Unlocking logind session %s for %s", session.id, self._username)
-									self.logind_client.unlock_session(session)
-									self.logger.info("Logind session %s unlocked", session.id)
-						return
-					case _:
-						self.logger.warning(f"Unknown xrdp_local output: {line}")
-				raise RuntimeError("xrdp_local disconnected before successfully connecting to Xorg.")
+			try:
+				with timing.span("xrdp_local.wait_connected"):
+					self._wait_for_xrdp_local(pipe_read, pidfd)
+			except Exception:
+				self._proc.terminate()
+				raise
+			latency = time.monotonic() - spawned_at
+			self.logger.info(
+				"xrdp_local connected after %.3f seconds", latency,
+				extra={"event": "xrdp_local_connected", "display": xrdp_session.display, "latency": latency},
+			)
+			if self._settings.logind_enabled is True:
+				if self._settings.unlock_on_local_connection is True and is_existing_session is True:
+					if unlock_targets is not None:
+						from .common.logind import LogindSession
+						logind_sessions = [LogindSession(**target) for target in unlock_targets]
+					else:
+						with timing.span("logind.find_xrdp_sessions"):
+							logind_sessions = self.logind_client.find_xrdp_sessions(os.getuid(), xrdp_session.display)
+					self._xrdp_logind_sessions = logind_sessions
+					unlock_sessions(self.logind_client, logind_sessions, self._username, self._settings.logind_unlock_timeout, self.logger)
 		finally:
 			os.close(pipe_read)
+			if pidfd is not None:
+				os.close(pidfd)
+
+	def _open_pidfd(self, pid: int) -> Optional[int]:
+		# Requires Linux 5.3
+		try:
+			return os.pidfd_open(pid)
+		except (AttributeError, OSError) as e:
+			self.logger.debug("pidfd is not available, polling for the exit of xrdp_local instead: %s", e)
+			return None
+
+	def _on_xrdp_local_exit(self, xrdp_session: XRDPSession, is_existing_session: bool, exited_at: float) -> None:
+		# xrdp_local exits when xorgxrdp hands the session over to an RDP
+		# client (and also on logout, or if it crashes). Instead of leaving the
+		# physical seat as is until the session is closed, we lock our local
+		# session and switch the seat to the greeter right away.
+		self._lock_local_session(xrdp_session, is_existing_session, exited_at)
+		from .common.display_manager import switch_to_greeter
+		try:
+			if switch_to_greeter(self.logind_client.bus) is False:
+				self.logger.debug("The display manager doesn't support switching to the greeter")
+		except Exception as e:
+			self.logger.warning("Failed to switch to the greeter after xrdp_local exited: %s", e)
+
+	def _lock_local_session(self, xrdp_session: XRDPSession, is_existing_session: bool, exited_at: float) -> None:
+		# If we launched the xrdp session, its desktop environment may be
+		# attached to our local session (see the app.slice bug in the README),
+		# so locking it would lock the desktop the RDP client is connecting to.
+		# The same goes for sessions the wrong session workaround unlocks.
+		if is_existing_session is False:
+			self.logger.info("Not locking the local session, since its xrdp session was launched from it")
+			return
+		try:
+			session = self.logind_client.get_current_session()
+			if self._xrdp_logind_sessions is None:
+				self._xrdp_logind_sessions = self.logind_client.find_xrdp_sessions(os.getuid(), xrdp_session.display)
+			if any(xrdp_logind_session.dbus_path == session.dbus_path for xrdp_logind_session in self._xrdp_logind_sessions):
+				self.logger.info("Not locking local session %s, since it belongs to the xrdp session", session.id)
+				return
+			self.logind_client.lock_session(session)
+		except Exception as e:
+			self.logger.warning("Failed to lock the local session after xrdp_local exited: %s", e)
+			return
+		latency = time.monotonic() - exited_at
+		self.logger.info(
+			"Local session %s locked %.3f seconds after xrdp_local exited", session.id, latency,
+			extra={"event": "takeover_locked", "session_id": session.id, "latency": latency},
+		)
 
 	def get_session(self, *, create_new_session: bool=True) -> tuple[XRDPSession, bool]:
-		session = self.sesman_client.find_session_by_username(self._username)
-		if session is not None:
-			self.logger.info("Existing session found for %s at :%d", session.username, session.display)
-			return session, True
+		with timing.span("get_session"):
+			return get_session(self.sesman_client, self._username, self.logger, create_new_session=create_new_session)
 
-		if create_new_session is False:
-			raise KeyError("No existing session found for %s", self._username)
+	def _lookup_with_broker(self) -> Optional[tuple[XRDPSession, bool, str, list[dict[str, Any]]]]:
+		if self._settings.broker_socket_path is None:
+			return None
+		from .broker import BrokerClient, BrokerUnavailableError
+		# The broker may have to launch a session and wait for its socket, so
+		# the reply can take longer than connecting. Once the request is sent
+		# we don't fall back to a direct lookup, which could launch a second
+		# session while the broker is still launching the first.
+		client = BrokerClient(
+			self._settings.broker_socket_path,
+			self._settings.broker_timeout,
+			self._settings.broker_timeout + self._settings.xrdp_socket_wait_timeout,
+		)
+		try:
+			with timing.span("broker.lookup"):
+				reply = client.lookup(self._username)
+		except BrokerUnavailableError as e:
+			self.logger.warning("Failed to reach the broker, looking the session up directly: %s", e)
+			return None
+		self.logger.info("Broker returned session for %s at :%d", reply.session.username, reply.session.display)
+		return reply.session, reply.is_existing_session, reply.socket_path, reply.unlock_targets
 
-		self.logger.info("No existing session for %s found, launching new session", self._username)
-		session = self.sesman_client.launch_new_session()
-		self.logger.info("New session launched for %s at :%d", session.username, session.display)
-		return session, False
+	def _login(self) -> tuple[XRDPSession, bool]:
+		unlock_targets = None
+		if (broker_reply := self._lookup_with_broker()) is not None:
+			xrdp_session, is_existing_session, socket_path, unlock_targets = broker_reply
+		else:
+			xrdp_session, is_existing_session = self.get_session()
+			self.logger.debug("Sesman session index: %d hits, %d misses", self.sesman_client.index_hits, self.sesman_client.index_misses)
+			socket_path = self.sesman_client.get_socket_path_for_session(xrdp_session, self._settings.xrdp_socket_wait_timeout)
+		self._launch_xrdp_local(socket_path, xrdp_session, is_existing_session, unlock_targets)
+		if self._settings.logind_enabled is True:
+			self.logger.debug("Logind: %d bus calls, %d proxy cache hits, %d misses", self.logind_client.bus_calls, self.logind_client.proxy_cache_hits, self.logind_client.proxy_cache_misses)
+		return xrdp_session, is_existing_session
 
 	def run(self) -> tuple[int, bool]:
-		xrdp_session, is_existing_session = self.get_session()
-		socket_path = self.sesman_client.get_socket_path_for_session(xrdp_session)
-		self._launch_xrdp_local(socket_path, xrdp_session, is_existing_session)
+		# The timing breakdown covers the login itself, up to the point the user
+		# has a usable desktop and the active marker is set.
+		try:
+			xrdp_session, is_existing_session = self._login()
+		except Exception:
+			timing.flush(username=self._username, success=False)
+			raise
 
 		if self._proc is None:
 			raise RuntimeError("xrdp_local not launched.")
@@ -85,7 +223,11 @@ class Main:
 		try:
 			self.logger.info("xrdp_local launched successfully.")
 			with ActiveMarker(self._settings, xrdp_session):
+				timing.flush(username=self._username, display=xrdp_session.display, is_existing_session=is_existing_session, success=True)
 				return_code = self._proc.wait()
+				# Before anything else, including removing the marker
+				if self._settings.logind_enabled is True and self._settings.lock_on_remote_takeover is True:
+					self._on_xrdp_local_exit(xrdp_session, is_existing_session, time.monotonic())
 		except Exception:
 			self._proc.terminate()
 			raise
@@ -110,7 +252,9 @@ def typer_main(
 	session in your session manager.
 	"""
 	settings = Settings.load_from_file(settings_file)
+	timing.configure(settings)
 	should_close_session = True
+	main: Optional[Main] = None
 	try:
 		level = logging.INFO
 		if verbose is True or settings.verbose is True:
@@ -126,8 +270,20 @@ def typer_main(
 		sys.exit(return_code)
 	finally:
 		if settings.logind_enabled is True and should_close_session is True:
-			logging.info("Launching session closer")
-			subprocess.run(["xrdp_local_session_session_closer"])
+			close_session(settings, main)
+
+
+def close_session(settings: Settings, main: Optional[Main]) -> None:
+	if settings.session_closer_in_process is True and main is not None:
+		from .session_closer import SessionCloser
+		logging.info("Closing session in-process")
+		try:
+			SessionCloser(main.logind_client).close_when_drained(settings.session_closer_drain_timeout)
+			return
+		except Exception as e:
+			logging.warning("Failed to close session in-process, falling back to the session closer: %s", e)
+	logging.info("Launching session closer")
+	subprocess.run(["xrdp_local_session_session_closer"])
 
 
 def main() -> None:
@@ -10,21 +10,38 @@ close all processes in the cgroup (assuming it's cgroups are in use), or we can
 simply as logind to terminate the session, which is cleaner.
 
 This program waits a bit and then ask logind to close its session. It's called
-by xrdp_local_session just before it exits.
+by xrdp_local_session just before it exits, unless xrdp_local_session is
+configured to close the session in-process (see SessionCloser.close_when_drained).
 """
 
 import os
 import time
+import signal
 import logging
 
 import typer
+from typing import TYPE_CHECKING, Optional
 
-from .config import Settings
 from .consts import SYSTEM_CONFIG_FILE
-from .common.logind import LogindClient
+
+# How often to check whether the other processes in our session have exited.
+# Changes in the session's state wake us up immediately.
+DRAIN_POLL_INTERVAL = 0.05
+
+if TYPE_CHECKING:
+	import psutil
+	from .common.logind import LogindClient, LogindSession
+	from .common.logind_watcher import LogindWatcher
+
+def _is_running(process: "psutil.Process") -> bool:
+	import psutil
+	try:
+		return process.status() != psutil.STATUS_ZOMBIE
+	except psutil.NoSuchProcess:
+		return False
 
 class SessionCloser:
-	def __init__(self, logind_client: LogindClient) -> None:
+	def __init__(self, logind_client: "LogindClient") -> None:
 		self.logind_client = logind_client
 		self._logger = logging.getLogger("xrdp_local_session.session_closer")
 
@@ -34,6 +51,79 @@ class SessionCloser:
 		self.logind_client.close_session(session)
 		self._logger.info("Current session %s closed", session.id)
 
+	def _get_remaining_processes(self, ignored: set[int]) -> Optional[set[int]]:
+		# The processes still running in our session's cgroup, or None if it
+		# can't be read
+		import psutil
+		from .common.process_table import get_cgroup_pids
+
+		pids = get_cgroup_pids(os.getpid())
+		if pids is None:
+			return None
+		remaining = set()
+		for pid in pids:
+			if pid in ignored:
+				continue
+			try:
+				if _is_running(psutil.Process(pid)):
+					remaining.add(pid)
+			except psutil.NoSuchProcess:
+				continue
+		return remaining
+
+	def _wait_until_drained(self, session: "LogindSession", watcher: "Optional[LogindWatcher]", timeout: float) -> None:
+		import psutil
+
+		# We and our ancestors (e.g. the display manager's session wrapper)
+		# won't exit before the session is closed, so we don't wait for them.
+		process = psutil.Process()
+		ignored = {process.pid} | {parent.pid for parent in process.parents()}
+
+		def is_closing(sessions: dict[str, "LogindSession"]) -> bool:
+			current = sessions.get(session.dbus_path)
+			return current is None or current.state == "closing"
+
+		deadline = time.monotonic() + timeout
+		while True:
+			remaining = self._get_remaining_processes(ignored)
+			if remaining is not None and len(remaining) == 0:
+				self._logger.debug("All other processes in session %s exited", session.id)
+				return
+			wait = deadline - time.monotonic()
+			if wait <= 0:
+				self._logger.debug("Timed out waiting for processes %s in session %s to exit", remaining, session.id)
+				return
+			wait = min(wait, DRAIN_POLL_INTERVAL)
+			if watcher is None:
+				time.sleep(wait)
+			elif watcher.wait_for(is_closing, wait) is True:
+				self._logger.debug("Session %s is already closing", session.id)
+				return
+
+	def close_when_drained(self, timeout: float) -> None:
+		# Used from within xrdp_local_session itself, reusing its logind
+		# connection. Instead of sleeping a fixed delay, we wait until all other
+		# processes in the session have exited or logind is already closing the
+		# session, whichever comes first, bounded by the timeout.
+		session = self.logind_client.get_current_session()
+		try:
+			watcher = self.logind_client.subscribe()
+		except Exception as e:
+			self._logger.debug("Not watching the session state, only waiting for its processes to exit: %s", e)
+			watcher = None
+		try:
+			self._wait_until_drained(session, watcher, timeout)
+		finally:
+			if watcher is not None:
+				watcher.close()
+
+		# We're part of the session too, so we block the termination signals
+		# logind is about to send us and let the caller exit normally.
+		signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGHUP})
+		self._logger.info("Closing current session %s", session.id)
+		self.logind_client.close_session(session)
+		self._logger.info("Current session %s closed", session.id)
+
 def typer_main(
 	settings_file: str = typer.Option(SYSTEM_CONFIG_FILE, "-c", "--config-file", help="Path to the global configuration file"),
 	verbose: bool = typer.Option(False, "-v", "--verbose", help="Verbose logging to stderr"),
@@ -45,12 +135,17 @@ def typer_main(
 		level = logging.DEBUG
 	logging.basicConfig(level=level)
 
-	settings = Settings.load_from_file(settings_file)
-
 	if no_daemonize is False:
 		if os.fork() > 0:
 			os._exit(0)
 
+	# Everything else is only needed by the daemonized child, so we import it
+	# after forking to let xrdp_local_session exit sooner.
+	from .config import Settings
+	from .common.logind import LogindClient
+
+	settings = Settings.load_from_file(settings_file)
+
 	time.sleep(delay)
 
 	session_closer = SessionCloser(LogindClient(settings))
@@ -0,0 +1,89 @@
+"""
+Finding (or launching) a user's xrdp session and unlocking it, shared by
+xrdp_local_session itself and the long-running broker and supervisor.
+"""
+
+from __future__ import annotations
+
+import time
+import logging
+from typing import TYPE_CHECKING
+
+from .config import Settings, SettingsLoader
+from .common.xrdp import SesmanClient, XRDPSession
+
+if TYPE_CHECKING:
+	from .common.logind import LogindClient, LogindSession
+
+
+def get_session(sesman_client: SesmanClient, username: str, logger: logging.Logger, *, create_new_session: bool=True, indexed: bool=False) -> tuple[XRDPSession, bool]:
+	"""
+	Return the user's xrdp session, launching one if there's none (unless
+	create_new_session is false, in which case KeyError is raised), and whether
+	it already existed.
+
+	Processes serving many lookups should set indexed, so they look up through
+	the client's session index rather than stopping the listing at the first
+	match. An index may predate a session that was just started remotely, so
+	before launching one, a miss is confirmed against a listing taken after the
+	lookup began.
+	"""
+	if indexed is True:
+		started_at = time.monotonic()
+		index = sesman_client.get_index()
+		session = index.by_username.get(username)
+		if session is None and create_new_session is True and index.created_at < started_at:
+			sesman_client.invalidate()
+			session = sesman_client.get_index().by_username.get(username)
+	else:
+		session = sesman_client.find_session_by_username(username)
+	if session is not None:
+		logger.info("Existing session found for %s at :%d", session.username, session.display)
+		return session, True
+
+	if create_new_session is False:
+		raise KeyError(f"No existing session found for {username}")
+
+	logger.info("No existing session for %s found, launching new session", username)
+	session = sesman_client.launch_new_session()
+	logger.info("New session launched for %s at :%d", session.username, session.display)
+	return session, False
+
+
+def unlock_sessions(logind_client: LogindClient, logind_sessions: list[LogindSession], username: str, timeout: float, logger: logging.Logger) -> None:
+	"""
+	Unlock the logind sessions of a user's xrdp session, logging the outcome.
+	"""
+	if len(logind_sessions) == 0:
+		logger.warning("No logind session found for existing session of %s, will be unable to unlock it automatically.", username)
+		return
+	logger.info("Unlocking logind sessions %s for %s", [session.id for session in logind_sessions], username)
+	result = logind_client.unlock_sessions(logind_sessions, timeout)
+	for session_id in result.unlocked:
+		logger.info("Logind session %s unlocked", session_id)
+	for session_id, error in result.failed.items():
+		logger.warning("Failed to unlock logind session %s: %s", session_id, error)
+
+
+class SessionService:
+	"""
+	Base of the long-running processes that look up sessions for many users
+	(the broker and the supervisor). They share one logind connection, and pick
+	up configuration changes as they go, except for enabling logind, which
+	requires a restart.
+	"""
+
+	def __init__(self, settings_loader: SettingsLoader) -> None:
+		self._settings_loader = settings_loader
+		self.logind_client = None
+		if settings_loader.settings.logind_enabled is True:
+			# Imported here so dbus is only loaded when logind support is enabled
+			from .common.logind import LogindClient
+			self.logind_client = LogindClient(settings_loader.settings)
+
+	@property
+	def _settings(self) -> Settings:
+		settings = self._settings_loader.settings
+		if self.logind_client is not None:
+			self.logind_client.settings = settings
+		return settings
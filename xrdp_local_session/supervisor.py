@@ -0,0 +1,238 @@
+"""
+Multi-seat supervisor for xrdp_local_session.
+
+Instead of one xrdp_local_session process per local X login, the supervisor
+serves several seats from a single process: each seat gets its own xrdp_local
+child, readiness handshake and active marker, while all seats share one logind
+connection and the sesman session cache.
+
+The supervisor runs as root, and runs xrdp_local as each seat's user on the
+seat's local X display. If the display needs an Xauthority file, give it with
+the seat; the user gets a private copy of it for as long as the seat runs.
+"""
+
+from __future__ import annotations
+
+import os
+import pwd
+import shutil
+import asyncio
+import logging
+import tempfile
+from typing import BinaryIO, NamedTuple, Optional
+
+import typer
+
+from .config import SettingsLoader
+from .consts import SYSTEM_CONFIG_FILE
+from .active_marker import ActiveMarker
+from .common.xrdp import SesmanClient, XRDPSession
+from .session_lookup import SessionService, get_session, unlock_sessions
+
+# PATH for xrdp_local, rather than inheriting root's
+SEAT_PATH = "/usr/local/bin:/usr/bin:/bin"
+
+
+class Seat(NamedTuple):
+	username: str
+	display: str
+	xauthority: Optional[str] = None
+
+	@classmethod
+	def parse(cls, value: str) -> Seat:
+		# X display names never contain commas, file names might
+		username, separator, rest = value.partition("=")
+		display, comma, xauthority = rest.partition(",")
+		if separator == "" or username == "" or display == "" or (comma != "" and xauthority == ""):
+			raise ValueError(f"Invalid seat {value!r}, expected USER=DISPLAY[,XAUTHORITY]")
+		return cls(username, display, xauthority or None)
+
+
+class Supervisor(SessionService):
+	def __init__(self, settings_loader: SettingsLoader) -> None:
+		# Enabling logind requires a restart, everything else is picked up
+		# from the configuration file when a seat starts.
+		super().__init__(settings_loader)
+		self._logger = logging.getLogger("xrdp_local_session.supervisor")
+		self._sesman_clients: dict[str, SesmanClient] = {}
+		self._session_locks: dict[str, asyncio.Lock] = {}
+
+	def _get_sesman_client(self, username: str) -> SesmanClient:
+		# Seats of the same user share one client and its session index. Only
+		# the event loop thread touches this dictionary.
+		if username not in self._sesman_clients:
+			self._sesman_clients[username] = SesmanClient(username, socket_path=self._settings.sesman_socket_path)
+		return self._sesman_clients[username]
+
+	def _get_session_lock(self, username: str) -> asyncio.Lock:
+		# SesmanClient isn't thread-safe, and two seats of the same user looking
+		# up a session at once could both find none and launch one each.
+		if username not in self._session_locks:
+			self._session_locks[username] = asyncio.Lock()
+		return self._session_locks[username]
+
+	def _get_environment(self, user: pwd.struct_passwd, seat: Seat, xauthority: Optional[str]) -> dict[str, str]:
+		# A clean environment for the seat's user, so nothing of ours (e.g.
+		# HOME or XAUTHORITY) leaks into xrdp_local.
+		environment = {
+			"HOME": user.pw_dir,
+			"USER": user.pw_name,
+			"LOGNAME": user.pw_name,
+			"SHELL": user.pw_shell,
+			"PATH": SEAT_PATH,
+			"DISPLAY": seat.display,
+		}
+		if xauthority is not None:
+			environment["XAUTHORITY"] = xauthority
+		for name in ("LANG", "LC_ALL"):
+			if name in os.environ:
+				environment[name] = os.environ[name]
+		return environment
+
+	def _copy_xauthority(self, user: pwd.struct_passwd, path: str) -> str:
+		# The display manager's Xauthority is usually only readable by root, so
+		# the seat's user gets a copy only it can read.
+		fd, copy_path = tempfile.mkstemp(prefix="xrdp-local-xauth-")
+		try:
+			with os.fdopen(fd, "wb") as target, open(path, "rb") as source:
+				shutil.copyfileobj(source, target)
+				os.fchown(target.fileno(), user.pw_uid, user.pw_gid)
+		except BaseException:
+			os.unlink(copy_path)
+			raise
+		return copy_path
+
+	def _get_session(self, sesman_client: SesmanClient, username: str) -> tuple[XRDPSession, bool, str]:
+		# Blocking, run in the default executor. Seats share the client, so
+		# lookups go through its index.
+		session, is_existing_session = get_session(sesman_client, username, self._logger, indexed=True)
+		return session, is_existing_session, sesman_client.get_socket_path_for_session(session, self._settings.xrdp_socket_wait_timeout)
+
+	def _unlock(self, username: str, xrdp_session: XRDPSession) -> None:
+		# Blocking, run in the default executor
+		assert self.logind_client is not None
+		logind_sessions = self.logind_client.find_xrdp_sessions(pwd.getpwnam(username).pw_uid, xrdp_session.display)
+		unlock_sessions(self.logind_client, logind_sessions, username, self._settings.logind_unlock_timeout, self._logger)
+
+	async def _wait_for_xrdp_local(self, pipe_file: BinaryIO) -> None:
+		loop = asyncio.get_running_loop()
+		reader = asyncio.StreamReader()
+		transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe_file)
+		try:
+			while True:
+				line_bytes = await reader.readline()
+				if len(line_bytes) == 0:
+					raise RuntimeError("xrdp_local disconnected before successfully connecting to Xorg.")
+				line = line_bytes.decode("utf-8", errors="replace").strip()
+				match line:
+					case "connected":
+						return
+					case _:
+						self._logger.warning(f"Unknown xrdp_local output: {line}")
+		finally:
+			transport.close()
+
+	async def run_seat(self, seat: Seat) -> int:
+		user = pwd.getpwnam(seat.username)
+		if seat.xauthority is None or user.pw_uid == os.getuid():
+			return await self._run_seat(seat, user, seat.xauthority)
+		xauthority = self._copy_xauthority(user, seat.xauthority)
+		try:
+			return await self._run_seat(seat, user, xauthority)
+		finally:
+			os.unlink(xauthority)
+
+	async def _run_seat(self, seat: Seat, user: pwd.struct_passwd, xauthority: Optional[str]) -> int:
+		loop = asyncio.get_running_loop()
+		async with self._get_session_lock(seat.username):
+			xrdp_session, is_existing_session, socket_path = await loop.run_in_executor(None, self._get_session, self._get_sesman_client(seat.username), seat.username)
+		self._logger.info("Seat %s: using session of %s at :%d", seat.display, seat.username, xrdp_session.display)
+
+		# Switching users needs root, and isn't needed to run as ourselves
+		switch_user = user.pw_uid != os.getuid()
+		pipe_read, pipe_write = os.pipe()
+		try:
+			proc = await asyncio.create_subprocess_exec(
+				"xrdp_local", socket_path, str(pipe_write),
+				pass_fds=(pipe_write,),
+				env=self._get_environment(user, seat, xauthority),
+				user=user.pw_uid if switch_user else None,
+				group=user.pw_gid if switch_user else None,
+				extra_groups=os.getgrouplist(user.pw_name, user.pw_gid) if switch_user else None,
+			)
+		except Exception:
+			os.close(pipe_read)
+			raise
+		finally:
+			os.close(pipe_write)
+
+		pipe_file = os.fdopen(pipe_read, "rb")
+		timeout = self._settings.xrdp_local_connect_timeout
+		try:
+			try:
+				await asyncio.wait_for(self._wait_for_xrdp_local(pipe_file), timeout)
+			except asyncio.TimeoutError:
+				raise TimeoutError(f"xrdp_local did not connect to Xorg within {timeout} seconds.")
+		except BaseException:
+			if proc.returncode is None:
+				proc.terminate()
+			await proc.wait()
+			raise
+		finally:
+			pipe_file.close()
+		self._logger.info("Seat %s: xrdp_local connected", seat.display)
+
+		try:
+			if self.logind_client is not None and self._settings.unlock_on_local_connection is True and is_existing_session is True:
+				await loop.run_in_executor(None, self._unlock, seat.username, xrdp_session)
+			with ActiveMarker(self._settings, xrdp_session):
+				return_code = await proc.wait()
+		except BaseException:
+			if proc.returncode is None:
+				proc.terminate()
+				await proc.wait()
+			raise
+
+		self._logger.info("Seat %s: xrdp_local exited with status %d", seat.display, return_code)
+		return return_code
+
+	async def run(self, seats: list[Seat]) -> int:
+		results = await asyncio.gather(*(self.run_seat(seat) for seat in seats), return_exceptions=True)
+		exit_code = 0
+		for seat, result in zip(seats, results):
+			if isinstance(result, BaseException):
+				self._logger.error("Seat %s failed: %s", seat.display, result)
+				exit_code = 1
+			elif result != 0:
+				exit_code = 1
+		return exit_code
+
+
+def typer_main(
+	seats: list[str] = typer.Option(..., "-s", "--seat", help="A seat to serve, as USER=DISPLAY[,XAUTHORITY] (e.g. alice=:0,/var/run/lightdm/root/:0), can be given several times"),
+	settings_file: str = typer.Option(SYSTEM_CONFIG_FILE, "-c", "--config-file", help="Path to the global configuration file"),
+	verbose: bool = typer.Option(False, "-v", "--verbose", help="Verbose logging to stderr"),
+) -> None:
+	"""
+	Serve several local seats from one process, connecting each to its user's
+	xrdp session.
+	"""
+	settings_loader = SettingsLoader(settings_file)
+	settings = settings_loader.settings
+	level = logging.INFO
+	if verbose is True or settings.verbose is True:
+		level = logging.DEBUG
+	logging.basicConfig(level=level)
+
+	try:
+		parsed_seats = [Seat.parse(seat) for seat in seats]
+	except ValueError as e:
+		raise typer.BadParameter(str(e))
+	raise typer.Exit(asyncio.run(Supervisor(settings_loader).run(parsed_seats)))
+
+
+def main() -> None:
+	typer.run(typer_main)
+
+if __name__ == "__main__":
+	main()
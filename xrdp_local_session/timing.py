@@ -0,0 +1,96 @@
+"""
+Span-style timing instrumentation for the login pipeline.
+
+Instrumented code wraps each stage in `timing.span("name")`. Timing is off by
+default, in which case span() returns a shared no-op context manager. When
+enabled through the `timing_enabled` setting, spans are collected and flush()
+emits them as a single JSON line per login, either appended to the file in
+`timing_output` or logged through the xrdp_local_session.timing logger.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+from typing import Any, ContextManager, Iterator, Optional
+
+from .config import Settings
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Tracer:
+	def __init__(self, enabled: bool=False, output: Optional[str]=None) -> None:
+		self.enabled = enabled
+		self._output = output
+		self._logger = logging.getLogger("xrdp_local_session.timing")
+		self._lock = threading.Lock()
+		self._spans: list[dict[str, Any]] = []
+		self._started_at = time.monotonic()
+
+	@contextlib.contextmanager
+	def _span(self, name: str, attributes: dict[str, Any]) -> Iterator[None]:
+		start = time.monotonic()
+		error = None
+		try:
+			yield
+		except BaseException as e:
+			error = type(e).__name__
+			raise
+		finally:
+			span = {
+				"name": name,
+				"start": round(start - self._started_at, 6),
+				"duration": round(time.monotonic() - start, 6),
+				**attributes,
+			}
+			if error is not None:
+				span["error"] = error
+			with self._lock:
+				self._spans.append(span)
+
+	def span(self, name: str, **attributes: Any) -> ContextManager[None]:
+		if self.enabled is False:
+			return _NULL_SPAN
+		return self._span(name, attributes)
+
+	def flush(self, **fields: Any) -> None:
+		if self.enabled is False:
+			return
+		with self._lock:
+			spans, self._spans = self._spans, []
+		record = {
+			"event": "login_timing",
+			"time": time.time(),
+			"pid": os.getpid(),
+			"total": round(time.monotonic() - self._started_at, 6),
+			**fields,
+			"spans": spans,
+		}
+		line = json.dumps(record)
+		if self._output is None:
+			self._logger.info("%s", line)
+			return
+		try:
+			with open(self._output, "a") as f:
+				f.write(line + "\n")
+		except OSError as e:
+			self._logger.warning("Failed to write timing to %s: %s", self._output, e)
+
+
+_tracer = Tracer()
+
+
+def configure(settings: Settings) -> None:
+	global _tracer
+	_tracer = Tracer(settings.timing_enabled, settings.timing_output)
+
+
+def span(name: str, **attributes: Any) -> ContextManager[None]:
+	return _tracer.span(name, **attributes)
+
+
+def flush(**fields: Any) -> None:
+	_tracer.flush(**fields)